@@ -0,0 +1,403 @@
+"""Нагрузочный прогон бота: синтетические или записанные потоки обновлений через настоящий Dispatcher.
+
+Сеть не используется: Bot из bot.py получает поддельный транспорт, который отвечает
+как Telegram и считает вызовы API. Данные, лог и хранилища — во временном каталоге.
+
+	python bench_replay.py                       # все сценарии
+	python bench_replay.py --scenario duel_fans --fans 500 --rate 0
+	python bench_replay.py --replay updates.jsonl --rate 50
+
+Сценарии:
+	poll_rush          — утренний наплыв голосов в только что открытый опрос (+ /status от части игроков)
+	summary_penalties  — итоги опроса с 30 игроками «Под вопросом» (таймауты и уведомления)
+	duel_fans          — дуэль с сотнями болельщиков, жмущих duel_fan
+	replay             — поток сырых обновлений из JSONL-файла (одно обновление Telegram на строку)
+
+Результат (updates/s, перцентили по обработчикам, байты записи, число вызовов API)
+пишется в JSON (--out), чтобы сравнивать прогоны между собой.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+WORKDIR = tempfile.mkdtemp(prefix="bench_")
+# До импорта bot: никаких файлов в рабочем каталоге, лога в консоль и сетевых хранилищ
+for _key, _value in (
+	("IGNORE_LOCK", "1"),
+	("LOCK_FILE", os.path.join(WORKDIR, "bot.lock")),
+	("DATA_FILE", os.path.join(WORKDIR, "bot_data.json")),
+	("SQLITE_FILE", os.path.join(WORKDIR, "bot_data.sqlite3")),
+	("TENANTS_FILE", os.path.join(WORKDIR, "tenants.json")),
+	("LOG_FILE", os.path.join(WORKDIR, "bot.log")),
+	("LOG_LEVEL", "WARNING"),
+	("SCHEDULER_DB", ""),
+	("OPENWEATHER_API_KEY", ""),
+):
+	os.environ.setdefault(_key, _value)
+
+from aiogram import Bot, Dispatcher, types
+
+import bot as app
+import clock
+import duels
+import tenants
+from metrics import STORAGE_BYTES
+from perf import PerfTracker
+from polls import CATEGORY_MAYBE
+from tg_utils import start_outbound_dispatcher, stop_outbound_dispatcher
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+USER_ID_BASE = 500000
+
+class FakeTransport:
+	"""Подменяет Bot.request: отвечает правдоподобными объектами и считает вызовы по методам."""
+
+	def __init__(self, latency: float = 0.0) -> None:
+		self.latency = latency
+		self.calls: Counter = Counter()
+		self._message_id = 1000
+		self._poll_id = 0
+
+	def reset(self) -> None:
+		self.calls.clear()
+
+	def _message(self, data: Dict[str, Any], **extra: Any) -> Dict[str, Any]:
+		self._message_id += 1
+		chat_id = int(data.get("chat_id", 0))
+		msg = {
+			"message_id": self._message_id,
+			"date": int(clock.time()),
+			"chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+			"from": BOT_USER,
+		}
+		if "text" in data:
+			msg["text"] = data["text"]
+		msg.update(extra)
+		return msg
+
+	async def request(self, method: str, data: Optional[Dict[str, Any]] = None, files: Any = None, **kwargs: Any) -> Any:
+		self.calls[method] += 1
+		if self.latency:
+			await asyncio.sleep(self.latency)
+		data = data or {}
+		if method == "getMe":
+			return BOT_USER
+		if method == "sendPoll":
+			options = data.get("options") or []
+			if isinstance(options, str):
+				options = json.loads(options)
+			self._poll_id += 1
+			poll = {
+				"id": f"bench{self._poll_id}",
+				"question": data.get("question", ""),
+				"options": [{"text": str(o), "voter_count": 0} for o in options],
+				"total_voter_count": 0,
+				"is_closed": False,
+				"is_anonymous": False,
+				"type": "regular",
+				"allows_multiple_answers": False,
+			}
+			return self._message(data, poll=poll)
+		if method in ("sendMessage", "sendDocument"):
+			return self._message(data)
+		if method == "editMessageReplyMarkup":
+			return self._message(data)
+		if method == "getChatMember":
+			# Бот — админ с правом ограничивать: таймауты ставятся через restrictChatMember
+			return {"status": "administrator", "user": BOT_USER, "can_restrict_members": True}
+		# pin/unpin, deleteMessage, answerCallbackQuery, restrictChatMember, setWebhook...
+		return True
+
+# -------------------- Обновления --------------------
+_update_id = 0
+
+def _next_update_id() -> int:
+	global _update_id
+	_update_id += 1
+	return _update_id
+
+def user(uid: int) -> Dict[str, Any]:
+	return {"id": uid, "is_bot": False, "first_name": f"Player{uid % 100000}", "username": f"player{uid}"}
+
+def chat(chat_id: int) -> Dict[str, Any]:
+	return {"id": chat_id, "type": "supergroup", "title": "Bench"}
+
+def poll_answer_update(uid: int, poll_id: str, option_ids: List[int]) -> Dict[str, Any]:
+	return {"update_id": _next_update_id(), "poll_answer": {"poll_id": poll_id, "user": user(uid), "option_ids": option_ids}}
+
+def command_update(uid: int, chat_id: int, text: str, reply_to: Optional[int] = None) -> Dict[str, Any]:
+	command = text.split()[0]
+	message = {
+		"message_id": _next_update_id(),
+		"date": int(clock.time()),
+		"chat": chat(chat_id),
+		"from": user(uid),
+		"text": text,
+		"entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+	}
+	if reply_to is not None:
+		message["reply_to_message"] = {"message_id": 1, "date": int(clock.time()), "chat": chat(chat_id), "from": user(reply_to), "text": "..."}
+	return {"update_id": message["message_id"], "message": message}
+
+def callback_update(uid: int, chat_id: int, message_id: int, data: str) -> Dict[str, Any]:
+	update_id = _next_update_id()
+	return {
+		"update_id": update_id,
+		"callback_query": {
+			"id": str(update_id),
+			"from": user(uid),
+			"chat_instance": str(chat_id),
+			"data": data,
+			"message": {"message_id": message_id, "date": int(clock.time()), "chat": chat(chat_id), "from": BOT_USER, "text": "..."},
+		},
+	}
+
+# -------------------- Прогон --------------------
+def _ms(summary: Dict[str, float]) -> Dict[str, float]:
+	return {k: (round(v * 1000, 3) if k != "count" else v) for k, v in summary.items()}
+
+class BenchHarness:
+	"""Бот из bot.py в одном процессе: тенанты, планировщик на паузе, обработчики дуэлей, поддельный транспорт."""
+
+	def __init__(self, latency: float = 0.0, rate_limits: bool = False) -> None:
+		self.transport = FakeTransport(latency)
+		self.rate_limits = rate_limits
+		self.tracker = PerfTracker(size=100000)
+
+	async def setup(self) -> None:
+		app.bot.request = self.transport.request
+		Bot.set_current(app.bot)
+		Dispatcher.set_current(app.dp)
+		loop = asyncio.get_running_loop()
+		app.MAIN_LOOP = loop
+		app.scheduler = app._create_scheduler()
+		# Планировщик не запускает задания: замеряется только обработка обновлений
+		app.scheduler.start(paused=True)
+		if self.rate_limits:
+			start_outbound_dispatcher()
+		app._setup_tenants()
+		for t in tenants.registry:
+			t.start()
+		app.setup_duel_handlers(app.dp, app.bot, app.scheduler, app.safe_telegram_call, lambda: False, loop)
+		duels.start_timeout_manager(app.bot)
+		# Свой трекер без ограничения по кольцу: перцентили по всему сценарию
+		for middleware in app.dp.middleware.applications:
+			if hasattr(middleware, "tracker"):
+				middleware.tracker = self.tracker
+
+	async def teardown(self) -> None:
+		await duels.stop_timeout_managers()
+		for t in tenants.registry:
+			await t.close()
+		if self.rate_limits:
+			await stop_outbound_dispatcher()
+		app.scheduler.shutdown(wait=False)
+
+	@property
+	def tenant(self) -> tenants.Tenant:
+		return tenants.registry.default
+
+	def reset(self) -> None:
+		"""Чистое состояние группы между сценариями."""
+		t = self.tenant
+		for pid in list(t.active_polls):
+			t.active_polls.pop(pid, None)
+			tenants.registry.unregister_poll(pid)
+		st = duels.state_for(t.chat_id)
+		st.active_duel = None
+		st.daily_count.clear()
+		for uid in list(st.timeouts.deadlines):
+			st.timeouts.cancel(uid)
+		self.tracker.reset()
+		self.transport.reset()
+
+	async def feed(self, updates: Iterable[Dict[str, Any]], rate: float) -> Dict[str, Any]:
+		"""Подать обновления с темпом rate в секунду (0 — все сразу) и дождаться обработки."""
+		tasks = []
+		started = time.perf_counter()
+		for n, raw in enumerate(updates):
+			if rate > 0:
+				delay = started + n / rate - time.perf_counter()
+				if delay > 0:
+					await asyncio.sleep(delay)
+			tasks.append(asyncio.create_task(app._process_webhook_update(types.Update(**raw))))
+		await asyncio.gather(*tasks)
+		elapsed = time.perf_counter() - started
+		return {"updates": len(tasks), "seconds": round(elapsed, 4), "updates_per_sec": round(len(tasks) / elapsed, 1) if elapsed else None}
+
+	async def timed(self, coro: Any) -> float:
+		started = time.perf_counter()
+		with tenants.use(self.tenant):
+			await coro
+		return round(time.perf_counter() - started, 4)
+
+	async def report(self, name: str, stream: Dict[str, Any], bytes_before: Dict[str, float], **extra: Any) -> Dict[str, Any]:
+		await self.tenant.flush()
+		return {
+			"scenario": name,
+			**stream,
+			"update_latency_ms": _ms(self.tracker.summary(self.tracker.updates)),
+			"handlers_ms": {handler: _ms(self.tracker.summary(ring)) for handler, ring in sorted(self.tracker.handlers.items())},
+			"slow_updates": self.tracker.slow,
+			"api_calls": dict(sorted(self.transport.calls.items())),
+			"api_calls_total": sum(self.transport.calls.values()),
+			"bytes_written": {kind: int(STORAGE_BYTES.value(kind=kind) - before) for kind, before in bytes_before.items()},
+			**extra,
+		}
+
+def _bytes_now() -> Dict[str, float]:
+	return {kind: STORAGE_BYTES.value(kind=kind) for kind in ("snapshot", "journal")}
+
+async def _open_poll(h: BenchHarness) -> tuple:
+	"""Открыть опрос первого дня расписания; возвращает (poll_id, секунды на start_poll)."""
+	poll = dict(h.tenant.polls_config[0]) if h.tenant.polls_config else {"day": "manual", "question": "Bench?", "options": ["Да ✅", "Нет ❌", "Под вопросом ❔"]}
+	seconds = await h.timed(app.start_poll(poll))
+	return next(reversed(h.tenant.active_polls)), seconds
+
+async def scenario_poll_rush(h: BenchHarness, args: argparse.Namespace) -> Dict[str, Any]:
+	h.reset()
+	before = _bytes_now()
+	poll_id, open_seconds = await _open_poll(h)
+	options = len(h.tenant.active_polls[poll_id]["poll"]["options"])
+	rnd = random.Random(args.seed)
+	updates = []
+	for i in range(args.voters):
+		uid = USER_ID_BASE + i
+		updates.append(poll_answer_update(uid, poll_id, [rnd.randrange(options)]))
+		if rnd.random() < 0.1:  # передумал: снял голос и проголосовал заново
+			updates.append(poll_answer_update(uid, poll_id, []))
+			updates.append(poll_answer_update(uid, poll_id, [rnd.randrange(options)]))
+		if i % 25 == 0:
+			updates.append(command_update(uid, h.tenant.chat_id, "/status"))
+	stream = await h.feed(updates, args.rate)
+	return await h.report("poll_rush", stream, before, poll_open_seconds=open_seconds, voters=args.voters)
+
+async def scenario_summary_penalties(h: BenchHarness, args: argparse.Namespace) -> Dict[str, Any]:
+	h.reset()
+	before = _bytes_now()
+	poll_id, _ = await _open_poll(h)
+	data = h.tenant.active_polls[poll_id]
+	categories = data["categories"]
+	maybe_idx = categories.index(CATEGORY_MAYBE) if CATEGORY_MAYBE in categories else len(categories) - 1
+	others = [i for i in range(len(categories)) if i != maybe_idx] or [0]
+	updates = [poll_answer_update(USER_ID_BASE + i, poll_id, [maybe_idx]) for i in range(args.penalized)]
+	updates += [poll_answer_update(USER_ID_BASE + args.penalized + i, poll_id, [others[i % len(others)]]) for i in range(args.voters)]
+	stream = await h.feed(updates, args.rate)
+	h.transport.reset()
+	summary_seconds = await h.timed(app.send_summary(poll_id))
+	# Ограничения send_summary ставит фоном — дождёмся их до подсчёта
+	await asyncio.gather(*list(app._background_tasks), return_exceptions=True)
+	timeouts = len(duels.state_for(h.tenant.chat_id).timeouts)
+	return await h.report("summary_penalties", stream, before, summary_seconds=summary_seconds, penalized=timeouts, voters=len(updates))
+
+async def scenario_duel_fans(h: BenchHarness, args: argparse.Namespace) -> Dict[str, Any]:
+	h.reset()
+	before = _bytes_now()
+	chat_id = h.tenant.chat_id
+	challenger, opponent = USER_ID_BASE + 900000, USER_ID_BASE + 900001
+	setup = await h.feed([command_update(challenger, chat_id, "/duel", reply_to=opponent)], 0)
+	st = duels.state_for(chat_id)
+	if not st.active_duel:
+		raise RuntimeError("Duel was not created — check DUEL settings")
+	await h.feed([callback_update(opponent, chat_id, 1, f"duel_accept:{challenger}")], 0)
+	message_id = st.active_duel.get("betting_message_id") or 1
+	h.tracker.reset()
+	h.transport.reset()
+	sides = (challenger, opponent)
+	updates = [callback_update(USER_ID_BASE + i, chat_id, message_id, f"duel_fan:{sides[i % 2]}") for i in range(args.fans)]
+	stream = await h.feed(updates, args.rate)
+	fans = len(st.active_duel.get("challenger_fans", ())) + len(st.active_duel.get("opponent_fans", ()))
+	st.active_duel = None
+	return await h.report("duel_fans", stream, before, fans=fans, setup_seconds=setup["seconds"])
+
+async def scenario_replay(h: BenchHarness, args: argparse.Namespace) -> Dict[str, Any]:
+	h.reset()
+	before = _bytes_now()
+	with open(args.replay, "r", encoding="utf-8") as f:
+		updates = [json.loads(line) for line in f if line.strip()]
+	stream = await h.feed(updates, args.rate)
+	return await h.report("replay", stream, before, source=os.path.basename(args.replay))
+
+SCENARIOS = {
+	"poll_rush": scenario_poll_rush,
+	"summary_penalties": scenario_summary_penalties,
+	"duel_fans": scenario_duel_fans,
+}
+
+def _print_result(result: Dict[str, Any]) -> None:
+	lat = result["update_latency_ms"]
+	print(f"{result['scenario']}: {result['updates']} updates in {result['seconds']}s ({result['updates_per_sec']}/s), "
+		f"p50 {lat['p50']} ms, p95 {lat['p95']} ms, p99 {lat['p99']} ms, API calls {result['api_calls_total']}, "
+		f"bytes {result['bytes_written']}")
+	for name, s in sorted(result["handlers_ms"].items(), key=lambda item: item[1]["p95"], reverse=True)[:5]:
+		print(f"    {name}: n={s['count']} p50={s['p50']} p95={s['p95']} p99={s['p99']} ms")
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+	h = BenchHarness(latency=args.api_latency, rate_limits=args.rate_limits)
+	await h.setup()
+	results = []
+	try:
+		if args.replay:
+			names = ["replay"]
+		elif args.scenario == "all":
+			names = list(SCENARIOS)
+		else:
+			names = [args.scenario]
+		for name in names:
+			func = scenario_replay if name == "replay" else SCENARIOS[name]
+			result = await func(h, args)
+			_print_result(result)
+			results.append(result)
+	finally:
+		await h.teardown()
+	return {
+		"generated_at": datetime.now().isoformat(timespec="seconds"),
+		"python": platform.python_version(),
+		"config": {k: v for k, v in vars(args).items() if k != "out"},
+		"results": results,
+	}
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--scenario", choices=["all"] + list(SCENARIOS), default="all")
+	parser.add_argument("--replay", help="JSONL с сырыми обновлениями Telegram вместо синтетических сценариев")
+	parser.add_argument("--rate", type=float, default=200.0, help="обновлений в секунду (0 — все сразу)")
+	parser.add_argument("--voters", type=int, default=300, help="число голосующих в poll_rush и summary_penalties")
+	parser.add_argument("--penalized", type=int, default=30, help="игроков 'Под вопросом' в summary_penalties")
+	parser.add_argument("--fans", type=int, default=200, help="болельщиков в duel_fans")
+	parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа поддельного Telegram, с")
+	parser.add_argument("--rate-limits", action="store_true", help="пропускать вызовы через OutboundDispatcher с лимитами Telegram")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--out", default="bench_results.json", help="куда записать результаты (JSON)")
+	return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+	args = parse_args(argv)
+	try:
+		report = asyncio.run(run(args))
+	finally:
+		shutil.rmtree(WORKDIR, ignore_errors=True)
+	with open(args.out, "w", encoding="utf-8") as f:
+		json.dump(report, f, ensure_ascii=False, indent=2)
+	print(f"Results written to {args.out}")
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
+
+
+
+
+
@@ -14,6 +14,8 @@ import asyncio
 import logging
 import signal
 import atexit
+import hmac
+import hashlib
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, Dict, Any
 
@@ -22,11 +24,14 @@ try:
 except Exception:
     psutil = None
 
-from logging.handlers import RotatingFileHandler
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import ParseMode
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.utils import exceptions
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
 from pytz import timezone
 from dotenv import load_dotenv
@@ -38,15 +43,23 @@ import random
 from typing import List
 
 from ux import format_status_overview
-from weather import get_weather_forecast, pick_weather_message
+from weather import WeatherClient, pick_weather_message
 from state import now_tz, iso_now, WEEKDAY_MAP, KALININGRAD_TZ, normalize_day_key
-from persistence import save_data as _persist_save, load_data as _persist_load
-from scheduling import compute_poll_close_dt, compute_next_poll_datetime as _compute_next_poll_datetime
-from tg_utils import safe_telegram_call
-from scheduler_setup import setup_scheduler_jobs
+from storage import create_storage
+from scheduling import build_occurrence
+from tg_utils import safe_telegram_call, start_outbound_dispatcher, stop_outbound_dispatcher, start_delete_queue, stop_delete_queue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, TG_GLOBAL_RATE
+from scheduler_setup import setup_scheduler_jobs, upsert_job, register_job_handler, reconcile_jobs, PERSISTENT_JOBSTORE
+from jobstore import SQLiteJobStore
 from handlers_setup import setup_error_handler
-from polls import find_last_active_poll, format_poll_votes
+from logging_setup import setup_logging
+from polls import find_last_active_poll, format_poll_votes, option_categories, categorize_answer, is_penalized_answer, CATEGORY_YES, CATEGORY_NO, CATEGORY_MAYBE
 from duels import setup_duel_handlers, is_user_in_timeout, remove_timeout, username_to_userid, set_duels_enabled, get_duels_enabled, enforce_timeout
+import duels
+import tenants
+import sharding
+import metrics
+import perf
+import clock
 
  
 
@@ -72,29 +85,59 @@ except Exception:
     sys.exit(1)
 
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "12f9f68ba8b0f873901522977cf20b5a")
+# Сколько секунд прогноз считается свежим; старый прогноз отдаётся сразу и обновляется в фоне
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "1800"))
+# За сколько минут до опроса/итогов планировщик прогревает кэш прогноза
+WEATHER_PREFETCH_MINUTES = int(os.getenv("WEATHER_PREFETCH_MINUTES", "5"))
 
 DATA_FILE = os.getenv("DATA_FILE", "bot_data.json")
+# Список обслуживаемых групп (JSON: [{"chat_id": ..., "polls": [...]}, ...]); без файла — только TG_CHAT_ID
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+# Журнал голосов: каждое изменение дописывается строкой в DATA_FILE.journal вместо полной перезаписи
+DATA_JOURNAL = os.getenv("DATA_JOURNAL", "1") == "1"
+# Бэкенд хранения: json (DATA_FILE) или sqlite (SQLITE_FILE, с однократной миграцией из DATA_FILE)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot_data.sqlite3")
+# Постоянное хранилище заданий планировщика: пропущенные за время простоя опросы и закрытия догоняются
+# после рестарта; пустое значение — задания только в памяти, как раньше
+SCHEDULER_DB = os.getenv("SCHEDULER_DB", "scheduler_jobs.sqlite3")
 PORT = int(os.getenv("PORT", 8080))
+# Режим webhook: если задан WEBHOOK_URL (публичный адрес сервиса), обновления приходят
+# на keepalive-сервер по WEBHOOK_PATH вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode("utf-8")).hexdigest()[:48]
 LOCK_FILE = os.getenv("LOCK_FILE", "bot.lock")
+TG_API_BASE = os.getenv("TG_API_BASE", "").rstrip("/")
+# Шардирование: при SHARD_COUNT > 1 процесс-супервизор запускает столько воркеров, каждый ведёт свою долю групп
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", "1")))
+# Номер шарда выставляет супервизор; без него процесс — супервизор (или обычный бот при SHARD_COUNT=1)
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.getenv("SHARD_INDEX") else None
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", PORT + 1))
+IS_SHARD_SUPERVISOR = SHARD_COUNT > 1 and SHARD_INDEX is None
+# Потолок паузы между повторами пересылки воркеру, который перезапускается (секунды)
+SHARD_FORWARD_RETRY_MAX = float(os.getenv("SHARD_FORWARD_RETRY_MAX", "30"))
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+# /metrics открыт всем, пока не задан токен (Authorization: Bearer <METRICS_TOKEN>)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Обновления дольше порога (секунды, 0 — не логировать) пишутся в лог как медленные
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "1.0"))
+# Сколько последних замеров на обработчик держать для перцентилей /perf
+PERF_RING_SIZE = int(os.getenv("PERF_RING_SIZE", "1000"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# LOG_JSON=1 — структурированный лог: одна JSON-строка на запись
+LOG_JSON = os.getenv("LOG_JSON", "0").lower() in ("1", "true", "yes")
+# Одинаковые предупреждения пишутся не чаще раза за столько секунд (0 — без схлопывания)
+LOG_DEDUP_SECONDS = float(os.getenv("LOG_DEDUP_SECONDS", "60"))
 
 # -------------------- Logging --------------------
-class StdoutFilter(logging.Filter):
-    def filter(self, record: logging.LogRecord) -> bool:
-        return record.levelno < logging.ERROR
-
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.addFilter(StdoutFilter())
-
-stderr_handler = logging.StreamHandler(sys.stderr)
-stderr_handler.setLevel(logging.ERROR)
-
-file_handler = RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=5, encoding="utf-8")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[file_handler, stdout_handler, stderr_handler],
+# Записи уходят в очередь, в файл и stdout/stderr их пишет фоновый поток (см. logging_setup)
+setup_logging(
+    LOG_FILE,
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    json_format=LOG_JSON,
+    dedup_interval=LOG_DEDUP_SECONDS,
 )
 
 log = logging.getLogger("bot")
@@ -151,24 +194,27 @@ def ensure_single_instance(lock_path: str = LOCK_FILE) -> None:
 
     atexit.register(_cleanup)
 
-ensure_single_instance()
+# У каждого шарда свой лок: воркеры разных шардов не мешают друг другу, два воркера одного шарда — не запустятся
+ensure_single_instance(sharding.shard_path(LOCK_FILE, SHARD_INDEX) if SHARD_INDEX is not None else LOCK_FILE)
 
 # -------------------- Bot, scheduler, timezone --------------------
-bot = Bot(token=TOKEN, parse_mode=ParseMode.HTML)
+# TG_API_BASE — другой адрес Bot API (локальный Bot API server или fake_tg_server.py для прогонов)
+bot = Bot(token=TOKEN, parse_mode=ParseMode.HTML, server=TelegramAPIServer.from_base(TG_API_BASE)) if TG_API_BASE else Bot(token=TOKEN, parse_mode=ParseMode.HTML)
 dp = Dispatcher(bot)
+# Время обработки обновлений и обработчиков — для /metrics и /perf
+perf_tracker = perf.PerfTracker(PERF_RING_SIZE)
+dp.middleware.setup(perf.TimingMiddleware(perf_tracker, slow_threshold=SLOW_UPDATE_SECONDS))
+# Каждое обновление обрабатывается в контексте своей группы (по chat.id или poll_id); чужие чаты отсекаются
+dp.middleware.setup(tenants.TenantMiddleware(lambda user_id: is_admin(user_id)))
 
 # Планировщик создадим внутри main(), чтобы он корректно работал в том же event loop, что и aiogram
 scheduler: Optional[AsyncIOScheduler] = None
 MAIN_LOOP: Optional[asyncio.AbstractEventLoop] = None
 
 
-START_TIME = datetime.now()
+START_TIME = clock.now()
 
-# runtime state
-active_polls: Dict[str, Dict[str, Any]] = {}
-stats: Dict[str, int] = {}
-disabled_days: set = set()
-questionable_reminders_enabled: bool = True
+# runtime state: у каждой группы своё (см. tenants.Tenant); текущая группа — tenants.current()
 
 # -------------------- Mini-game removed --------------------
 
@@ -176,9 +222,9 @@ def _mention(user_id: int, name: str) -> str:
     return f'<a href="tg://user?id={user_id}">{html.escape(name)}</a>'
 
 def _now_ts() -> float:
-    return time.time()
+    return clock.time()
 
-# polls config (modifiable)
+# polls config по умолчанию (для основной группы и групп без своего расписания в TENANTS_FILE)
 polls_config = [
     {"day": "tue", "time_poll": "08:00", "time_game": "21:30",
      "question": "⚠️ ФОК 21:30 — сегодня тренировочное занятие! Кто готов и будет?",
@@ -208,38 +254,56 @@ def is_admin(user_id: int) -> bool:
  # normalize_day_key перенесён в app.state
 
 # -------------------- Persistence --------------------
-_next_save_allowed = 0
+SAVE_DEBOUNCE_SECONDS = float(os.getenv("SAVE_DEBOUNCE_SECONDS", "2"))
+
+def _create_tenant(chat_id: int, polls: list) -> tenants.Tenant:
+    """Группа со своим хранилищем: у основной группы — DATA_FILE/SQLITE_FILE, у остальных — с chat_id в имени."""
+    is_default = chat_id == CHAT_ID
+    storage = create_storage(
+        STORAGE_BACKEND,
+        tenants.tenant_path(DATA_FILE, chat_id, is_default),
+        tenants.tenant_path(SQLITE_FILE, chat_id, is_default),
+        journal=DATA_JOURNAL,
+    )
+    return tenants.Tenant(chat_id, polls, storage, save_debounce=SAVE_DEBOUNCE_SECONDS)
+
+def _setup_tenants() -> None:
+    """Заново создать группы из TENANTS_FILE (вызывается в main(): хранилища привязаны к event loop)."""
+    tenants.registry.clear()
+    for cfg in tenants.load_tenant_configs(TENANTS_FILE, CHAT_ID, polls_config):
+        if SHARD_INDEX is not None and sharding.shard_for(cfg["chat_id"], SHARD_COUNT) != SHARD_INDEX:
+            continue
+        tenants.registry.add(_create_tenant(cfg["chat_id"], cfg["polls"]))
+    log.info("Serving %s chat(s): %s", len(tenants.registry), [t.chat_id for t in tenants.registry])
+
 async def save_data() -> None:
-    global _next_save_allowed
-    if time.time() < _next_save_allowed:
-        return
-    _next_save_allowed = time.time() + 10
+    """Отметить состояние текущей группы изменённым; запись выполнит фоновая задача SaveCoordinator."""
+    tenants.current().saver.mark_dirty()
+
+async def flush_data() -> None:
+    """Немедленно записать все несохранённые изменения текущей группы (снимок и журнал)."""
     try:
-        await _persist_save(DATA_FILE, active_polls, stats, disabled_days, questionable_reminders_enabled)
-        log.debug("Data saved to %s", DATA_FILE)
+        await tenants.current().flush()
     except Exception:
         log.exception("Failed to save data")
 
+def record_change(op: str, **fields: Any) -> None:
+    """Зафиксировать изменение состояния текущей группы."""
+    tenants.current().record(op, **fields)
+
 async def load_data() -> None:
-    global active_polls, stats
-    if os.path.exists(DATA_FILE):
+    for t in tenants.registry:
         try:
-            ap, st, dd, qrem = await _persist_load(DATA_FILE)
-            active_polls = ap
-            stats = st
-            disabled_days.clear(); disabled_days.update(dd)
-            global questionable_reminders_enabled
-            questionable_reminders_enabled = bool(qrem)
-            log.info("Loaded data: active_polls=%s, stats=%s, disabled_days=%s", len(active_polls), len(stats), sorted(list(disabled_days)))
+            await t.load()
+            tenants.registry.index_polls(t)
+            log.info("Loaded data for chat %s: active_polls=%s, stats=%s, disabled_days=%s, duel_timeouts=%s", t.chat_id, len(t.active_polls), len(t.stats), sorted(list(t.disabled_days)), len(t.duels.timeouts))
         except Exception:
-            log.exception("Failed to load data — starting with empty state")
-    else:
-        log.info("No data file found — starting fresh")
+            log.exception("Failed to load data for chat %s — starting with empty state", t.chat_id)
 
 def make_backup() -> None:
     try:
         if os.path.exists(DATA_FILE):
-            bfile = f"bot_data_backup_{datetime.now():%Y%m%d}.json"
+            bfile = f"bot_data_backup_{clock.now():%Y%m%d}.json"
             shutil.copyfile(DATA_FILE, bfile)
             log.info("Backup created: %s", bfile)
     except Exception:
@@ -249,35 +313,56 @@ def make_backup() -> None:
 # safe_telegram_call импортирован из app.telegram
 
 # -------------------- New helpers: compute poll close datetime & scheduling reminders --------------------
-# compute_poll_close_dt импортирован из app.scheduling
+def _scheduled_at(data: Dict[str, Any], key: str) -> Optional[datetime]:
+    """Момент из расписания, сохранённого в опросе при создании (open/game/close/summary)."""
+    value = (data.get("schedule") or {}).get(key)
+    return datetime.fromisoformat(value).astimezone(KALININGRAD_TZ) if value else None
 
 async def send_reminder_if_needed(poll_id: str) -> None:
-    """Send reminder to CHAT_ID if yes_count < 10 for the poll."""
+    """Send reminder to the poll's chat if yes_count < 10 for the poll."""
+    t = tenants.current()
     try:
-        data = active_polls.get(poll_id)
+        data = t.active_polls.get(poll_id)
         if not data or not data.get("active"):
             return
-        votes = data.get("votes", {})
-        yes_users = [v for v in votes.values() if v.get("answer", "").startswith("Да")]
-        if len(yes_users) < 10:
+        yes_count = t.active_polls.tally(poll_id).count(CATEGORY_YES)
+        if yes_count < 10:
             # send reminder
             question = data.get("poll", {}).get("question", "Пожалуйста, проголосуйте!")
             text = f"🔔 Напоминание: <b>{question}</b>\nПожалуйста, проголосуйте — нам нужно как минимум 10 'Да' для подтверждения."
-            await safe_telegram_call(bot.send_message, CHAT_ID, text, parse_mode=ParseMode.HTML)
-            log.info("Reminder sent for poll %s (yes=%s)", poll_id, len(yes_users))
+            await safe_telegram_call(bot.send_message, t.chat_id, text, parse_mode=ParseMode.HTML, priority=PRIORITY_LOW)
+            log.info("Reminder sent for poll %s (yes=%s)", poll_id, yes_count)
     except Exception:
         log.exception("Error in send_reminder_if_needed for poll %s", poll_id)
 
+def _questionable_mentions(votes: Dict[str, Any], tally) -> List[str]:
+    """Упоминания проголосовавших 'Под вопросом': по user_id, иначе по username, иначе просто имя."""
+    mentions = []
+    for key in tally.voters(CATEGORY_MAYBE):
+        v = votes[key]
+        user_id = v.get("user_id")
+        safe_name = html.escape(v.get("name", "Участник"))
+        username = v.get("username")
+        if user_id:
+            mentions.append(f'<a href="tg://user?id={user_id}">{safe_name}</a>')
+        elif username:
+            username_clean = str(username).lstrip("@")
+            mentions.append(f'<a href="https://t.me/{html.escape(username_clean)}">{safe_name}</a>')
+        else:
+            mentions.append(safe_name)
+    return mentions
+
 async def tag_questionable_users(poll_id: str) -> None:
     """
     Tag users who voted 'Под вопросом' (or containing 'Под вопросом' substring).
     Use saved user_id to create mention via tg://user?id=..., or use https://t.me/{username} if username is available,
     otherwise use plain escaped name.
     """
+    t = tenants.current()
     try:
-        if not questionable_reminders_enabled:
+        if not t.questionable_reminders_enabled:
             return
-        data = active_polls.get(poll_id)
+        data = t.active_polls.get(poll_id)
         if not data or not data.get("active"):
             return
         votes = data.get("votes", {})
@@ -298,39 +383,29 @@ async def tag_questionable_users(poll_id: str) -> None:
         mins_left = int((close_dt - now).total_seconds() // 60) if close_dt else None
 
         # Собираем всех 'под вопросом' и отправляем одно общее сообщение (без спама)
-        questionable_mentions = []
-        for v in votes.values():
-            answer = v.get("answer", "")
-            if "под" in answer.lower() or "под вопрос" in answer.lower() or "?" in answer:
-                user_id = v.get("user_id")
-                name = v.get("name", "Участник")
-                username = v.get("username")
-                safe_name = html.escape(name)
-                if user_id:
-                    questionable_mentions.append(f'<a href="tg://user?id={user_id}">{safe_name}</a>')
-                elif username:
-                    username_clean = str(username).lstrip("@")
-                    questionable_mentions.append(f'<a href="https://t.me/{html.escape(username_clean)}">{safe_name}</a>')
-                else:
-                    questionable_mentions.append(safe_name)
+        tally = t.active_polls.tally(poll_id)
+        questionable_mentions = tally.cached("maybe_mentions", lambda: _questionable_mentions(votes, tally))
         if questionable_mentions:
             header = "⚠️ Напоминание участникам 'Под вопросом'"
             left = f"Осталось {mins_left} минут до закрытия." if mins_left is not None else "Скоро закрытие."
             text = f"{header}\n{left}\nПожалуйста, подтвердите участие: " + ", ".join(questionable_mentions)
-            await safe_telegram_call(bot.send_message, CHAT_ID, text, parse_mode=ParseMode.HTML)
+            await safe_telegram_call(bot.send_message, t.chat_id, text, parse_mode=ParseMode.HTML, priority=PRIORITY_LOW)
             log.debug("Tagged %s questionable users for poll %s", len(questionable_mentions), poll_id)
     except Exception:
         log.exception("Error in tag_questionable_users for poll %s", poll_id)
 
-def schedule_poll_reminders(poll_id: str) -> None:
+def schedule_poll_reminders(poll_id: str, restore: bool = False) -> None:
     """
     Schedule the two kinds of jobs for the given poll:
       - every 3 hours reminder if yes<10 (from start until close)
       - every 30 minutes tagging 'Под вопросом' users from close-2h until close
     Store close_dt in active_polls[poll_id]['close_dt'] as ISO.
+    With restore=True (startup) jobs already in the persistent job store are kept and
+    the stored close_dt is reused, so a close missed during downtime is caught up.
     """
+    t = tenants.current()
     try:
-        data = active_polls.get(poll_id)
+        data = t.active_polls.get(poll_id)
         if not data:
             return
         poll = data.get("poll", {})
@@ -339,33 +414,14 @@ def schedule_poll_reminders(poll_id: str) -> None:
         if scheduler is None:
             log.error("Scheduler not initialized!")
             return
-        loop = MAIN_LOOP
         start_dt = now_tz()
-        # Вычислим close_dt: при наличии manual_close_* используем их, иначе общую логику
         mclose_day = poll.get("manual_close_day")
         mclose_time = poll.get("manual_close_time")
-        if mclose_day or mclose_time:
-            try:
-                c_day = mclose_day or poll.get("day")
-                tg = (mclose_time or poll.get("time_game", "23:59"))
-                tg_hour, tg_minute = map(int, tg.split(":"))
-                target = WEEKDAY_MAP.get(c_day, None)
-                if target is None:
-                    close_dt = start_dt + timedelta(hours=24)
-                else:
-                    days_ahead = (target - start_dt.weekday()) % 7
-                    base_date = start_dt.date() + timedelta(days=days_ahead)
-                    base = datetime(base_date.year, base_date.month, base_date.day, tg_hour, tg_minute)
-                    close_dt = KALININGRAD_TZ.localize(base) if base.tzinfo is None else base.astimezone(KALININGRAD_TZ)
-                    if close_dt <= start_dt:
-                        close_dt = close_dt + timedelta(days=7)
-            except Exception:
-                close_dt = start_dt + timedelta(hours=24)
+        if restore and data.get("close_dt"):
+            close_dt = datetime.fromisoformat(data["close_dt"]).astimezone(KALININGRAD_TZ)
         else:
-            close_dt = compute_poll_close_dt(poll, start_dt)
-        # safety: ensure at least 2 hours duration, otherwise fallback to start+24h
-        if close_dt <= start_dt + timedelta(minutes=5):
-            close_dt = start_dt + timedelta(hours=24)
+            # Время закрытия посчитано движком расписания при создании опроса (учитывает manual_close_*)
+            close_dt = _scheduled_at(data, "close") or build_occurrence(poll, start_dt).close_dt
 
         # store close timestamp for later use by tag job
         try:
@@ -379,19 +435,12 @@ def schedule_poll_reminders(poll_id: str) -> None:
         close_job_id = f"close_{poll_id}"
 
         # schedule reminder каждые 3 часа только если это вт/чт и нет ручного закрытия
-        if poll.get("day") in ("tue", "thu") and not (mclose_day or mclose_time):
+        if poll.get("day") in ("tue", "thu") and not (mclose_day or mclose_time) and start_dt < close_dt:
             try:
-                try:
-                    scheduler.remove_job(reminder_job_id)
-                except Exception:
-                    pass
-                scheduler.add_job(
-                    lambda pid=poll_id: asyncio.run_coroutine_threadsafe(send_reminder_if_needed(pid), loop),
-                    trigger="interval",
-                    hours=3,
-                    start_date=start_dt,
-                    end_date=close_dt,
-                    id=reminder_job_id,
+                upsert_job(
+                    scheduler, reminder_job_id, "reminder", "reminder", (t.chat_id, poll_id),
+                    IntervalTrigger(hours=3, start_date=start_dt, end_date=close_dt, timezone=KALININGRAD_TZ),
+                    keep_existing=restore,
                 )
                 log.info("Scheduled 3h reminders for poll %s from %s to %s", poll_id, start_dt, close_dt)
             except Exception:
@@ -402,107 +451,109 @@ def schedule_poll_reminders(poll_id: str) -> None:
         try:
             tag_start = max(start_dt, close_dt - timedelta(hours=2))
             interval_minutes = 20
-            try:
-                scheduler.remove_job(tag_job_id)
-            except Exception:
-                pass
-            scheduler.add_job(
-                lambda pid=poll_id: asyncio.run_coroutine_threadsafe(tag_questionable_users(pid), loop),
-                trigger="interval",
-                minutes=interval_minutes,
-                start_date=tag_start,
-                end_date=close_dt,
-                id=tag_job_id,
-            )
+            if tag_start < close_dt:
+                upsert_job(
+                    scheduler, tag_job_id, "tagq", "tag_questionable", (t.chat_id, poll_id),
+                    IntervalTrigger(minutes=interval_minutes, start_date=tag_start, end_date=close_dt, timezone=KALININGRAD_TZ),
+                    keep_existing=restore,
+                )
             log.info("Scheduled tagging (20m) for poll %s from %s to %s", poll_id, tag_start, close_dt)
         except Exception:
             log.exception("Failed to schedule tagging for poll %s", poll_id)
         # Автоматическое закрытие опроса — добавить после всех scheduler.add_job
         try:
-            try:
-                scheduler.remove_job(close_job_id)
-            except Exception:
-                pass
-            scheduler.add_job(
-                lambda pid=poll_id: asyncio.run_coroutine_threadsafe(send_summary(pid), loop),
-                trigger="date",
-                run_date=close_dt,
-                id=close_job_id,
+            upsert_job(
+                scheduler, close_job_id, "close", "close_poll", (t.chat_id, poll_id),
+                DateTrigger(run_date=close_dt, timezone=KALININGRAD_TZ),
+                keep_existing=restore,
             )
             log.info("Scheduled auto-close for poll %s at %s", poll_id, close_dt)
         except Exception:
             log.exception("Failed to schedule auto-close for poll %s", poll_id)
-        asyncio.run_coroutine_threadsafe(save_data(), loop)
+        t.saver.mark_dirty()
     except Exception:
         log.exception("Error in schedule_poll_reminders for poll %s", poll_id)
 
 # -------------------- Poll lifecycle --------------------
 # -------------------- Weather forecast --------------------
+WEATHER_CITY = "Zelenogradsk, Kaliningradskaya oblast, RU"
+# Одна сессия и кэш прогнозов на всё время работы бота; закрывается в shutdown()
+weather_client = WeatherClient(OPENWEATHER_API_KEY, ttl=WEATHER_CACHE_TTL)
+
 async def _get_weather(target_dt: datetime) -> Optional[str]:
-    """Адаптер для app.weather.get_weather_forecast с текущим ключом и городом."""
-    if not get_weather_forecast:
-        return None
-    city = "Zelenogradsk, Kaliningradskaya oblast, RU"
-    return await get_weather_forecast(city, OPENWEATHER_API_KEY, target_dt)
+    """Прогноз на момент target_dt для города игры — только из памяти.
+
+    Кэш заранее прогревает _prefetch_weather; при промахе загрузка уходит в фон,
+    а опрос/итоги публикуются без погоды, не дожидаясь OpenWeather.
+    """
+    forecast = await weather_client.get_forecast(WEATHER_CITY, target_dt, cache_only=True)
+    log.debug("Weather read for %s: %s (stats: %s)", target_dt, "cached" if forecast else "miss", weather_client.stats)
+    return forecast
+
+async def _prefetch_weather(poll: Optional[Dict[str, Any]] = None) -> None:
+    """Прогреть кэш прогноза перед опросом или итогами (для вторника погода не показывается)."""
+    if not weather_client.api_key:
+        # Без ключа погоды нет вовсе — об этом main() уже предупредил админа
+        return
+    if poll is not None and poll.get("day") == "tue":
+        return
+    if not await weather_client.prefetch(WEATHER_CITY):
+        log.warning("Weather prefetch failed for %s", WEATHER_CITY)
+
 async def start_poll(poll: Dict[str, Any], from_admin: bool = False) -> None:
     """Create and register a poll. Ensures options count fits Telegram limits."""
+    t = tenants.current()
     try:
         options = poll.get("options", [])[:10]
         if not options:
             log.warning("Poll has no options, skipping: %s", poll)
             return
-        day = poll.get("day", "manual")
-        now = now_tz()
-        if day != "manual":
-            target_weekday = WEEKDAY_MAP.get(day, None)
-            hour, minute = map(int, poll.get("time_game", now.strftime('%H:%M')).split(':'))
-            today_weekday = now.weekday()
-            days_until_target = (target_weekday - today_weekday) % 7
-            target_date = now.date() + timedelta(days=days_until_target)
-            # локализация через pytz
-            game_dt_naive = datetime(target_date.year, target_date.month, target_date.day, hour, minute)
-            game_dt = KALININGRAD_TZ.localize(game_dt_naive)
-        else:
-            game_dt = now
-        weather = await _get_weather(game_dt) if poll.get("day") != "tue" else None
+        # Все моменты опроса (игра, закрытие, итоги) — из движка расписания, один раз на опрос
+        occ = t.schedule.occurrence_for(poll)
+        weather = await _get_weather(occ.game_dt) if poll.get("day") != "tue" else None
         msg = await safe_telegram_call(
             bot.send_poll,
-            chat_id=CHAT_ID,
+            chat_id=t.chat_id,
             question=poll["question"],
             options=options,
             is_anonymous=False,
             allows_multiple_answers=False,
+            priority=PRIORITY_HIGH,
         )
         if not msg:
             log.error("send_poll returned None — poll not created: %s", poll.get("question"))
             return
         try:
-            await safe_telegram_call(bot.pin_chat_message, CHAT_ID, msg.message_id, disable_notification=True)
+            await safe_telegram_call(bot.pin_chat_message, t.chat_id, msg.message_id, disable_notification=True, priority=PRIORITY_HIGH)
             pinned_message_id = msg.message_id
             log.info("Pinned poll message %s", msg.message_id)
         except Exception as e:
             pinned_message_id = None
             log.exception("Failed to pin poll message: %s", e)
         poll_id = msg.poll.id
-        active_polls[poll_id] = {
+        t.active_polls[poll_id] = {
             "message_id": msg.message_id,
             "pinned_message_id": pinned_message_id,
             "poll": poll,
             "votes": {},
+            "categories": option_categories(options),
             "active": True,
             "created_at": iso_now(),
+            "schedule": occ.as_dict(),
         }
-        await save_data()
+        tenants.registry.register_poll(poll_id, t)
+        record_change("poll_open", poll_id=poll_id, entry=t.active_polls[poll_id])
         if weather:
-            await safe_telegram_call(bot.send_message, CHAT_ID, f"<b>Погода на время игры:</b> {weather}", parse_mode=ParseMode.HTML)
-        await safe_telegram_call(bot.send_message, CHAT_ID, "📢 <b>Новый опрос!</b>\nПроголосуйте ☝️", parse_mode=ParseMode.HTML)
+            await safe_telegram_call(bot.send_message, t.chat_id, f"<b>Погода на время игры:</b> {weather}", parse_mode=ParseMode.HTML, priority=PRIORITY_HIGH)
+        await safe_telegram_call(bot.send_message, t.chat_id, "📢 <b>Новый опрос!</b>\nПроголосуйте ☝️", parse_mode=ParseMode.HTML, priority=PRIORITY_HIGH)
         if poll.get("day") == "tue":
             await safe_telegram_call(
                 bot.send_message,
-                CHAT_ID,
+                t.chat_id,
                 "❗️<b>ФОК • СТАРТ РОВНО В 21:30</b>\n"
                 "Переобуйтесь в сменную обувь в холле <b>ФОКа</b>, а затем заходите в раздевалку.",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_HIGH,
             )
         if from_admin:
             await safe_telegram_call(bot.send_message, ADMIN_ID, f"✅ Опрос вручную: {poll['question']}")
@@ -514,31 +565,35 @@ async def start_poll(poll: Dict[str, Any], from_admin: bool = False) -> None:
     except Exception:
         log.exception("Failed to start poll")
 
-async def _chunk_and_send(chat_id: int, text: str, parse_mode=None) -> None:
+async def _chunk_and_send(chat_id: int, text: str, parse_mode=None, priority: int = PRIORITY_HIGH) -> None:
     """Send text in chunks respecting TELEGRAM_MESSAGE_LIMIT."""
     if not text:
         return
     chunks = [text[i:i+TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)]
     for chunk in chunks:
-        await safe_telegram_call(bot.send_message, chat_id, chunk, parse_mode=parse_mode)
+        await safe_telegram_call(bot.send_message, chat_id, chunk, parse_mode=parse_mode, priority=priority)
 
 async def send_summary(poll_id: str) -> None:
-    data = active_polls.get(poll_id)
+    t = tenants.current()
+    data = t.active_polls.get(poll_id)
     if not data:
         return
     try:
         penalized_users = []  # список (user_id, name) для наказаний 'Под вопросом'
-        data["active"] = False
+        t.active_polls.mark_closed(poll_id)
         votes = data.get("votes", {})
-        yes_users = [html.escape(v["name"]) for v in votes.values() if v["answer"].startswith("Да")]
-        no_users = [html.escape(v["name"]) for v in votes.values() if v["answer"].startswith("Нет")]
-        # Соберём пользователей 'Под вопросом' для возможного наказания
-        for v in votes.values():
-            if str(v.get("answer", "")).lower().startswith("под вопрос"):
-                uid = v.get("user_id")
-                name = v.get("name", "Участник")
-                if uid:
-                    penalized_users.append((uid, name))
+        tally = t.active_polls.tally(poll_id)
+        yes_users, no_users = tally.cached("summary_names", lambda: (
+            [html.escape(votes[k]["name"]) for k in tally.voters(CATEGORY_YES)],
+            [html.escape(votes[k]["name"]) for k in tally.voters(CATEGORY_NO)],
+        ))
+        # Соберём пользователей 'Под вопросом' для возможного наказания (прочие варианты с «?» не наказываются)
+        for k in tally.voters(CATEGORY_MAYBE):
+            v = votes[k]
+            uid = v.get("user_id")
+            name = v.get("name", "Участник")
+            if uid and is_penalized_answer(v.get("answer", "")):
+                penalized_users.append((uid, name))
         day = data["poll"].get("day")
         if day == "fri":
             status = (
@@ -567,18 +622,7 @@ async def send_summary(poll_id: str) -> None:
                     if total_yes < 10 else
                     "✅ Сегодня собираемся на песчанке! ⚽"
                 )
-        day = data["poll"].get("day", "manual")
-        now = now_tz()
-        if day != "manual":
-            target_weekday = WEEKDAY_MAP.get(day, None)
-            hour, minute = map(int, data["poll"].get("time_game", now.strftime('%H:%M')).split(':'))
-            today_weekday = now.weekday()
-            days_until_target = (target_weekday - today_weekday) % 7
-            target_date = now.date() + timedelta(days=days_until_target)
-            game_dt_naive = datetime(target_date.year, target_date.month, target_date.day, hour, minute)
-            game_dt = KALININGRAD_TZ.localize(game_dt_naive)
-        else:
-            game_dt = now
+        game_dt = _scheduled_at(data, "game") or build_occurrence(data["poll"], now_tz()).game_dt
         include_weather = data["poll"].get("day") != "tue"
         weather = await _get_weather(game_dt) if include_weather else None
         weather_str = ""
@@ -603,27 +647,29 @@ async def send_summary(poll_id: str) -> None:
             f"❌ Нет ({len(no_users)}): {', '.join(no_users) or '—'}\n\n"
             f"{status}" + weather_str + captains_text
         )
-        await _chunk_and_send(CHAT_ID, text, parse_mode=ParseMode.HTML)
+        await _chunk_and_send(t.chat_id, text, parse_mode=ParseMode.HTML)
         pin_id = data.get("pinned_message_id") or data.get("message_id")
         if pin_id:
             try:
-                await safe_telegram_call(bot.unpin_chat_message, CHAT_ID, pin_id)
+                await safe_telegram_call(bot.unpin_chat_message, t.chat_id, pin_id, priority=PRIORITY_HIGH)
                 log.info("Unpinned poll message %s", pin_id)
             except Exception as e:
                 log.exception("Failed to unpin poll message: %s", e)
 
         # update stats safely (only votes with user_id)
-        for v in votes.values():
+        stats_changed: Dict[str, Any] = {}
+        for key, v in votes.items():
             if not v.get("user_id"):
                 continue
             user_id = str(v["user_id"])
             name = v.get("name", "")
-            if user_id not in stats:
-                stats[user_id] = {"name": name, "count": 0}
-            if stats[user_id]["name"] != name:
-                stats[user_id]["name"] = name
-            if str(v.get("answer", "")).startswith("Да"):
-                stats[user_id]["count"] += 1
+            if user_id not in t.stats:
+                t.stats[user_id] = {"name": name, "count": 0}
+            if t.stats[user_id]["name"] != name:
+                t.stats[user_id]["name"] = name
+            if tally.by_voter.get(key) == CATEGORY_YES:
+                t.stats[user_id]["count"] += 1
+            stats_changed[user_id] = t.stats[user_id]
 
         # remove scheduled reminder/tag jobs for this poll if any
         try:
@@ -648,34 +694,53 @@ async def send_summary(poll_id: str) -> None:
         except Exception:
             log.exception("Failed to remove scheduled jobs for poll %s", poll_id)
 
-        active_polls.pop(poll_id, None)
-        await save_data()
+        t.active_polls.pop(poll_id, None)
+        tenants.registry.unregister_poll(poll_id)
+        record_change("poll_close", poll_id=poll_id, stats=stats_changed)
+        await flush_data()
         log.info("Summary sent for poll: %s", data["poll"].get("question"))
 
         # Наказание за 'Под вопросом' — таймаут на 36 часов (2160 минут)
         if penalized_users:
+            # Сначала сообщение в чат о блокировке
             try:
-                for uid, name in penalized_users:
-                    try:
-                        await enforce_timeout(uid, CHAT_ID, name, scheduler, bot, timeout_minutes=2160)
-                    except Exception:
-                        log.exception("Failed to enforce timeout for maybe user %s", uid)
-                # Сообщение в чат о блокировке
                 mentions = [f'<a href="tg://user?id={uid}">{html.escape(name)}</a>' for uid, name in penalized_users]
                 block_text = (
                     "⛔ <b>Временная блокировка</b>\n"
                     "Следующие пользователи выбрали вариант 'Под вопросом ❔' до конца опроса и временно заблокированы на 36 часов:\n"
                     + (", ".join(mentions) if mentions else "—")
                 )
-                await safe_telegram_call(bot.send_message, CHAT_ID, block_text, parse_mode=ParseMode.HTML)
+                await safe_telegram_call(bot.send_message, t.chat_id, block_text, parse_mode=ParseMode.HTML)
             except Exception:
                 log.exception("Failed to notify about maybe-users punishment")
+            # Ограничения в Telegram — фоном и с низким приоритетом, итоги их не ждут
+            _spawn_background(_enforce_penalties(t.chat_id, penalized_users))
     except Exception:
         log.exception("Failed to send summary for poll: %s", data["poll"].get("question"))
 
+_background_tasks: set = set()
+
+def _spawn_background(coro) -> asyncio.Task:
+    """Запустить корутину фоном, держа ссылку на задачу до её завершения."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def _enforce_penalties(chat_id: int, penalized_users: List[Tuple[Any, str]]) -> None:
+    """Поставить таймауты наказанным за 'Под вопросом' (restrictChatMember идут с PRIORITY_LOW)."""
+    results = await asyncio.gather(
+        *(enforce_timeout(uid, chat_id, name, scheduler, bot, timeout_minutes=2160, priority=PRIORITY_LOW) for uid, name in penalized_users),
+        return_exceptions=True,
+    )
+    for (uid, _), result in zip(penalized_users, results):
+        if isinstance(result, Exception):
+            log.error("Failed to enforce timeout for maybe user %s: %s", uid, result)
+
 # -------------------- Poll answer handling --------------------
 @dp.poll_answer_handler()
 async def handle_poll_answer(poll_answer: types.PollAnswer) -> None:
+    t = tenants.current()
     try:
         uid = poll_answer.user.id
         uname = poll_answer.user.full_name or poll_answer.user.first_name or str(uid)
@@ -686,24 +751,28 @@ async def handle_poll_answer(poll_answer: types.PollAnswer) -> None:
         except Exception:
             pass
         option_ids = poll_answer.option_ids
-        for poll_id, data in list(active_polls.items()):
-            if poll_answer.poll_id == poll_id:
-                if not option_ids:
-                    data["votes"].pop(str(uid), None)
-                else:
-                    answer = data["poll"]["options"][option_ids[0]]
-                    # --- Сохраняем user_id и username для корректных упоминаний позже ---
-                    username = getattr(poll_answer.user, "username", None)
-                    data["votes"][str(uid)] = {
-                        "name": uname,
-                        "answer": answer,
-                        "user_id": uid,
-                        "username": username,
-                    }
-                # save asynchronously (fire-and-forget)
-                asyncio.run_coroutine_threadsafe(save_data(), MAIN_LOOP)
-                log.debug("Vote saved: %s -> %s", uname, data["votes"].get(str(uid)))
-                return
+        poll_id = poll_answer.poll_id
+        data = t.active_polls.get(poll_id)
+        if data is None:
+            return
+        if not option_ids:
+            t.active_polls.remove_vote(poll_id, str(uid))
+            record_change("unvote", poll_id=poll_id, user=str(uid))
+        else:
+            idx = option_ids[0]
+            answer = data["poll"]["options"][idx]
+            categories = data.get("categories") or []
+            # --- Сохраняем user_id и username для корректных упоминаний позже ---
+            username = getattr(poll_answer.user, "username", None)
+            t.active_polls.set_vote(poll_id, str(uid), {
+                "name": uname,
+                "answer": answer,
+                "category": categories[idx] if idx < len(categories) else categorize_answer(answer),
+                "user_id": uid,
+                "username": username,
+            })
+            record_change("vote", poll_id=poll_id, user=str(uid), vote=data["votes"][str(uid)])
+        log.debug("Vote saved: %s -> %s", uname, data["votes"].get(str(uid)))
     except Exception:
         log.exception("Error handling poll answer")
 
@@ -721,6 +790,7 @@ async def cmd_commands(message: types.Message) -> None:
         "/status — показать текущий опрос",
         "/stats — статистика «Да ✅»",
         "/nextpoll — когда следующий опрос",
+        "/schedule — расписание опросов и игр на ближайшие недели",
         "/uptime — время работы бота",
         "/duel — вызвать соперника на дуэль (ответьте на сообщение и напишите /duel)",
         "/commands — справка",
@@ -739,6 +809,7 @@ async def cmd_commands(message: types.Message) -> None:
             "/disablepoll &lt;день&gt; — отключить автоопрос (напр. вт/thu)",
             "/enablepoll &lt;день&gt; — включить автоопрос",
             "/pollsstatus — показать отключённые дни",
+            "/perf — время обработки обновлений (p50/p95/p99)",
             "/remind [текст] — напомнить об опросе",
             "/notify Текст — оповестить всех 'Да ✅'",
             "/say Текст — отправить сообщение от имени бота",
@@ -762,30 +833,62 @@ async def cmd_nextpoll(message: types.Message) -> None:
         log.exception("Error in /nextpoll")
         await message.reply("⚠️ Ошибка при определении следующего опроса. Проверьте логи.")
 
+SCHEDULE_PREVIEW = 6
+
+def _fmt_dt(dt: datetime) -> str:
+    return dt.strftime("%d.%m %H:%M")
+
+@dp.message_handler(commands=["schedule"])
+async def cmd_schedule(message: types.Message) -> None:
+    """Ближайшие запуски опросов: открытие, закрытие, итоги и игра."""
+    t = tenants.current()
+    items = t.schedule.upcoming(limit=SCHEDULE_PREVIEW)
+    if not items:
+        return await message.reply("ℹ️ Нет запланированных опросов.")
+    lines = ["🗓 <b>Ближайшие опросы</b>"]
+    for occ in items:
+        lines.append("")
+        lines.append(f"<b>{html.escape(occ.poll.get('question', ''))}</b>")
+        lines.append(f"Опрос: {_fmt_dt(occ.open_dt)} → закрытие {_fmt_dt(occ.close_dt)}")
+        game_line = f"Игра: {_fmt_dt(occ.game_dt)}"
+        if occ.summary_dt:
+            game_line += f", итоги: {_fmt_dt(occ.summary_dt)}"
+        lines.append(game_line)
+        if occ.reminders:
+            lines.append(f"Напоминаний: {len(occ.reminders)}, теги 'Под вопросом' с {occ.tag_start.strftime('%H:%M')}")
+    await _chunk_and_send(message.chat.id, "\n".join(lines), parse_mode=ParseMode.HTML, priority=PRIORITY_NORMAL)
+
 @dp.message_handler(commands=["status"])
 async def cmd_status(message: types.Message) -> None:
-    last = find_last_active_poll(active_polls)
+    t = tenants.current()
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Активных опросов нет.")
-    _, data = last
+    pid, data = last
     poll = data["poll"]
     # Build emoji table: Yes/No/Maybe counts
-    votes = data.get("votes", {})
-    header_line = format_status_overview(data) if format_status_overview else ""
-    header = f"<b>{html.escape(poll['question'])}</b>\n\n" + header_line
-    await message.reply(header + format_poll_votes(data))
+    tally = t.active_polls.tally(pid)
+
+    def _render() -> str:
+        header_line = format_status_overview(data, tally) if format_status_overview else ""
+        header = f"<b>{html.escape(poll['question'])}</b>\n\n" + header_line
+        return header + format_poll_votes(data, tally)
+
+    # Между голосами повторный /status — просто поиск в кэше
+    await message.reply(tally.cached("status", _render))
 
 @dp.message_handler(commands=["stats"])
 async def cmd_stats(message: types.Message) -> None:
-    if not stats:
+    t = tenants.current()
+    if not t.stats:
         return await message.reply("📊 Пока нет статистики.")
-    stats_sorted = sorted(stats.values(), key=lambda x: -x["count"])
+    stats_sorted = await t.storage.top_stats()
     text = "\n".join(f"{row['name']}: {row['count']}" for row in stats_sorted)
     await message.reply(f"📈 Статистика 'Да ✅':\n{text}")
 
 @dp.message_handler(commands=["uptime"])
 async def cmd_uptime(message: types.Message) -> None:
-    uptime = datetime.now() - START_TIME
+    uptime = clock.now() - START_TIME
     hours, remainder = divmod(int(uptime.total_seconds()), 3600)
     minutes = (remainder // 60)
     await message.reply(f"⏱ Бот работает уже {hours} ч {minutes} мин.")
@@ -832,16 +935,17 @@ async def cmd_startpoll(message: types.Message) -> None:
 
 # Вспомогательная для schedule_polls:
 async def send_summary_by_day(poll: dict):
-    for pid, data in list(active_polls.items()):
-        if data["poll"]["day"] == poll["day"] and data.get("active"):
-            await send_summary(pid)
-            break
+    t = tenants.current()
+    found = t.active_polls.active_for_day(poll["day"])
+    if found:
+        await send_summary(found[0])
 
 @dp.message_handler(commands=["closepoll"])
 async def cmd_closepoll(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    last = find_last_active_poll(active_polls)
+    t = tenants.current()
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
     pid, data = last
@@ -852,6 +956,7 @@ async def cmd_closepoll(message: types.Message) -> None:
 async def cmd_addplayer(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     raw = message.get_args()
     if not raw or not raw.strip():
         return await message.reply("Использование: /addplayer Имя1, Имя2; Имя3")
@@ -863,16 +968,16 @@ async def cmd_addplayer(message: types.Message) -> None:
             parts.append(s)
     if not parts:
         return await message.reply("Не найдено имён для добавления.")
-    last = find_last_active_poll(active_polls)
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
     pid, data = last
     added = 0
     for name in parts:
-        key = f"admin_{name}_{int(time.time())}_{added}"
-        data["votes"][key] = {"name": name, "answer": "Да ✅ (добавлен вручную)"}
+        key = f"admin_{name}_{int(_now_ts())}_{added}"
+        t.active_polls.set_vote(pid, key, {"name": name, "answer": "Да ✅ (добавлен вручную)", "category": CATEGORY_YES})
+        record_change("vote", poll_id=pid, user=key, vote=data["votes"][key])
         added += 1
-    await save_data()
     if added == 1:
         await message.reply(f"✅ Игрок '{parts[0]}' добавлен как 'Да ✅'.")
     else:
@@ -882,43 +987,44 @@ async def cmd_addplayer(message: types.Message) -> None:
 async def cmd_removeplayer(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     name = message.get_args().strip()
     if not name:
         return await message.reply("Использование: /removeplayer Имя")
-    last = find_last_active_poll(active_polls)
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
     pid, data = last
     removed = 0
     for uid, v in list(data["votes"].items()):
         if v.get("name") == name:
-            del data["votes"][uid]
+            t.active_polls.remove_vote(pid, uid)
+            record_change("unvote", poll_id=pid, user=uid)
             removed += 1
-    await save_data()
     await message.reply(f"✅ Игрок '{name}' удалён (найдено: {removed}).")
 
 @dp.message_handler(commands=["reload"])
 async def cmd_reload(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    scheduler.remove_all_jobs()
-    schedule_polls()
-    for pid, data in list(active_polls.items()):
-        if data.get("active"):
-            schedule_poll_reminders(pid)
+    t = tenants.current()
+    schedule_polls(t)
+    # Идущие опросы сохраняют свои напоминания и закрытие; восстанавливаются только недостающие задания
+    for pid, _ in t.active_polls.active_items():
+        schedule_poll_reminders(pid, restore=True)
     await message.reply("✅ Расписание обновлено.")
 
 @dp.message_handler(commands=["disablepoll"])
 async def cmd_disablepoll(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     arg = message.get_args().strip()
     day_key = normalize_day_key(arg)
     if not day_key:
         return await message.reply("Использование: /disablepoll <день недели> (напр. вт, thu)")
-    disabled_days.add(day_key)
-    scheduler.remove_all_jobs()
-    schedule_polls()
+    t.disabled_days.add(day_key)
+    schedule_polls(t)
     await save_data()
     await message.reply(f"✅ Автоопрос для '{day_key}' отключён. Расписание обновлено.")
 
@@ -926,14 +1032,14 @@ async def cmd_disablepoll(message: types.Message) -> None:
 async def cmd_enablepoll(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     arg = message.get_args().strip()
     day_key = normalize_day_key(arg)
     if not day_key:
         return await message.reply("Использование: /enablepoll <день недели> (напр. вт, thu)")
-    if day_key in disabled_days:
-        disabled_days.remove(day_key)
-    scheduler.remove_all_jobs()
-    schedule_polls()
+    if day_key in t.disabled_days:
+        t.disabled_days.remove(day_key)
+    schedule_polls(t)
     await save_data()
     await message.reply(f"✅ Автоопрос для '{day_key}' включён. Расписание обновлено.")
 
@@ -941,16 +1047,44 @@ async def cmd_enablepoll(message: types.Message) -> None:
 async def cmd_pollsstatus(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    if not disabled_days:
+    t = tenants.current()
+    if not t.disabled_days:
         return await message.reply("ℹ️ Все дни включены для автозапуска опросов.")
-    days_txt = ", ".join(sorted(list(disabled_days)))
+    days_txt = ", ".join(sorted(list(t.disabled_days)))
     await message.reply(f"⛔ Отключены дни: {days_txt}")
 
+PERF_TOP = 10
+
+def _fmt_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}"
+
+@dp.message_handler(commands=["perf"])
+async def cmd_perf(message: types.Message) -> None:
+    """Перцентили времени обработки по последним обновлениям и самые медленные обработчики."""
+    if not is_admin(message.from_user.id):
+        return await message.reply("❌ Нет прав.")
+    total = perf_tracker.summary(perf_tracker.updates)
+    if not total["count"]:
+        return await message.reply("ℹ️ Замеров пока нет.")
+    lines = [
+        f"⏱ <b>Обработка обновлений</b> (последние {total['count']}, мс)",
+        f"p50 {_fmt_ms(total['p50'])} · p95 {_fmt_ms(total['p95'])} · p99 {_fmt_ms(total['p99'])} · max {_fmt_ms(total['max'])}",
+        f"Медленных (≥ {SLOW_UPDATE_SECONDS:g} с) с запуска: {perf_tracker.slow}",
+    ]
+    top = perf_tracker.top_handlers(PERF_TOP)
+    if top:
+        lines.append("")
+        lines.append("<b>Самые медленные обработчики</b> (p50 / p95 / p99, мс):")
+        for name, s in top:
+            lines.append(f"<code>{html.escape(name)}</code> ×{s['count']}: {_fmt_ms(s['p50'])} / {_fmt_ms(s['p95'])} / {_fmt_ms(s['p99'])}")
+    await message.reply("\n".join(lines))
+
 @dp.message_handler(commands=["summary"])
 async def cmd_summary(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    last = find_last_active_poll(active_polls)
+    t = tenants.current()
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
     pid, data = last
@@ -964,15 +1098,16 @@ async def cmd_notify(message: types.Message) -> None:
     """
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     text = (message.get_args() or "").strip()
     if not text:
         return await message.reply("Использование: /notify Текст сообщения")
-    last = find_last_active_poll(active_polls)
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
-    _, data = last
+    pid, data = last
     votes = data.get("votes", {})
-    yes_users = [v for v in votes.values() if str(v.get("answer","")) .startswith("Да") and v.get("user_id")]
+    yes_users = [votes[k] for k in t.active_polls.tally(pid).voters(CATEGORY_YES) if votes[k].get("user_id")]
     if not yes_users:
         return await message.reply("Никто не проголосовал 'Да'.")
     mentions = []
@@ -981,7 +1116,7 @@ async def cmd_notify(message: types.Message) -> None:
         name = v.get("name") or str(uid)
         mentions.append(_mention(uid, name))
     msg = f"📣 <b>Оповещение для участников 'Да'</b>:\n{text}\n\n" + ", ".join(mentions)
-    await safe_telegram_call(bot.send_message, CHAT_ID, msg, parse_mode=ParseMode.HTML)
+    await safe_telegram_call(bot.send_message, t.chat_id, msg, parse_mode=ParseMode.HTML)
     await message.reply("✅ Оповещение отправлено")
 
 @dp.message_handler(commands=["remind"])
@@ -991,7 +1126,8 @@ async def cmd_remind(message: types.Message) -> None:
     """
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    last = find_last_active_poll(active_polls)
+    t = tenants.current()
+    last = find_last_active_poll(t.active_polls)
     if not last:
         return await message.reply("📭 Нет активных опросов.")
     _, data = last
@@ -1002,15 +1138,18 @@ async def cmd_remind(message: types.Message) -> None:
     if custom_text:
         reminder_text += f"\n\n{custom_text}"
     reminder_text += "\n\nПожалуйста, проголосуйте 👇"
-    await safe_telegram_call(bot.send_message, CHAT_ID, reminder_text, parse_mode=ParseMode.HTML)
+    await safe_telegram_call(bot.send_message, t.chat_id, reminder_text, parse_mode=ParseMode.HTML, priority=PRIORITY_LOW)
     await message.reply("✅ Напоминание отправлено")
 
 @dp.message_handler(commands=["backup"])
 async def cmd_backup(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "rb") as f:
+    t = tenants.current()
+    await t.saver.flush()
+    path = await t.storage.backup_file()
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
             await message.reply_document(f, caption="📦 Текущие данные бота")
     else:
         await message.reply("⚠️ Данных для бэкапа нет.")
@@ -1020,10 +1159,11 @@ async def cmd_say(message: types.Message) -> None:
     """Admin-only: отправить любое сообщение от имени бота в чат."""
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
+    t = tenants.current()
     text = (message.get_args() or "").strip()
     if not text:
         return await message.reply("Использование: /say Текст сообщения")
-    await safe_telegram_call(bot.send_message, CHAT_ID, text, parse_mode=ParseMode.HTML)
+    await safe_telegram_call(bot.send_message, t.chat_id, text, parse_mode=ParseMode.HTML)
     await message.reply("✅ Сообщение отправлено")
 
 # -------------------- Admin: toggle 'Под вопросом' reminders --------------------
@@ -1037,17 +1177,17 @@ async def cmd_qreminders(message: types.Message) -> None:
     if not is_admin(message.from_user.id):
         return await message.reply("❌ Нет прав.")
     arg = (message.get_args() or "").strip().lower()
-    global questionable_reminders_enabled
+    t = tenants.current()
     if arg in ("on", "вкл", "enable", "+"):
-        questionable_reminders_enabled = True
+        t.questionable_reminders_enabled = True
         await save_data()
         return await message.reply("✅ Напоминания для 'Под вопросом' — ВКЛЮЧЕНЫ.")
     if arg in ("off", "выкл", "disable", "-"):
-        questionable_reminders_enabled = False
+        t.questionable_reminders_enabled = False
         await save_data()
         return await message.reply("✅ Напоминания для 'Под вопросом' — ВЫКЛЮЧЕНЫ.")
     await message.reply(
-        "Статус: " + ("ВКЛЮЧЕНЫ" if questionable_reminders_enabled else "ВЫКЛЮЧЕНЫ") +
+        "Статус: " + ("ВКЛЮЧЕНЫ" if t.questionable_reminders_enabled else "ВЫКЛЮЧЕНЫ") +
         "\nИспользование: /qreminders on|off"
     )
 
@@ -1080,37 +1220,69 @@ async def cmd_duels(message: types.Message) -> None:
 
 # -------------------- Scheduler helpers --------------------
 def compute_next_poll_datetime() -> Optional[Tuple[datetime, Dict[str, Any]]]:
-    """Обёртка над app.scheduling.compute_next_poll_datetime для текущей конфигурации."""
-    return _compute_next_poll_datetime(polls_config, disabled_days)
+    """Ближайший автозапуск опроса текущей группы (из движка расписания)."""
+    occ = tenants.current().schedule.next_poll()
+    return (occ.open_dt, occ.poll) if occ else None
 
 # Функции для APScheduler
 # ---
-def _schedule_poll_job(poll):
-    asyncio.run_coroutine_threadsafe(start_poll(poll), MAIN_LOOP)
-
-def _schedule_summary_job(poll):
-    asyncio.run_coroutine_threadsafe(send_summary_by_day(poll), MAIN_LOOP)
+def _run_for_tenant(t: tenants.Tenant, func, *args) -> None:
+    """Запустить корутину в основном loop в контексте группы t (задания планировщика)."""
+    asyncio.run_coroutine_threadsafe(tenants.run_in(t, func, *args), MAIN_LOOP)
 
-def schedule_polls() -> None:
-    if scheduler is None:
-        log.error('Scheduler not initialized!')
-        return
-    def start_poll_cb(poll: dict):
-        asyncio.run_coroutine_threadsafe(start_poll(poll), MAIN_LOOP)
-    def send_summary_by_day_cb(poll: dict):
-        asyncio.run_coroutine_threadsafe(send_summary_by_day(poll), MAIN_LOOP)
-    def save_data_cb():
-        asyncio.run_coroutine_threadsafe(save_data(), MAIN_LOOP)
+def _schedule_tenant(t: tenants.Tenant) -> None:
+    t.schedule.invalidate()
     setup_scheduler_jobs(
         scheduler,
-        polls_config,
-        disabled_days,
+        t.polls_config,
+        t.disabled_days,
         KALININGRAD_TZ,
-        start_poll_cb,
-        send_summary_by_day_cb,
-        save_data_cb,
+        lambda: _run_for_tenant(t, save_data),
         log,
+        job_args=(t.chat_id,),
+        prefetch=bool(weather_client.api_key),
+        prefetch_lead_minutes=WEATHER_PREFETCH_MINUTES,
+        job_prefix=f"{t.chat_id}:",
     )
+
+def _tenant_job(func):
+    """Обработчик сохраняемого задания: первый аргумент — chat_id группы, остальные — аргументы func."""
+    async def _run(chat_id: int, *args: Any) -> None:
+        t = tenants.registry.get(chat_id)
+        if t is None:
+            log.warning("Skipping scheduled %s for unknown chat %s", func.__name__, chat_id)
+            return
+        await tenants.run_in(t, func, *args)
+    return _run
+
+register_job_handler("start_poll", _tenant_job(start_poll))
+register_job_handler("summary_by_day", _tenant_job(send_summary_by_day))
+register_job_handler("prefetch", _tenant_job(_prefetch_weather))
+register_job_handler("reminder", _tenant_job(send_reminder_if_needed))
+register_job_handler("tag_questionable", _tenant_job(tag_questionable_users))
+register_job_handler("close_poll", _tenant_job(send_summary))
+
+def _create_scheduler() -> AsyncIOScheduler:
+    """Планировщик: duel- и служебные задания — в памяти, опросы и напоминания — в SCHEDULER_DB."""
+    persistent = MemoryJobStore()
+    if SCHEDULER_DB:
+        path = sharding.shard_path(SCHEDULER_DB, SHARD_INDEX) if SHARD_INDEX is not None else SCHEDULER_DB
+        persistent = SQLiteJobStore(path)
+    return AsyncIOScheduler(timezone=KALININGRAD_TZ, jobstores={"default": MemoryJobStore(), PERSISTENT_JOBSTORE: persistent})
+
+def schedule_polls(tenant: Optional[tenants.Tenant] = None) -> None:
+    """Перепланировать задания одной группы или (без аргумента) всех групп."""
+    if scheduler is None:
+        log.error('Scheduler not initialized!')
+        return
+    for t in ([tenant] if tenant is not None else tenants.registry):
+        _schedule_tenant(t)
+    if tenant is None:
+        # Расписание групп, которых больше нет в TENANTS_FILE (или которые ушли на другой шард)
+        served = {f"{t.chat_id}:" for t in tenants.registry}
+        counts = reconcile_jobs(scheduler, {}, lambda job_id: ":" in job_id and job_id.split(":", 1)[0] + ":" not in served)
+        if counts["removed"]:
+            log.info("Removed %s scheduled jobs of chats no longer served", counts["removed"])
     log.info("Scheduler refreshed (timezone: Europe/Kaliningrad)")
     log.info("=== Запланированные задания ===")
     for job in scheduler.get_jobs():
@@ -1122,18 +1294,102 @@ def schedule_polls() -> None:
 async def handle(request):
     return web.Response(text="✅ Bot is alive")
 
+# -------------------- Metrics --------------------
+def _collect_bot_metrics() -> None:
+    metrics.ACTIVE_POLLS.clear()
+    metrics.POLL_VOTES.clear()
+    metrics.DUEL_TIMEOUTS.clear()
+    for t in tenants.registry:
+        metrics.ACTIVE_POLLS.set(len(t.active_polls), chat=t.chat_id)
+        metrics.POLL_VOTES.set(sum(len(p.get("votes", {})) for p in t.active_polls.values()), chat=t.chat_id)
+        metrics.DUEL_TIMEOUTS.set(len(t.duels.timeouts), chat=t.chat_id)
+    metrics.collect_weather(weather_client.stats)
+
+metrics.registry.add_collector(_collect_bot_metrics)
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Метрики в текстовом формате Prometheus; при заданном METRICS_TOKEN — только с Bearer-токеном."""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return web.Response(status=401)
+    return web.Response(body=metrics.registry.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+# -------------------- Webhook ingestion --------------------
+_webhook_tasks: set = set()
+_webhook_stop: Optional[asyncio.Event] = None
+
+async def _process_webhook_update(update: types.Update) -> None:
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    try:
+        # Как при polling: через updates_handler, чтобы сработали pre/post_process_update у middleware
+        await dp.process_updates([update])
+    except Exception:
+        log.exception("Failed to process update %s", update.update_id)
+
+async def handle_webhook(request: web.Request) -> web.Response:
+    """Принять обновление от Telegram: проверить секрет и отдать его диспетчеру в фоне."""
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        log.warning("Rejected webhook request with invalid secret from %s", request.remote)
+        return web.Response(status=403)
+    try:
+        payload = await request.json()
+        update = types.Update(**payload)
+    except Exception:
+        return web.Response(status=400)
+    if _supervisor is not None:
+        # Фронт только пересылает; 503 — Telegram повторит доставку, пока воркер перезапускается
+        accepted = await _supervisor.forward(payload)
+        if accepted is None:
+            return web.Response(status=503)
+        if not accepted:
+            log.warning("Update %s was rejected by all shards", payload.get("update_id"))
+        return web.Response(text="ok")
+    # Отвечаем Telegram сразу, обработка идёт отдельной задачей
+    task = asyncio.create_task(_process_webhook_update(update))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+    return web.Response(text="ok")
+
+async def handle_shard_update(request: web.Request) -> web.Response:
+    """Воркер шарда: принять обновление от фронт-процесса и обработать его в фоне."""
+    token = request.headers.get(sharding.SHARD_SECRET_HEADER, "")
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return web.Response(status=403)
+    try:
+        payload = await request.json()
+        update = types.Update(**payload)
+    except Exception:
+        return web.Response(status=400)
+    answer = payload.get("poll_answer")
+    if answer and tenants.registry.for_poll(answer.get("poll_id")) is None:
+        # Опрос не наш — фронт спросит следующий шард
+        return web.json_response({"handled": False})
+    task = asyncio.create_task(_process_webhook_update(update))
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+    return web.json_response({"handled": True})
+
 async def start_keepalive_server() -> None:
     app = web.Application()
     app.router.add_get("/", handle)
+    app.router.add_get("/metrics", handle_metrics)
+    host, port = "0.0.0.0", PORT
+    if SHARD_INDEX is not None:
+        # Воркер слушает только localhost: обновления ему пересылает фронт-процесс
+        app.router.add_post(sharding.SHARD_UPDATE_PATH, handle_shard_update)
+        host, port = "127.0.0.1", SHARD_BASE_PORT + SHARD_INDEX
+    elif WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, handle_webhook)
     runner = web.AppRunner(app)
     await runner.setup()
     try:
-        site = web.TCPSite(runner, "0.0.0.0", PORT)
+        site = web.TCPSite(runner, host, port)
         await site.start()
-        log.info("KeepAlive server started on port %s", PORT)
+        log.info("KeepAlive server started on %s:%s", host, port)
     except OSError as e:
-        if e.errno == 98:
-            log.warning("⚠️ Port %s already in use, skipping KeepAlive server startup", PORT)
+        if e.errno == 98 and SHARD_INDEX is None:
+            log.warning("⚠️ Port %s already in use, skipping KeepAlive server startup", port)
         else:
             log.exception("Failed to start KeepAlive server")
             raise
@@ -1146,15 +1402,39 @@ async def start_keepalive_server() -> None:
 
 async def shutdown() -> None:
     log.info("Shutting down...")
+    if _webhook_stop is not None:
+        _webhook_stop.set()
+    if _supervisor is not None:
+        try:
+            await _supervisor.stop()
+        except Exception:
+            log.exception("Error stopping shard workers")
     try:
-        await save_data()
+        await duels.stop_timeout_managers()
+    except Exception:
+        log.exception("Error stopping duel timeouts")
+    for t in tenants.registry:
+        try:
+            await t.close()
+        except Exception:
+            log.exception("Error while saving data for chat %s during shutdown", t.chat_id)
+    try:
+        await stop_delete_queue()
     except Exception:
-        log.exception("Error while saving data during shutdown")
+        log.exception("Error stopping delete queue")
+    try:
+        await stop_outbound_dispatcher()
+    except Exception:
+        log.exception("Error stopping outbound dispatcher")
     try:
         if scheduler and getattr(scheduler, 'running', False):
             scheduler.shutdown(wait=False)
     except Exception:
         log.exception("Error shutting down scheduler")
+    try:
+        await weather_client.close()
+    except Exception:
+        log.exception("Error closing weather client")
     try:
         await bot.session.close()
     except Exception:
@@ -1181,34 +1461,53 @@ async def main() -> None:
         MAIN_LOOP = asyncio.get_event_loop()
         log.info("Event loop created: %s", MAIN_LOOP)
     
-    scheduler = AsyncIOScheduler(timezone=KALININGRAD_TZ)
+    scheduler = _create_scheduler()
+    metrics.instrument_scheduler(scheduler)
+    # Стартуем на паузе: хранилище заданий открыто, можно сверить сохранённые задания с расписанием,
+    # а пропущенные за время простоя запуски выполнятся только после resume()
+    scheduler.start(paused=True)
     log.info("Scheduler created")
+
+    # Все исходящие вызовы через safe_telegram_call идут через очередь с лимитами Telegram
+    if SHARD_INDEX is not None:
+        # Общий лимит бота делится между воркерами; группы у воркеров не пересекаются
+        start_outbound_dispatcher(global_rate=TG_GLOBAL_RATE / SHARD_COUNT)
+    else:
+        start_outbound_dispatcher()
+    # Сообщения замьюченных (если нет права ограничивать) удаляются пачками в фоне
+    start_delete_queue(bot)
     
+    # Новые группы и хранилища на каждый запуск main(): фоновые задачи привязаны к текущему event loop
+    _setup_tenants()
     await load_data()
     log.info("Data loaded")
+    for t in tenants.registry:
+        t.start()
     
     # Восстановление напоминаний
-    for pid, data in list(active_polls.items()):
-        try:
-            if data.get("active"):
-                schedule_poll_reminders(pid)
-        except Exception:
-            log.exception("Failed to restore reminders for poll %s", pid)
+    for t in tenants.registry:
+        with tenants.use(t):
+            for pid, _ in t.active_polls.active_items():
+                try:
+                    schedule_poll_reminders(pid, restore=True)
+                except Exception:
+                    log.exception("Failed to restore reminders for poll %s", pid)
 
-    # ensure polling mode
-    log.info("Deleting webhook...")
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        log.info("Webhook deleted successfully")
-    except Exception as e:
-        log.exception("Failed to delete webhook: %s", e)
+    if not WEBHOOK_URL and SHARD_INDEX is None:
+        # ensure polling mode
+        log.info("Deleting webhook...")
+        try:
+            await bot.delete_webhook(drop_pending_updates=True)
+            log.info("Webhook deleted successfully")
+        except Exception as e:
+            log.exception("Failed to delete webhook: %s", e)
 
     # setup handlers BEFORE starting scheduler
     log.info("Setting up handlers...")
     def check_active_tue_thu_poll() -> bool:
-        """Проверить, есть ли активный опрос для вторника или четверга."""
+        """Проверить, есть ли в текущей группе активный опрос для вторника или четверга."""
         try:
-            last = find_last_active_poll(active_polls)
+            last = find_last_active_poll(tenants.current().active_polls)
             if not last:
                 return False
             _, data = last
@@ -1219,6 +1518,7 @@ async def main() -> None:
     
     setup_duel_handlers(dp, bot, scheduler, safe_telegram_call, check_active_tue_thu_poll, MAIN_LOOP)
     log.info("Duel handlers set up")
+    duels.start_timeout_manager(bot)
     
     # setup errors handler
     setup_error_handler(dp, bot, ADMIN_ID, log)
@@ -1240,11 +1540,13 @@ async def main() -> None:
     # Планируем опросы
     log.info("Scheduling polls...")
     schedule_polls()
+    # Первый прогрев кэша погоды — в фоне, чтобы ручной /start_poll сразу получил прогноз
+    asyncio.create_task(_prefetch_weather())
     
     # Запускаем планировщик
     log.info("Starting scheduler...")
     try:
-        scheduler.start()
+        scheduler.resume()
         log.info("Scheduler started successfully")
     except Exception as e:
         log.exception("Failed to start scheduler: %s", e)
@@ -1263,9 +1565,10 @@ async def main() -> None:
             except Exception as e:
                 log.exception("Failed to send weather warning: %s", e)
     
-    # Запускаем отправку в фоне, не блокируя основной поток
-    asyncio.create_task(send_startup_message())
-    log.info("Startup message task created")
+    # Запускаем отправку в фоне, не блокируя основной поток (при шардировании — только шард основной группы)
+    if SHARD_INDEX is None or tenants.registry.get(CHAT_ID) is not None:
+        asyncio.create_task(send_startup_message())
+        log.info("Startup message task created")
     
     # add signal handlers
     try:
@@ -1287,6 +1590,14 @@ async def main() -> None:
         log.exception("Failed to get bot info: %s", e)
         raise
     
+    if SHARD_INDEX is not None:
+        log.info("Shard %s/%s serving chats %s", SHARD_INDEX, SHARD_COUNT, [t.chat_id for t in tenants.registry])
+        await _serve_until_stopped()
+        return
+    if WEBHOOK_URL:
+        await _run_webhook()
+        return
+
     try:
         log.info("Calling dp.start_polling()...")
         await dp.start_polling()
@@ -1298,12 +1609,83 @@ async def main() -> None:
         log.exception("Polling failed: %s", e)
         raise
 
+async def _serve_until_stopped() -> None:
+    """Ждать shutdown(); обновления тем временем принимает keepalive-сервер."""
+    global _webhook_stop
+    _webhook_stop = asyncio.Event()
+    await _webhook_stop.wait()
+    if _webhook_tasks:
+        await asyncio.gather(*list(_webhook_tasks), return_exceptions=True)
+
+async def _run_webhook() -> None:
+    """Зарегистрировать webhook и ждать остановки."""
+    url = WEBHOOK_URL + WEBHOOK_PATH
+    await bot.set_webhook(url, secret_token=WEBHOOK_SECRET)
+    log.info("Webhook set to %s", url)
+    await _serve_until_stopped()
+    log.info("Webhook mode stopped")
+
+# -------------------- Shard supervisor --------------------
+_supervisor: Optional[sharding.ShardSupervisor] = None
+
+async def _forward_polling(supervisor: sharding.ShardSupervisor) -> None:
+    """Long polling во фронт-процессе: обновления не обрабатываются, а пересылаются воркерам."""
+    offset = None
+    while not supervisor.stopping:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=25)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if supervisor.stopping:
+                break
+            log.exception("getUpdates failed")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            # Пока воркер-владелец недоступен (перезапускается), повторяем с нарастающей паузой;
+            # offset сдвигаем, только когда обновление принято или отклонено окончательно
+            payload, delay = update.to_python(), 1.0
+            accepted = await supervisor.forward(payload)
+            while accepted is None and not supervisor.stopping:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, SHARD_FORWARD_RETRY_MAX)
+                accepted = await supervisor.forward(payload)
+            if accepted is None:
+                # Остановка: неотправленное Telegram отдаст заново при следующем запуске
+                break
+            offset = update.update_id + 1
+            if not accepted:
+                log.warning("Update %s was rejected by all shards", update.update_id)
+
+async def run_supervisor() -> None:
+    """Фронт-процесс: держит воркеры шардов и пересылает им обновления (webhook или polling)."""
+    global _supervisor
+    log.info("Starting shard supervisor with %s workers", SHARD_COUNT)
+    configs = tenants.load_tenant_configs(TENANTS_FILE, CHAT_ID, polls_config)
+    router = sharding.ShardRouter(SHARD_COUNT, [cfg["chat_id"] for cfg in configs], CHAT_ID)
+    for cfg in configs:
+        log.info("Chat %s -> shard %s", cfg["chat_id"], router.shard_for_chat(cfg["chat_id"]))
+    _supervisor = sharding.ShardSupervisor(router, [sys.executable, os.path.abspath(__file__)], SHARD_BASE_PORT, WEBHOOK_SECRET)
+    _supervisor.start()
+    try:
+        _install_signal_handlers(asyncio.get_running_loop())
+        await start_keepalive_server()
+        if WEBHOOK_URL:
+            await _run_webhook()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await _forward_polling(_supervisor)
+    finally:
+        if not _supervisor.stopping:
+            await shutdown()
+        _supervisor = None
 
 if __name__ == "__main__":
     # robust restart loop
     while True:
         try:
-            asyncio.run(main())
+            asyncio.run(run_supervisor() if IS_SHARD_SUPERVISOR else main())
         except KeyboardInterrupt:
             log.info("Stopped by KeyboardInterrupt")
             break
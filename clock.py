@@ -0,0 +1,119 @@
+"""Часы проекта: всё «сейчас» (now_tz, таймстемпы дуэлей и таймаутов, время APScheduler) берётся отсюда.
+
+По умолчанию — системное время. Симуляция (simulate.py) подставляет VirtualClock через set_clock()
+и переводит его вперёд сама, так что неделя расписания проигрывается за секунды.
+"""
+from __future__ import annotations
+
+from datetime import datetime, tzinfo
+from typing import Optional
+import time as _time
+
+class SystemClock:
+	"""Обычное системное время."""
+
+	def time(self) -> float:
+		return _time.time()
+
+	def now(self, tz: Optional[tzinfo] = None) -> datetime:
+		return datetime.now(tz)
+
+class VirtualClock:
+	"""Виртуальное время: стоит на месте, пока его не переведут set() или advance()."""
+
+	def __init__(self, start: float) -> None:
+		self._ts = float(start)
+
+	def time(self) -> float:
+		return self._ts
+
+	def now(self, tz: Optional[tzinfo] = None) -> datetime:
+		return datetime.fromtimestamp(self._ts, tz)
+
+	def set(self, ts: float) -> None:
+		"""Перевести часы на момент ts (назад нельзя)."""
+		if ts < self._ts:
+			raise ValueError(f"Virtual clock cannot go back: {ts} < {self._ts}")
+		self._ts = float(ts)
+
+	def advance(self, seconds: float) -> None:
+		self.set(self._ts + seconds)
+
+_clock = SystemClock()
+
+def get_clock():
+	return _clock
+
+def set_clock(clock) -> object:
+	"""Подменить часы; возвращает прежние (чтобы вернуть их после симуляции).
+
+	С VirtualClock на эти часы переводится и APScheduler, с любыми другими он снова работает
+	с обычным datetime — в проде его модули не трогаются.
+	"""
+	global _clock
+	previous, _clock = _clock, clock
+	if isinstance(clock, VirtualClock):
+		bind_apscheduler()
+	else:
+		unbind_apscheduler()
+	return previous
+
+def time() -> float:
+	"""Текущий unix timestamp по часам проекта."""
+	return _clock.time()
+
+def now(tz: Optional[tzinfo] = None) -> datetime:
+	"""Текущее время по часам проекта (в таймзоне tz, без неё — наивное локальное)."""
+	return _clock.now(tz)
+
+class _ClockDatetimeMeta(type):
+	# isinstance(x, datetime) в модулях APScheduler должен и дальше принимать обычные datetime
+	def __instancecheck__(cls, obj: object) -> bool:
+		return isinstance(obj, datetime)
+
+	def __subclasscheck__(cls, sub: type) -> bool:
+		return issubclass(sub, datetime)
+
+class _ClockDatetime(datetime, metaclass=_ClockDatetimeMeta):
+	"""datetime, у которого now() берётся из часов проекта."""
+
+	@classmethod
+	def now(cls, tz: Optional[tzinfo] = None) -> datetime:
+		return _clock.now(tz)
+
+# Модуль APScheduler -> его исходный datetime, пока модули переведены на часы проекта
+_apscheduler_datetime: dict = {}
+
+def _apscheduler_modules() -> list:
+	import apscheduler.schedulers.base
+	import apscheduler.executors.base
+	import apscheduler.triggers.interval
+	import apscheduler.triggers.date
+	modules = [apscheduler.schedulers.base, apscheduler.executors.base, apscheduler.triggers.interval, apscheduler.triggers.date]
+	try:
+		import apscheduler.executors.base_py3
+		modules.append(apscheduler.executors.base_py3)
+	except ImportError:
+		pass
+	return modules
+
+def bind_apscheduler() -> None:
+	"""Перевести APScheduler на часы проекта: планировщик, проверку пропусков в исполнителях и триггеры.
+
+	APScheduler читает время через datetime.now() в своих модулях, поэтому подменяется имя datetime
+	в них. Вызывает set_clock() при установке VirtualClock; повторный вызов ничего не делает.
+	"""
+	for module in _apscheduler_modules():
+		_apscheduler_datetime.setdefault(module, module.datetime)
+		module.datetime = _ClockDatetime
+
+def unbind_apscheduler() -> None:
+	"""Вернуть модулям APScheduler их исходный datetime."""
+	for module, original in _apscheduler_datetime.items():
+		module.datetime = original
+	_apscheduler_datetime.clear()
+
+
+
+
+
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Optional, Dict, Any, Set
+from typing import Optional, Dict, Any, Set, Callable
 import os
 import asyncio
 import random
@@ -10,7 +10,10 @@ from aiogram import Bot, Dispatcher, types
 from aiogram.types import ParseMode
 import html
 
-from state import KALININGRAD_TZ
+import clock
+from state import KALININGRAD_TZ, current_chat, now_tz
+from timeouts import TimeoutManager
+from tg_utils import safe_telegram_call, queue_delete, PRIORITY_NORMAL, PRIORITY_LOW
 
 log = logging.getLogger("bot")
 
@@ -18,88 +21,267 @@ log = logging.getLogger("bot")
 DUEL_PENDING_MINUTES = int(os.getenv("DUEL_PENDING_MINUTES", "10"))
 DUEL_BETTING_MINUTES = 2  # Время на выбор стороны болельщиками
 DUEL_MAX_DURATION_MINUTES = 3  # Максимальная длительность дуэли
+# Как соблюдать таймауты: restrict — restrictChatMember с until_date (один вызов на таймаут),
+# delete — удалять каждое сообщение замьюченного; auto — restrict, если у бота есть право ограничивать
+TIMEOUT_MODE = os.getenv("DUEL_TIMEOUT_MODE", "auto").lower()
+RESTRICT_RECHECK_SECONDS = 3600  # Как часто в режиме auto перепроверять права бота в чате
+_MUTED = types.ChatPermissions(can_send_messages=False)
+# Все права True — так Bot API снимает ограничения с участника
+_UNMUTED = types.ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=True,
+    can_invite_users=True,
+    can_pin_messages=True,
+)
 
-# Глобальное состояние дуэлей
-active_duel: Optional[Dict[str, Any]] = None
-duel_timeouts: Dict[str, float] = {}  # user_id -> timestamp окончания таймаута
-username_to_userid: Dict[str, int] = {}  # username (lower, без @) -> user_id
-duel_daily_count: Dict[str, Dict[str, Any]] = {}  # user_id -> {date: 'YYYYMMDD', count: int}
-duels_enabled: bool = True  # Флаг включения/выключения дуэлей (админ может управлять)
+# Состояние дуэлей по чатам (chat_id -> DuelState); текущий чат берётся из state.current_chat
+username_to_userid: Dict[str, int] = {}  # username (lower, без @) -> user_id, общая для всех чатов
+_states: Dict[Any, "DuelState"] = {}
 _main_loop = None  # Основной event loop для выполнения асинхронных задач
+_bot: Optional[Bot] = None  # Бот для уведомлений о снятии таймаута
 
 def _now_ts() -> float:
-    """Текущий timestamp."""
-    import time
-    return time.time()
+    """Текущий timestamp (по часам проекта, см. clock)."""
+    return clock.time()
+
+class DuelState:
+    """Дуэли одного чата: текущая дуэль, флаг включения, дневные счётчики и таймауты."""
+
+    def __init__(self, chat_id: Any) -> None:
+        self.chat_id = chat_id
+        self.active_duel: Optional[Dict[str, Any]] = None
+        self.enabled = True  # Флаг включения/выключения дуэлей (админ может управлять)
+        self.daily_count: Dict[str, Dict[str, Any]] = {}  # user_id -> {date: 'YYYYMMDD', count: int}
+        self.timeouts = TimeoutManager(on_expire=self._on_timeout_expired)  # куча дедлайнов + одна задача истечения
+        self.persist_cb: Optional[Callable[..., None]] = None  # Запись изменений в хранилище чата
+        self.can_restrict: Optional[bool] = None  # Может ли бот ограничивать участников (None — ещё не проверяли)
+        self.restrict_checked = 0.0
+        self.restrict_lock = asyncio.Lock()  # Одна проверка прав на всех, кто пришёл за ней одновременно
+
+    def persist(self, op: str, **fields: Any) -> None:
+        """Передать изменение состояния дуэлей в хранилище (если оно подключено)."""
+        if self.persist_cb is None:
+            return
+        try:
+            self.persist_cb(op, **fields)
+        except Exception:
+            log.exception("Failed to persist duel state change %s", op)
+
+    def export(self) -> Dict[str, Dict[str, Any]]:
+        """Снимок таймаутов, дневных счётчиков и карты username -> user_id для сохранения."""
+        saved = {}
+        for uid, until in self.timeouts.deadlines.items():
+            meta = self.timeouts.payloads.get(uid, {})
+            saved[uid] = {"until": until, "chat_id": meta.get("chat_id"), "name": meta.get("name")}
+        return {"timeouts": saved, "daily": self.daily_count, "usernames": username_to_userid}
+
+    def restore(self, state: Optional[Dict[str, Any]]) -> None:
+        """Восстановить состояние из хранилища (просроченные таймауты отбрасываются)."""
+        state = state or {}
+        now = _now_ts()
+        for uid in list(self.timeouts.deadlines):
+            self.timeouts.cancel(uid)
+        for uid, t in (state.get("timeouts") or {}).items():
+            try:
+                until = float(t.get("until"))
+            except (TypeError, ValueError):
+                continue
+            if until <= now:
+                self.persist("timeout_clear", user=str(uid))
+                continue
+            self.timeouts.set(str(uid), until, {"chat_id": t.get("chat_id"), "name": t.get("name")})
+        self.daily_count.clear()
+        self.daily_count.update(state.get("daily") or {})
+        for uname, uid in (state.get("usernames") or {}).items():
+            try:
+                username_to_userid[str(uname)] = int(uid)
+            except (TypeError, ValueError):
+                continue
+
+    async def _on_timeout_expired(self, uid: str, payload: Dict[str, Any]) -> None:
+        """Колбэк TimeoutManager: таймаут истёк — фиксируем, снимаем ограничение и уведомляем чат."""
+        self.persist("timeout_clear", user=uid)
+        chat_id = payload.get("chat_id")
+        if not chat_id or _bot is None:
+            return
+        if await _restrict_allowed(self, _bot):
+            await _set_restriction(self, _bot, uid, None)
+        await _notify_timeout_removed(int(uid), chat_id, payload.get("name") or uid, _bot)
+
+def state_for(chat_id: Any = None) -> DuelState:
+    """Состояние дуэлей чата (по умолчанию — текущего чата обрабатываемого обновления), O(1)."""
+    if chat_id is None:
+        chat_id = current_chat.get()
+    st = _states.get(chat_id)
+    if st is None:
+        st = _states[chat_id] = DuelState(chat_id)
+        if _bot is not None:
+            st.timeouts.start()
+    return st
+
+def export_state(chat_id: Any = None) -> Dict[str, Dict[str, Any]]:
+    return state_for(chat_id).export()
+
+def restore_state(state: Optional[Dict[str, Any]], chat_id: Any = None) -> None:
+    state_for(chat_id).restore(state)
+
+def _remember_username(username: Optional[str], user_id: int) -> None:
+    """Обновить карту username -> user_id; в хранилище пишем только реальные изменения."""
+    if not username:
+        return
+    key = str(username).lower()
+    uid = int(user_id)
+    if username_to_userid.get(key) == uid:
+        return
+    username_to_userid[key] = uid
+    state_for().persist("username", username=key, user_id=uid)
+
+def _is_admin(uid: int) -> bool:
+    try:
+        return str(uid) == str(os.getenv("TG_ADMIN_ID", ""))
+    except Exception:
+        return False
+
+def _date_key() -> str:
+    return now_tz().strftime('%Y%m%d')
+
+def _inc_duel_count(st: DuelState, u1: int, u2: int) -> None:
+    for uid in (u1, u2):
+        if _is_admin(uid):
+            continue
+        key = str(uid)
+        info = st.daily_count.get(key)
+        if not info or info.get('date') != _date_key():
+            st.daily_count[key] = {'date': _date_key(), 'count': 1}
+        else:
+            info['count'] = int(info.get('count', 0)) + 1
+        st.persist("duel_count", user=key, date=st.daily_count[key]['date'], count=st.daily_count[key]['count'])
 
 def _mention(user_id: int, name: str) -> str:
     """Создать упоминание пользователя."""
     return f'<a href="tg://user?id={user_id}">{html.escape(name)}</a>'
 
-def is_user_in_timeout(user_id: int) -> bool:
-    """Проверить, находится ли пользователь в таймауте."""
+async def _reply(message: types.Message, text: str, priority: int = PRIORITY_LOW, **kwargs: Any) -> Any:
+    """Ответить на сообщение через OutboundDispatcher — с общим лимитом бота и лимитом чата."""
+    return await safe_telegram_call(message.bot.send_message, message.chat.id, text, reply_to_message_id=message.message_id, priority=priority, **kwargs)
+
+async def _answer(call: types.CallbackQuery, text: Optional[str] = None, **kwargs: Any) -> Any:
+    """Ответить на нажатие кнопки через OutboundDispatcher (PRIORITY_NORMAL: Telegram ждёт ответ недолго)."""
+    return await safe_telegram_call(call.bot.answer_callback_query, call.id, text, retries=1, priority=PRIORITY_NORMAL, **kwargs)
+
+def is_user_in_timeout(user_id: int, chat_id: Any = None) -> bool:
+    """Проверить, находится ли пользователь в таймауте в чате (O(1))."""
+    return state_for(chat_id).timeouts.is_active(str(user_id))
+
+async def remove_timeout(user_id: int, chat_id: Any = None) -> None:
+    """Снять таймаут с пользователя (и ограничение в Telegram, если бот ограничивает участников)."""
     uid = str(user_id)
-    if uid not in duel_timeouts:
-        return False
-    if _now_ts() >= duel_timeouts[uid]:
-        # Таймаут истёк — удаляем
-        duel_timeouts.pop(uid, None)
+    st = state_for(chat_id)
+    if st.timeouts.cancel(uid):
+        st.persist("timeout_clear", user=uid)
+        if _bot is not None and await _restrict_allowed(st, _bot):
+            await _set_restriction(st, _bot, uid, None)
+
+async def _restrict_allowed(st: DuelState, bot) -> bool:
+    """Соблюдать ли таймауты в чате через restrictChatMember (в режиме auto — по правам бота, с кэшем)."""
+    if TIMEOUT_MODE in ("restrict", "delete"):
+        return TIMEOUT_MODE == "restrict"
+    if st.chat_id is None:
         return False
-    return True
+    if st.can_restrict is not None and _now_ts() - st.restrict_checked < RESTRICT_RECHECK_SECONDS:
+        return st.can_restrict
+    async with st.restrict_lock:
+        now = _now_ts()
+        if st.can_restrict is not None and now - st.restrict_checked < RESTRICT_RECHECK_SECONDS:
+            return st.can_restrict
+        member = await safe_telegram_call(bot.get_chat_member, st.chat_id, bot.id, retries=1)
+        status = getattr(member, "status", None)
+        allowed = status == "creator" or (status == "administrator" and bool(getattr(member, "can_restrict_members", False)))
+        if allowed != st.can_restrict:
+            log.info("Timeouts in chat %s are enforced by %s", st.chat_id, "restrictChatMember" if allowed else "deleting messages")
+        st.can_restrict, st.restrict_checked = allowed, now
+        return allowed
 
-async def remove_timeout(user_id: int) -> None:
-    """Снять таймаут с пользователя."""
-    uid = str(user_id)
-    if uid in duel_timeouts:
-        duel_timeouts.pop(uid, None)
+async def _set_restriction(st: DuelState, bot, user_id: Any, until: Optional[float], priority: int = PRIORITY_NORMAL) -> bool:
+    """Замьютить участника средствами Telegram до until (None — снять ограничение)."""
+    if until is None:
+        kwargs = {"permissions": _UNMUTED}
+    else:
+        # until_date ближе 30 секунд Telegram считает бессрочным
+        kwargs = {"permissions": _MUTED, "until_date": int(max(until, _now_ts() + 60))}
+    ok = await safe_telegram_call(bot.restrict_chat_member, st.chat_id, int(user_id), retries=1, priority=priority, **kwargs)
+    if not ok:
+        # Права отобрали или участник — админ: сообщения удалит handle_timeout_messages, права перепроверим
+        log.warning("restrictChatMember failed for user %s in chat %s", user_id, st.chat_id)
+        st.restrict_checked = 0.0
+    return bool(ok)
 
-async def enforce_timeout(user_id: int, chat_id: int, name: str, scheduler, bot, timeout_minutes: int) -> None:
-    """Установить таймаут на указанное количество минут."""
-    global _main_loop
+async def enforce_timeout(user_id: int, chat_id: int, name: str, scheduler, bot, timeout_minutes: int, priority: int = PRIORITY_NORMAL) -> None:
+    """Установить таймаут на указанное количество минут.
+
+    Если бот может ограничивать участников, таймаут ставится и в Telegram (restrictChatMember
+    с until_date и приоритетом priority), иначе сообщения замьюченного удаляет handle_timeout_messages.
+    Снятие выполняет TimeoutManager, отдельная задача планировщика не создаётся;
+    параметр scheduler оставлен для совместимости вызовов.
+    """
+    global _bot
     uid = str(user_id)
     timeout_end = _now_ts() + timeout_minutes * 60
-    duel_timeouts[uid] = timeout_end
-    # Запланировать автоматическое снятие таймаута
-    if scheduler:
-        try:
-            timeout_job_id = f"timeout_{uid}_{int(_now_ts())}"
-            if _main_loop:
-                scheduler.add_job(
-                    lambda uid=user_id, chat_id=chat_id, name=name: asyncio.run_coroutine_threadsafe(
-                        async_remove_timeout_notify(uid, chat_id, name, bot), _main_loop
-                    ),
-                trigger='date',
-                run_date=datetime.fromtimestamp(timeout_end, tz=KALININGRAD_TZ),
-                id=timeout_job_id,
-            )
-        except Exception:
-            log.exception("Failed to schedule timeout removal for user %s", uid)
+    if bot is not None:
+        _bot = bot
+    st = state_for(chat_id)
+    st.timeouts.set(uid, timeout_end, {"chat_id": chat_id, "name": name})
+    st.persist("timeout_set", user=uid, until=timeout_end, chat_id=chat_id, name=name)
+    if _bot is not None and await _restrict_allowed(st, _bot):
+        await _set_restriction(st, _bot, uid, timeout_end, priority)
+
+def start_timeout_manager(bot) -> None:
+    """Запустить задачи истечения таймаутов всех чатов в текущем event loop (вызывать из main)."""
+    global _bot
+    _bot = bot
+    restored = 0
+    for st in _states.values():
+        st.timeouts.start()
+        restored += len(st.timeouts)
+    if restored:
+        log.info("Restored %s duel timeouts from storage", restored)
+
+async def stop_timeout_managers() -> None:
+    for st in list(_states.values()):
+        await st.timeouts.stop()
 
 async def async_remove_timeout_notify(user_id: int, chat_id: int, name: str, bot) -> None:
-    """Автоматически снять таймаут и уведомить пользователя."""
-    await remove_timeout(user_id)
-    from tg_utils import safe_telegram_call
+    """Снять таймаут и уведомить пользователя."""
+    await remove_timeout(user_id, chat_id)
+    await _notify_timeout_removed(user_id, chat_id, name, bot)
+
+async def _notify_timeout_removed(user_id: int, chat_id: int, name: str, bot) -> None:
     await safe_telegram_call(
         bot.send_message,
         chat_id,
         f"💪 {_mention(user_id, name)} восстановился и снова готов к дуэлям!",
         parse_mode=ParseMode.HTML,
+        priority=PRIORITY_LOW,
     )
 
 async def _finish_duel_auto(bot: Bot, chat_id: int, scheduler) -> None:
     """Автоматически завершить дуэль через максимальное время (3 минуты)."""
-    global active_duel
+    st = state_for(chat_id)
     try:
-        if not active_duel:
+        if not st.active_duel:
             return
         
-        if active_duel.get("status") in ("finished", "cancelled"):
+        if st.active_duel.get("status") in ("finished", "cancelled"):
             return
         
         # Если дуэль в стадии болельщиков, завершаем её принудительно
-        if active_duel.get("status") == "betting":
+        if st.active_duel.get("status") == "betting":
             await _resolve_duel_with_fans(bot, chat_id, scheduler)
-        elif active_duel.get("status") == "accepted":
+        elif st.active_duel.get("status") == "accepted":
             # Если дуэль принята, но болельщики не выбрали стороны, завершаем без болельщиков
             await _resolve_duel_without_fans(bot, chat_id, scheduler)
     except Exception:
@@ -107,15 +289,15 @@ async def _finish_duel_auto(bot: Bot, chat_id: int, scheduler) -> None:
 
 async def _resolve_duel_with_fans(bot: Bot, chat_id: int, scheduler) -> None:
     """Разрешить дуэль с учётом болельщиков."""
-    global active_duel
+    st = state_for(chat_id)
     try:
-        if not active_duel:
+        if not st.active_duel:
             return
         
-        challenger_id = active_duel["challenger_id"]
-        opponent_id = active_duel["opponent_id"]
-        challenger_fans: Set[int] = active_duel.get("challenger_fans", set())
-        opponent_fans: Set[int] = active_duel.get("opponent_fans", set())
+        challenger_id = st.active_duel["challenger_id"]
+        opponent_id = st.active_duel["opponent_id"]
+        challenger_fans: Set[int] = st.active_duel.get("challenger_fans", set())
+        opponent_fans: Set[int] = st.active_duel.get("opponent_fans", set())
         
         # Убираем дуэлянтов из списка болельщиков, если они там случайно оказались
         challenger_fans.discard(challenger_id)
@@ -142,16 +324,16 @@ async def _resolve_duel_with_fans(bot: Bot, chat_id: int, scheduler) -> None:
         
         if winner_is_challenger:
             winner_id = challenger_id
-            winner_name = active_duel["challenger_name"]
+            winner_name = st.active_duel["challenger_name"]
             loser_id = opponent_id
-            loser_name = active_duel["opponent_name"]
+            loser_name = st.active_duel["opponent_name"]
             winner_fans = challenger_fans
             loser_fans = opponent_fans
         else:
             winner_id = opponent_id
-            winner_name = active_duel["opponent_name"]
+            winner_name = st.active_duel["opponent_name"]
             loser_id = challenger_id
-            loser_name = active_duel["challenger_name"]
+            loser_name = st.active_duel["challenger_name"]
             winner_fans = opponent_fans
             loser_fans = challenger_fans
         
@@ -163,7 +345,7 @@ async def _resolve_duel_with_fans(bot: Bot, chat_id: int, scheduler) -> None:
         # Болельщики проигравшего: 10 мин + 5 мин за каждого болельщика соперника
         for fan_id in loser_fans:
             fan_timeout = 10 + len(winner_fans) * 5
-            fan_name = active_duel.get("fan_names", {}).get(str(fan_id), f"Болельщик {fan_id}")
+            fan_name = st.active_duel.get("fan_names", {}).get(str(fan_id), f"Болельщик {fan_id}")
             await enforce_timeout(fan_id, chat_id, fan_name, scheduler, bot, fan_timeout)
         
         # Объявление результата
@@ -172,7 +354,7 @@ async def _resolve_duel_with_fans(bot: Bot, chat_id: int, scheduler) -> None:
         )
         
         if winner_fans:
-            fan_mentions = ", ".join([_mention(fid, active_duel.get("fan_names", {}).get(str(fid), f"Болельщик {fid}")) for fid in winner_fans])
+            fan_mentions = ", ".join([_mention(fid, st.active_duel.get("fan_names", {}).get(str(fid), f"Болельщик {fid}")) for fid in winner_fans])
             result_text += f"🎉 <b>Болельщики {winner_name}:</b> {fan_mentions}\n\n"
             result_text += f"🏆 Вы празднуете победу и отправили своих оппонентов-неудачников отдыхать!\n\n"
         
@@ -181,92 +363,94 @@ async def _resolve_duel_with_fans(bot: Bot, chat_id: int, scheduler) -> None:
         )
         
         if loser_fans:
-            fan_mentions = ", ".join([_mention(fid, active_duel.get("fan_names", {}).get(str(fid), f"Болельщик {fid}")) for fid in loser_fans])
+            fan_mentions = ", ".join([_mention(fid, st.active_duel.get("fan_names", {}).get(str(fid), f"Болельщик {fid}")) for fid in loser_fans])
             result_text += f"😞 <b>Болельщики {loser_name}:</b> {fan_mentions} получают таймаут на {10 + len(winner_fans) * 5} минут\n"
         
-        await bot.send_message(chat_id, result_text, parse_mode=ParseMode.HTML)
+        await safe_telegram_call(bot.send_message, chat_id, result_text, parse_mode=ParseMode.HTML, priority=PRIORITY_LOW)
         
         # Фиксируем статистику
         try:
-            _inc_duel_count(challenger_id, opponent_id)
+            _inc_duel_count(st, challenger_id, opponent_id)
         except Exception:
             pass
         
         # Отменяем запланированные задачи
         try:
             if scheduler:
-                if active_duel.get("betting_end_job_id"):
+                if st.active_duel.get("betting_end_job_id"):
                     try:
-                        scheduler.remove_job(active_duel["betting_end_job_id"])
+                        scheduler.remove_job(st.active_duel["betting_end_job_id"])
                     except Exception:
                         pass
-                if active_duel.get("max_duration_job_id"):
+                if st.active_duel.get("max_duration_job_id"):
                     try:
-                        scheduler.remove_job(active_duel["max_duration_job_id"])
+                        scheduler.remove_job(st.active_duel["max_duration_job_id"])
                     except Exception:
                         pass
         except Exception:
             pass
         
         # Очистка
-        active_duel = None
+        st.active_duel = None
         
     except Exception:
         log.exception("Error in _resolve_duel_with_fans")
-        active_duel = None
+        st.active_duel = None
 
 async def _resolve_duel_without_fans(bot: Bot, chat_id: int, scheduler) -> None:
     """Разрешить дуэль без болельщиков (старая механика как fallback)."""
-    global active_duel
+    st = state_for(chat_id)
     try:
-        if not active_duel:
+        if not st.active_duel:
             return
         
         winner_id, winner_name = random.choice([
-            (active_duel["challenger_id"], active_duel["challenger_name"]),
-            (active_duel["opponent_id"], active_duel["opponent_name"]),
+            (st.active_duel["challenger_id"], st.active_duel["challenger_name"]),
+            (st.active_duel["opponent_id"], st.active_duel["opponent_name"]),
         ])
         
-        if winner_id == active_duel["challenger_id"]:
-            loser_id, loser_name = active_duel["opponent_id"], active_duel["opponent_name"]
+        if winner_id == st.active_duel["challenger_id"]:
+            loser_id, loser_name = st.active_duel["opponent_id"], st.active_duel["opponent_name"]
         else:
-            loser_id, loser_name = active_duel["challenger_id"], active_duel["challenger_name"]
+            loser_id, loser_name = st.active_duel["challenger_id"], st.active_duel["challenger_name"]
         
         await enforce_timeout(loser_id, chat_id, loser_name, scheduler, bot, 30)
         
-        await bot.send_message(
+        await safe_telegram_call(
+            bot.send_message,
             chat_id,
             f"🎯 <b>Победитель:</b> {_mention(winner_id, winner_name)}\n\n"
             f"😵 Проигравший {_mention(loser_id, loser_name)} получает таймаут на 30 минут!",
             parse_mode=ParseMode.HTML,
+            priority=PRIORITY_LOW,
         )
         
         try:
-            _inc_duel_count(active_duel["challenger_id"], active_duel["opponent_id"])
+            _inc_duel_count(st, st.active_duel["challenger_id"], st.active_duel["opponent_id"])
         except Exception:
             pass
         
         # Отменяем запланированные задачи
         try:
             if scheduler:
-                if active_duel.get("betting_end_job_id"):
+                if st.active_duel.get("betting_end_job_id"):
                     try:
-                        scheduler.remove_job(active_duel["betting_end_job_id"])
+                        scheduler.remove_job(st.active_duel["betting_end_job_id"])
                     except Exception:
                         pass
-                if active_duel.get("max_duration_job_id"):
+                if st.active_duel.get("max_duration_job_id"):
                     try:
-                        scheduler.remove_job(active_duel["max_duration_job_id"])
+                        scheduler.remove_job(st.active_duel["max_duration_job_id"])
                     except Exception:
                         pass
         except Exception:
             pass
         
-        active_duel = None
+        st.active_duel = None
         
     except Exception:
         log.exception("Error in _resolve_duel_without_fans")
-        active_duel = None
+        st.active_duel = None
 
 def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_func, check_active_poll_func=None, main_loop=None) -> None:
     """Регистрация всех хендлеров для дуэлей.
@@ -284,74 +468,50 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
             _main_loop = None
     else:
         _main_loop = main_loop
-    def _is_admin(uid: int) -> bool:
-        try:
-            return str(uid) == str(os.getenv("TG_ADMIN_ID", ""))
-        except Exception:
-            return False
-
-    def _date_key() -> str:
-        from datetime import datetime as _dt
-        return _dt.now(KALININGRAD_TZ).strftime('%Y%m%d')
-
-    def _can_start_duel(uid: int) -> bool:
+    def _can_start_duel(st: DuelState, uid: int) -> bool:
         if _is_admin(uid):
             return True
-        info = duel_daily_count.get(str(uid))
+        info = st.daily_count.get(str(uid))
         if not info or info.get('date') != _date_key():
             return True
         return int(info.get('count', 0)) < 3
 
-    def _inc_duel_count(u1: int, u2: int) -> None:
-        for uid in (u1, u2):
-            if _is_admin(uid):
-                continue
-            key = str(uid)
-            info = duel_daily_count.get(key)
-            if not info or info.get('date') != _date_key():
-                duel_daily_count[key] = {'date': _date_key(), 'count': 1}
-            else:
-                info['count'] = int(info.get('count', 0)) + 1
-
-    async def _expire_duel_if_pending(bot: Bot) -> None:
-        global active_duel
+    async def _expire_duel_if_pending(bot: Bot, chat_id: int) -> None:
+        st = state_for(chat_id)
         try:
-            if active_duel and active_duel.get("status") == "pending":
-                chat_id = active_duel.get("chat_id")
-                await bot.send_message(chat_id, "⌛ Вызов на дуэль просрочен (10 минут). Дуэль отменена.")
-                active_duel = None
+            if st.active_duel and st.active_duel.get("status") == "pending":
+                await safe_telegram_call(bot.send_message, chat_id, "⌛ Вызов на дуэль просрочен (10 минут). Дуэль отменена.", priority=PRIORITY_LOW)
+                st.active_duel = None
         except Exception:
             log.exception("Failed to expire pending duel")
 
     @dp.message_handler(commands=["duel"])
     async def cmd_duel(message: types.Message) -> None:
         """Команда вызова на дуэль: /duel"""
-        global active_duel, duels_enabled
+        chat_id = message.chat.id
+        st = state_for(chat_id)
         try:
             # Проверка, включены ли дуэли
-            if not duels_enabled:
-                return await message.reply("⛔ Дуэли временно отключены администратором.")
+            if not st.enabled:
+                return await _reply(message, "⛔ Дуэли временно отключены администратором.")
             
             # Проверка активных опросов для вторника/четверга
             if check_active_poll_func and check_active_poll_func():
-                return await message.reply("⛔ Во время активного опроса дуэли временно запрещены.")
+                return await _reply(message, "⛔ Во время активного опроса дуэли временно запрещены.")
             
             # Проверка на активную дуэль
-            if active_duel:
-                return await message.reply("⚔️ Сейчас уже идёт дуэль! Подожди окончания боя, чтобы начать новую.")
+            if st.active_duel:
+                return await _reply(message, "⚔️ Сейчас уже идёт дуэль! Подожди окончания боя, чтобы начать новую.")
             
             challenger = message.from_user
             
             # Лимит на дуэли в сутки (кроме администратора)
-            if not _can_start_duel(challenger.id):
-                return await message.reply("⛔ Лимит дуэлей на сегодня исчерпан (3 в сутки).")
+            if not _can_start_duel(st, challenger.id):
+                return await _reply(message, "⛔ Лимит дуэлей на сегодня исчерпан (3 в сутки).")
 
             # Проверка таймаута вызывающего
             if is_user_in_timeout(challenger.id):
-                try:
-                    await bot.delete_message(message.chat.id, message.message_id)
-                except Exception:
-                    pass
+                await queue_delete(bot, message.chat.id, message.message_id)
                 return
             
             # Определение соперника
@@ -361,33 +521,32 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
 
             # Обновляем карту username -> user_id
             try:
-                if getattr(challenger, 'username', None):
-                    username_to_userid[str(challenger.username).lower()] = int(challenger.id)
+                _remember_username(getattr(challenger, 'username', None), challenger.id)
             except Exception:
                 pass
             if opponent:
                 try:
-                    if getattr(opponent, 'username', None):
-                        username_to_userid[str(opponent.username).lower()] = int(opponent.id)
+                    _remember_username(getattr(opponent, 'username', None), opponent.id)
                 except Exception:
                     pass
             
             if not opponent:
-                return await message.reply(
+                return await _reply(
+                    message,
                     "❓ Нужно указать соперника!\n\n"
                     "Просто ответьте (Reply) на любое сообщение пользователя и напишите <code>/duel</code>",
                     parse_mode=ParseMode.HTML
                 )
             
             if opponent.id == challenger.id:
-                return await message.reply("Нельзя вызвать самого себя!")
+                return await _reply(message, "Нельзя вызвать самого себя!")
             
             # Проверка таймаута соперника
             if is_user_in_timeout(opponent.id):
-                return await message.reply("⛔ Соперник сейчас в таймауте и не может принять вызов!")
+                return await _reply(message, "⛔ Соперник сейчас в таймауте и не может принять вызов!")
             
             # Создание вызова
-            active_duel = {
+            st.active_duel = {
                 "challenger_id": challenger.id,
                 "challenger_name": challenger.full_name or challenger.first_name,
                 "challenger_username": getattr(challenger, 'username', None),
@@ -406,7 +565,8 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                 types.InlineKeyboardButton(text="❌ Отклонить", callback_data=f"duel_decline:{challenger.id}"),
             )
             
-            await message.reply(
+            await _reply(
+                message,
                 f"⚔️ {_mention(challenger.id, challenger.full_name or challenger.first_name)} вызывает "
                 f"{_mention(opponent.id, opponent.full_name or opponent.first_name)} на дуэль!\n\n"
                 f"Принять вызов?",
@@ -417,12 +577,12 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
             # Запланировать авто-сброс вызова через DUEL_PENDING_MINUTES, если не принят
             if scheduler:
                 try:
-                    expire_job_id = f"duel_expire_{int(active_duel['created_ts'])}"
-                    active_duel["expire_job_id"] = expire_job_id
-                    run_dt = datetime.fromtimestamp(active_duel["created_ts"] + DUEL_PENDING_MINUTES*60, tz=KALININGRAD_TZ)
+                    expire_job_id = f"duel_expire_{chat_id}_{int(st.active_duel['created_ts'])}"
+                    st.active_duel["expire_job_id"] = expire_job_id
+                    run_dt = datetime.fromtimestamp(st.active_duel["created_ts"] + DUEL_PENDING_MINUTES*60, tz=KALININGRAD_TZ)
                     if _main_loop:
                         scheduler.add_job(
-                            lambda: asyncio.run_coroutine_threadsafe(_expire_duel_if_pending(bot), _main_loop),
+                            lambda: asyncio.run_coroutine_threadsafe(_expire_duel_if_pending(bot, chat_id), _main_loop),
                         trigger='date',
                         run_date=run_dt,
                         id=expire_job_id,
@@ -431,92 +591,96 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                     log.exception("Failed to schedule duel expire job")
         except Exception:
             log.exception("Error in /duel")
-            await message.reply("⚠️ Ошибка при создании вызова")
+            await _reply(message, "⚠️ Ошибка при создании вызова")
     
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("duel_accept:"))
     async def cb_duel_accept(call: types.CallbackQuery) -> None:
         """Обработка принятия вызова на дуэль."""
-        global active_duel
+        st = state_for(call.message.chat.id)
         try:
-            if not active_duel or active_duel["status"] != "pending":
-                return await call.answer("Нет активного вызова", show_alert=True)
+            if not st.active_duel or st.active_duel["status"] != "pending":
+                return await _answer(call, "Нет активного вызова", show_alert=True)
             
             challenger_id_from_callback = int(call.data.split(":")[1])
-            if call.from_user.id != active_duel["opponent_id"]:
-                return await call.answer("Принять вызов может только вызванный игрок", show_alert=True)
+            if call.from_user.id != st.active_duel["opponent_id"]:
+                return await _answer(call, "Принять вызов может только вызванный игрок", show_alert=True)
             
-            if challenger_id_from_callback != active_duel["challenger_id"]:
-                return await call.answer("Этот вызов не для тебя", show_alert=True)
+            if challenger_id_from_callback != st.active_duel["challenger_id"]:
+                return await _answer(call, "Этот вызов не для тебя", show_alert=True)
             
             # Проверка таймаутов ещё раз
-            if is_user_in_timeout(active_duel["challenger_id"]) or is_user_in_timeout(active_duel["opponent_id"]):
-                active_duel = None
-                return await call.answer("Один из игроков в таймауте", show_alert=True)
+            if is_user_in_timeout(st.active_duel["challenger_id"]) or is_user_in_timeout(st.active_duel["opponent_id"]):
+                st.active_duel = None
+                return await _answer(call, "Один из игроков в таймауте", show_alert=True)
             
-            active_duel["status"] = "accepted"
-            active_duel["accepted_ts"] = _now_ts()
-            await call.answer()
+            st.active_duel["status"] = "accepted"
+            st.active_duel["accepted_ts"] = _now_ts()
+            await _answer(call)
             
             # Удаляем кнопки
             try:
-                await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+                await safe_telegram_call(bot.edit_message_reply_markup, call.message.chat.id, call.message.message_id, reply_markup=None, priority=PRIORITY_LOW)
             except Exception:
                 pass
             
             # Отменяем джобу истечения ожидания принятия
             try:
-                if scheduler and active_duel.get("expire_job_id"):
-                    scheduler.remove_job(active_duel["expire_job_id"]) 
-                    active_duel.pop("expire_job_id", None)
+                if scheduler and st.active_duel.get("expire_job_id"):
+                    scheduler.remove_job(st.active_duel["expire_job_id"]) 
+                    st.active_duel.pop("expire_job_id", None)
             except Exception:
                 pass
             
             # Объявляем старт дуэли и фазу болельщиков
-            chat_id = active_duel["chat_id"]
-            active_duel["challenger_fans"] = set()
-            active_duel["opponent_fans"] = set()
-            active_duel["fan_names"] = {}
-            active_duel["status"] = "betting"
-            active_duel["betting_start_ts"] = _now_ts()
-            
-            await bot.send_message(
+            chat_id = st.active_duel["chat_id"]
+            st.active_duel["challenger_fans"] = set()
+            st.active_duel["opponent_fans"] = set()
+            st.active_duel["fan_names"] = {}
+            st.active_duel["status"] = "betting"
+            st.active_duel["betting_start_ts"] = _now_ts()
+            
+            await safe_telegram_call(
+                bot.send_message,
                 chat_id,
                 f"🗡️ <b>Дуэль началась!</b>\n"
-                f"{_mention(active_duel['challenger_id'], active_duel['challenger_name'])} vs "
-                f"{_mention(active_duel['opponent_id'], active_duel['opponent_name'])}\n\n"
+                f"{_mention(st.active_duel['challenger_id'], st.active_duel['challenger_name'])} vs "
+                f"{_mention(st.active_duel['opponent_id'], st.active_duel['opponent_name'])}\n\n"
                 f"⏱️ <b>Время на выбор стороны: {DUEL_BETTING_MINUTES} минуты</b>\n"
                 f"Выберите, за кого вы болеете! Каждый болельщик добавляет +2% шанса (макс +30%).\n"
                 f"Болельщики разделяют судьбу своего чемпиона!",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_LOW,
             )
             
             # Кнопки для выбора стороны
             kb = types.InlineKeyboardMarkup()
             kb.add(
                 types.InlineKeyboardButton(
-                    text=f"⚔️ За {active_duel['challenger_name']}",
-                    callback_data=f"duel_fan:{active_duel['challenger_id']}"
+                    text=f"⚔️ За {st.active_duel['challenger_name']}",
+                    callback_data=f"duel_fan:{st.active_duel['challenger_id']}"
                 ),
                 types.InlineKeyboardButton(
-                    text=f"⚔️ За {active_duel['opponent_name']}",
-                    callback_data=f"duel_fan:{active_duel['opponent_id']}"
+                    text=f"⚔️ За {st.active_duel['opponent_name']}",
+                    callback_data=f"duel_fan:{st.active_duel['opponent_id']}"
                 ),
             )
             
-            betting_msg = await bot.send_message(
+            betting_msg = await safe_telegram_call(
+                bot.send_message,
                 chat_id,
                 f"👥 <b>Выберите сторону:</b>",
                 reply_markup=kb,
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_LOW,
             )
             
-            active_duel["betting_message_id"] = betting_msg.message_id
+            st.active_duel["betting_message_id"] = betting_msg.message_id if betting_msg else None
             
             # Планируем завершение фазы болельщиков через 2 минуты
             if scheduler:
                 try:
-                    betting_end_job_id = f"duel_betting_end_{int(_now_ts())}"
-                    active_duel["betting_end_job_id"] = betting_end_job_id
+                    betting_end_job_id = f"duel_betting_end_{chat_id}_{int(_now_ts())}"
+                    st.active_duel["betting_end_job_id"] = betting_end_job_id
                     run_dt = datetime.fromtimestamp(_now_ts() + DUEL_BETTING_MINUTES*60, tz=KALININGRAD_TZ)
                     if _main_loop:
                         scheduler.add_job(
@@ -531,8 +695,8 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
             # Планируем автоматическое завершение дуэли через 3 минуты максимум
             if scheduler:
                 try:
-                    max_duration_job_id = f"duel_max_duration_{int(_now_ts())}"
-                    active_duel["max_duration_job_id"] = max_duration_job_id
+                    max_duration_job_id = f"duel_max_duration_{chat_id}_{int(_now_ts())}"
+                    st.active_duel["max_duration_job_id"] = max_duration_job_id
                     run_dt = datetime.fromtimestamp(_now_ts() + DUEL_MAX_DURATION_MINUTES*60, tz=KALININGRAD_TZ)
                     if _main_loop:
                         scheduler.add_job(
@@ -546,48 +710,52 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
             
         except Exception:
             log.exception("Error in duel_accept callback")
-            active_duel = None
+            st.active_duel = None
             try:
-                await call.answer("Ошибка", show_alert=True)
+                await _answer(call, "Ошибка", show_alert=True)
             except Exception:
                 pass
 
     async def _end_betting_phase(bot: Bot, chat_id: int, scheduler) -> None:
         """Завершить фазу болельщиков и начать бой."""
-        global active_duel
+        st = state_for(chat_id)
         try:
-            if not active_duel or active_duel.get("status") != "betting":
+            if not st.active_duel or st.active_duel.get("status") != "betting":
                 return
             
             # Убираем кнопки
             try:
-                if active_duel.get("betting_message_id"):
-                    await bot.edit_message_reply_markup(
+                if st.active_duel.get("betting_message_id"):
+                    await safe_telegram_call(
+                        bot.edit_message_reply_markup,
                         chat_id,
-                        active_duel["betting_message_id"],
-                        reply_markup=None
+                        st.active_duel["betting_message_id"],
+                        reply_markup=None,
+                        priority=PRIORITY_LOW,
                     )
             except Exception:
                 pass
             
-            challenger_fans_count = len(active_duel.get("challenger_fans", set()))
-            opponent_fans_count = len(active_duel.get("opponent_fans", set()))
+            challenger_fans_count = len(st.active_duel.get("challenger_fans", set()))
+            opponent_fans_count = len(st.active_duel.get("opponent_fans", set()))
             
-            await bot.send_message(
+            await safe_telegram_call(
+                bot.send_message,
                 chat_id,
                 f"⏱️ Время на выбор стороны истекло!\n\n"
                 f"📊 <b>Статистика поддержки:</b>\n"
-                f"{_mention(active_duel['challenger_id'], active_duel['challenger_name'])}: {challenger_fans_count} болельщиков (+{min(challenger_fans_count * 2, 30)}% шанса)\n"
-                f"{_mention(active_duel['opponent_id'], active_duel['opponent_name'])}: {opponent_fans_count} болельщиков (+{min(opponent_fans_count * 2, 30)}% шанса)\n\n"
+                f"{_mention(st.active_duel['challenger_id'], st.active_duel['challenger_name'])}: {challenger_fans_count} болельщиков (+{min(challenger_fans_count * 2, 30)}% шанса)\n"
+                f"{_mention(st.active_duel['opponent_id'], st.active_duel['opponent_name'])}: {opponent_fans_count} болельщиков (+{min(opponent_fans_count * 2, 30)}% шанса)\n\n"
                 f"⚔️ Бой начинается...",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_LOW,
             )
             
             # Отменяем задачу максимальной длительности, так как дуэль завершается сейчас
             try:
-                if scheduler and active_duel.get("max_duration_job_id"):
-                    scheduler.remove_job(active_duel["max_duration_job_id"])
-                    active_duel.pop("max_duration_job_id", None)
+                if scheduler and st.active_duel.get("max_duration_job_id"):
+                    scheduler.remove_job(st.active_duel["max_duration_job_id"])
+                    st.active_duel.pop("max_duration_job_id", None)
             except Exception:
                 pass
             
@@ -600,119 +768,138 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
         except Exception:
             log.exception("Error in _end_betting_phase")
 
+    async def _refresh_fan_keyboard(duel: Dict[str, Any]) -> None:
+        """Показать текущий счёт на кнопках. Пока одно редактирование в очереди,
+        новые клики только помечают кнопки устаревшими — в итоге уходит одно
+        редактирование с последними цифрами, а не по одному на каждого болельщика."""
+        if duel.get("kb_refresh_running"):
+            duel["kb_refresh_dirty"] = True
+            return
+        duel["kb_refresh_running"] = True
+        try:
+            while True:
+                duel["kb_refresh_dirty"] = False
+                kb = types.InlineKeyboardMarkup()
+                kb.add(
+                    types.InlineKeyboardButton(
+                        text=f"⚔️ За {duel['challenger_name']} ({len(duel.get('challenger_fans', set()))})",
+                        callback_data=f"duel_fan:{duel['challenger_id']}"
+                    ),
+                    types.InlineKeyboardButton(
+                        text=f"⚔️ За {duel['opponent_name']} ({len(duel.get('opponent_fans', set()))})",
+                        callback_data=f"duel_fan:{duel['opponent_id']}"
+                    ),
+                )
+                await safe_telegram_call(
+                    bot.edit_message_reply_markup,
+                    duel["chat_id"],
+                    duel["betting_message_id"],
+                    reply_markup=kb,
+                    retries=1,
+                    priority=PRIORITY_LOW,
+                )
+                if not duel.get("kb_refresh_dirty") or duel.get("status") != "betting":
+                    break
+        finally:
+            duel["kb_refresh_running"] = False
+
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("duel_fan:"))
     async def cb_duel_fan(call: types.CallbackQuery) -> None:
         """Обработка выбора стороны болельщиком."""
-        global active_duel
+        st = state_for(call.message.chat.id)
         try:
-            if not active_duel or active_duel.get("status") != "betting":
-                return await call.answer("Фаза выбора стороны уже завершена", show_alert=True)
+            if not st.active_duel or st.active_duel.get("status") != "betting":
+                return await _answer(call, "Фаза выбора стороны уже завершена", show_alert=True)
             
             fan_id = call.from_user.id
             fan_name = call.from_user.full_name or call.from_user.first_name
             
             # Проверка таймаута болельщика
             if is_user_in_timeout(fan_id):
-                return await call.answer("Вы в таймауте и не можете поддерживать дуэлянтов", show_alert=True)
+                return await _answer(call, "Вы в таймауте и не можете поддерживать дуэлянтов", show_alert=True)
             
             # Нельзя поддерживать, если ты один из дуэлянтов
-            if fan_id in (active_duel["challenger_id"], active_duel["opponent_id"]):
-                return await call.answer("Дуэлянты не могут поддерживать себя", show_alert=True)
+            if fan_id in (st.active_duel["challenger_id"], st.active_duel["opponent_id"]):
+                return await _answer(call, "Дуэлянты не могут поддерживать себя", show_alert=True)
             
             # Получаем выбранную сторону
             parts = call.data.split(":")
             if len(parts) < 2:
-                return await call.answer("Ошибка данных", show_alert=True)
+                return await _answer(call, "Ошибка данных", show_alert=True)
             
             chosen_side_id = int(parts[1])
             
             # Проверяем, не выбрал ли уже сторону
-            if fan_id in active_duel.get("challenger_fans", set()) or fan_id in active_duel.get("opponent_fans", set()):
-                return await call.answer("Вы уже выбрали сторону!", show_alert=True)
+            if fan_id in st.active_duel.get("challenger_fans", set()) or fan_id in st.active_duel.get("opponent_fans", set()):
+                return await _answer(call, "Вы уже выбрали сторону!", show_alert=True)
             
             # Добавляем болельщика
-            if chosen_side_id == active_duel["challenger_id"]:
-                active_duel["challenger_fans"].add(fan_id)
-                side_name = active_duel["challenger_name"]
-            elif chosen_side_id == active_duel["opponent_id"]:
-                active_duel["opponent_fans"].add(fan_id)
-                side_name = active_duel["opponent_name"]
+            if chosen_side_id == st.active_duel["challenger_id"]:
+                st.active_duel["challenger_fans"].add(fan_id)
+                side_name = st.active_duel["challenger_name"]
+            elif chosen_side_id == st.active_duel["opponent_id"]:
+                st.active_duel["opponent_fans"].add(fan_id)
+                side_name = st.active_duel["opponent_name"]
             else:
-                return await call.answer("Ошибка: неизвестная сторона", show_alert=True)
+                return await _answer(call, "Ошибка: неизвестная сторона", show_alert=True)
             
-            active_duel["fan_names"][str(fan_id)] = fan_name
+            st.active_duel["fan_names"][str(fan_id)] = fan_name
             
-            await call.answer(f"✅ Вы поддержали {side_name}!", show_alert=False)
+            await _answer(call, f"✅ Вы поддержали {side_name}!", show_alert=False)
             
             # Обновляем сообщение с кнопками (можно показать текущий счет)
-            challenger_fans_count = len(active_duel.get("challenger_fans", set()))
-            opponent_fans_count = len(active_duel.get("opponent_fans", set()))
-            
             try:
-                if active_duel.get("betting_message_id"):
-                    kb = types.InlineKeyboardMarkup()
-                    kb.add(
-                        types.InlineKeyboardButton(
-                            text=f"⚔️ За {active_duel['challenger_name']} ({challenger_fans_count})",
-                            callback_data=f"duel_fan:{active_duel['challenger_id']}"
-                        ),
-                        types.InlineKeyboardButton(
-                            text=f"⚔️ За {active_duel['opponent_name']} ({opponent_fans_count})",
-                            callback_data=f"duel_fan:{active_duel['opponent_id']}"
-                        ),
-                    )
-                    await bot.edit_message_reply_markup(
-                        active_duel["chat_id"],
-                        active_duel["betting_message_id"],
-                        reply_markup=kb
-                    )
+                if st.active_duel.get("betting_message_id"):
+                    await _refresh_fan_keyboard(st.active_duel)
             except Exception:
                 pass  # Игнорируем ошибки редактирования
             
         except Exception:
             log.exception("Error in duel_fan callback")
             try:
-                await call.answer("Ошибка", show_alert=True)
+                await _answer(call, "Ошибка", show_alert=True)
             except Exception:
                 pass
     
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("duel_decline:"))
     async def cb_duel_decline(call: types.CallbackQuery) -> None:
         """Обработка отклонения вызова на дуэль."""
-        global active_duel
+        st = state_for(call.message.chat.id)
         try:
-            if not active_duel or active_duel["status"] != "pending":
-                return await call.answer("Нет активного вызова", show_alert=True)
+            if not st.active_duel or st.active_duel["status"] != "pending":
+                return await _answer(call, "Нет активного вызова", show_alert=True)
             
-            if call.from_user.id not in (active_duel["challenger_id"], active_duel["opponent_id"]):
-                return await call.answer("Отклонить может только участник дуэли", show_alert=True)
+            if call.from_user.id not in (st.active_duel["challenger_id"], st.active_duel["opponent_id"]):
+                return await _answer(call, "Отклонить может только участник дуэли", show_alert=True)
             
-            await call.answer()
+            await _answer(call)
             
             # Удаляем кнопки
             try:
-                await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+                await safe_telegram_call(bot.edit_message_reply_markup, call.message.chat.id, call.message.message_id, reply_markup=None, priority=PRIORITY_LOW)
             except Exception:
                 pass
             
-            await bot.send_message(
-                active_duel["chat_id"],
+            await safe_telegram_call(
+                bot.send_message,
+                st.active_duel["chat_id"],
                 f"❌ {_mention(call.from_user.id, call.from_user.full_name or call.from_user.first_name)} отклонил вызов на дуэль.",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_LOW,
             )
             
             # Отменяем задачи
             try:
-                if scheduler and active_duel.get("expire_job_id"):
-                    scheduler.remove_job(active_duel["expire_job_id"])
+                if scheduler and st.active_duel.get("expire_job_id"):
+                    scheduler.remove_job(st.active_duel["expire_job_id"])
             except Exception:
                 pass
             
-            active_duel = None
+            st.active_duel = None
             
         except Exception:
             log.exception("Error in duel_decline callback")
-            active_duel = None
+            st.active_duel = None
     
     @dp.message_handler(commands=["mute"])    
     async def cmd_mute(message: types.Message) -> None:
@@ -722,9 +909,11 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                 return
             
             if not message.reply_to_message or not message.reply_to_message.from_user:
-                return await message.reply(
+                return await _reply(
+                    message,
                     "Ответьте на сообщение пользователя, которого хотите замутить, и укажите время: /mute [минуты]\n"
-                    "Например: /mute 60"
+                    "Например: /mute 60",
+                    priority=PRIORITY_NORMAL,
                 )
             
             target_user = message.reply_to_message.from_user
@@ -747,14 +936,16 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                 bot,
                 minutes
             )
-            await message.reply(
+            await _reply(
+                message,
                 f"🔇 Пользователь {_mention(target_user.id, target_user.full_name or target_user.first_name)} замьючен на {minutes} минут.",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_NORMAL,
             )
         except Exception:
             log.exception("Error in /mute")
             try:
-                await message.reply("Ошибка выполнения команды /mute")
+                await _reply(message, "Ошибка выполнения команды /mute", priority=PRIORITY_NORMAL)
             except Exception:
                 pass
     
@@ -766,31 +957,38 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                 return
             
             if not message.reply_to_message or not message.reply_to_message.from_user:
-                return await message.reply(
-                    "Ответьте на сообщение пользователя, которого хотите размутить: /unmute"
+                return await _reply(
+                    message,
+                    "Ответьте на сообщение пользователя, которого хотите размутить: /unmute",
+                    priority=PRIORITY_NORMAL,
                 )
             
             target_user = message.reply_to_message.from_user
             
             await remove_timeout(target_user.id)
-            await message.reply(
+            await _reply(
+                message,
                 f"✅ Пользователь {_mention(target_user.id, target_user.full_name or target_user.first_name)} размучен.",
                 parse_mode=ParseMode.HTML,
+                priority=PRIORITY_NORMAL,
             )
         except Exception:
             log.exception("Error in /unmute")
             try:
-                await message.reply("Ошибка выполнения команды /unmute")
+                await _reply(message, "Ошибка выполнения команды /unmute", priority=PRIORITY_NORMAL)
             except Exception:
                 pass
     
     @dp.message_handler(content_types=types.ContentType.ANY)
     async def handle_timeout_messages(message: types.Message) -> None:
-        """Блокировать новые сообщения от пользователей в таймауте (кроме команд)."""
+        """Блокировать новые сообщения от пользователей в таймауте (кроме команд).
+
+        Запасной путь: если бот ограничил участника через restrictChatMember, сообщений от него не будет.
+        Удаление уходит в фоновую очередь (пачками через deleteMessages), обработчик не ждёт Telegram.
+        """
         # Актуализируем карту username -> user_id при любом сообщении
         try:
-            if getattr(message.from_user, 'username', None):
-                username_to_userid[str(message.from_user.username).lower()] = int(message.from_user.id)
+            _remember_username(getattr(message.from_user, 'username', None), message.from_user.id)
         except Exception:
             pass
         # Проверяем таймаут только для НЕ команд (команды обрабатываются другими handlers)
@@ -800,16 +998,15 @@ def setup_duel_handlers(dp: Dispatcher, bot: Bot, scheduler, safe_telegram_call_
                 return
             # Блокируем любые другие сообщения от пользователя в таймауте
             try:
-                await bot.delete_message(message.chat.id, message.message_id)
+                await queue_delete(bot, message.chat.id, message.message_id)
             except Exception:
                 pass
 
 # Функции для управления флагом дуэлей (используются из bot.py)
-def set_duels_enabled(enabled: bool) -> None:
-    """Установить состояние дуэлей (включено/выключено)."""
-    global duels_enabled
-    duels_enabled = bool(enabled)
-
-def get_duels_enabled() -> bool:
-    """Получить текущее состояние дуэлей."""
-    return duels_enabled
+def set_duels_enabled(enabled: bool, chat_id: Any = None) -> None:
+    """Установить состояние дуэлей в чате (включено/выключено)."""
+    state_for(chat_id).enabled = bool(enabled)
+
+def get_duels_enabled(chat_id: Any = None) -> bool:
+    """Получить текущее состояние дуэлей в чате."""
+    return state_for(chat_id).enabled
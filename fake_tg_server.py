@@ -0,0 +1,494 @@
+"""Локальная замена Telegram Bot API для нагрузочных и сквозных прогонов без api.telegram.org.
+
+Реализует методы, которыми пользуется бот: getMe, getUpdates, setWebhook/deleteWebhook,
+sendMessage, sendPoll, stopPoll, pin/unpinChatMessage, editMessageText/ReplyMarkup,
+deleteMessage(s), answerCallbackQuery, sendDocument, getChatMember, restrictChatMember. Ответы — в формате Bot API,
+так что aiogram разбирает их (и ошибки 429/5xx) как настоящие.
+
+	python fake_tg_server.py --port 8081 --users 40 --latency 0.05 --error-429 0.02
+	TG_API_BASE=http://127.0.0.1:8081 python bot.py
+
+Скриптовая «группа» из --users участников голосует в каждом новом опросе и жмёт
+кнопки с callback_data из --click-prefix. Обновления отдаются через getUpdates или
+пушатся на адрес из setWebhook. Служебные адреса:
+	GET  /_stats    — счётчики вызовов, ответов и внедрённых ошибок (JSON)
+	POST /_reset    — обнулить счётчики
+	POST /_command  — {"text": "/startpoll ...", "user_id": ...} — сообщение от участника или админа
+	POST /_update   — произвольное сырое обновление в очередь
+"""
+from __future__ import annotations
+
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import aiohttp
+from aiohttp import web
+
+log = logging.getLogger("fake_tg")
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Local", "username": "local_test_bot"}
+USER_ID_BASE = 700000
+
+# Параметры, которые aiogram передаёт строкой JSON
+_JSON_PARAMS = {"reply_markup", "options", "message_ids", "permissions", "allowed_updates", "entities"}
+_INT_PARAMS = {"chat_id", "message_id", "offset", "limit", "timeout", "from_chat_id", "user_id", "until_date"}
+
+def _parse_params(raw: Dict[str, Any]) -> Dict[str, Any]:
+	params: Dict[str, Any] = {}
+	for key, value in raw.items():
+		if not isinstance(value, str):
+			params[key] = value
+		elif key in _JSON_PARAMS:
+			try:
+				params[key] = json.loads(value)
+			except ValueError:
+				params[key] = value
+		elif key in _INT_PARAMS:
+			try:
+				params[key] = int(value)
+			except ValueError:
+				params[key] = value
+		elif value in ("True", "true"):
+			params[key] = True
+		elif value in ("False", "false"):
+			params[key] = False
+		else:
+			params[key] = value
+	return params
+
+def _ok(result: Any) -> web.Response:
+	return web.json_response({"ok": True, "result": result})
+
+def _error(status: int, description: str, **parameters: Any) -> web.Response:
+	body: Dict[str, Any] = {"ok": False, "error_code": status, "description": description}
+	if parameters:
+		body["parameters"] = parameters
+	return web.json_response(body, status=status)
+
+class _SlidingWindow:
+	"""Лимит n событий за period секунд; wait() — сколько ждать до следующего разрешённого."""
+
+	def __init__(self, limit: int, period: float) -> None:
+		self.limit = limit
+		self.period = period
+		self.events: Deque[float] = deque()
+
+	def wait(self, now: float) -> float:
+		while self.events and now - self.events[0] >= self.period:
+			self.events.popleft()
+		if len(self.events) < self.limit:
+			self.events.append(now)
+			return 0.0
+		return self.period - (now - self.events[0])
+
+class FakeTelegram:
+	"""Состояние поддельного Bot API: сообщения, опросы, очередь обновлений, лимиты и скриптовые участники."""
+
+	def __init__(self, args: argparse.Namespace) -> None:
+		self.args = args
+		self.rnd = random.Random(args.seed)
+		self.stats: Counter = Counter()
+		self.latency_total = 0.0
+		self.updates: List[Dict[str, Any]] = []
+		self.update_id = 0
+		self.new_updates = asyncio.Event()
+		self.webhook_url = ""
+		self.webhook_secret = ""
+		self.message_ids: Dict[int, int] = {}
+		self.polls: Dict[str, Dict[str, Any]] = {}
+		self.restricted: Dict[tuple, int] = {}  # (chat_id, user_id) -> until_date
+		self.users = [{"id": USER_ID_BASE + i, "is_bot": False, "first_name": f"Player{i}", "username": f"player{i}"} for i in range(args.users)]
+		self.global_window = _SlidingWindow(args.global_per_second, 1.0) if args.global_per_second else None
+		self.chat_windows: Dict[int, _SlidingWindow] = {}
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._tasks: set = set()
+		self._kickoff = list(args.kickoff)
+
+	# -------------------- Обновления --------------------
+	def push_update(self, payload: Dict[str, Any]) -> None:
+		self.update_id += 1
+		update = {"update_id": self.update_id}
+		update.update(payload)
+		self.stats["updates_generated"] += 1
+		if self.webhook_url:
+			self._spawn(self._deliver(update))
+		else:
+			self.updates.append(update)
+			self.new_updates.set()
+
+	async def _deliver(self, update: Dict[str, Any]) -> None:
+		if self._session is None:
+			self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+		headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+		try:
+			async with self._session.post(self.webhook_url, json=update, headers=headers) as resp:
+				self.stats[f"webhook_{resp.status}"] += 1
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			self.stats["webhook_failed"] += 1
+
+	def _spawn(self, coro: Any) -> None:
+		task = asyncio.create_task(coro)
+		self._tasks.add(task)
+		task.add_done_callback(self._tasks.discard)
+
+	async def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+		offset = int(params.get("offset") or 0)
+		if offset:
+			self.updates = [u for u in self.updates if u["update_id"] >= offset]
+		if not self.updates and params.get("timeout"):
+			self.new_updates.clear()
+			try:
+				await asyncio.wait_for(self.new_updates.wait(), timeout=min(int(params["timeout"]), 30))
+			except asyncio.TimeoutError:
+				pass
+		return self.updates[: int(params.get("limit") or 100)]
+
+	def _bot_ready(self) -> None:
+		"""Бот начал принимать обновления (и уже сбросил старые) — отправить команды --kickoff."""
+		pending, self._kickoff = self._kickoff, []
+		for text in pending:
+			self.command(text)
+
+	def command(self, text: str, user_id: Optional[int] = None, chat_id: Optional[int] = None) -> None:
+		"""Сообщение в группу от участника (или от админа при user_id=admin)."""
+		uid = user_id or self.args.admin_id
+		sender = next((u for u in self.users if u["id"] == uid), {"id": uid, "is_bot": False, "first_name": "Admin"})
+		chat_id = chat_id or self.args.chat_id
+		message = self._message(chat_id, sender, text=text)
+		if text.startswith("/"):
+			message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+		self.push_update({"message": message})
+
+	# -------------------- Сообщения --------------------
+	def _message(self, chat_id: int, sender: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+		self.message_ids[chat_id] = self.message_ids.get(chat_id, 0) + 1
+		msg = {
+			"message_id": self.message_ids[chat_id],
+			"date": int(time.time()),
+			"chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private", "title": "Local"},
+			"from": sender,
+		}
+		msg.update({k: v for k, v in fields.items() if v is not None})
+		return msg
+
+	def _bot_message(self, params: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+		msg = self._message(int(params.get("chat_id", 0)), BOT_USER, **fields)
+		markup = params.get("reply_markup")
+		if isinstance(markup, dict) and markup.get("inline_keyboard"):
+			msg["reply_markup"] = markup
+			self._schedule_clicks(msg)
+		return msg
+
+	def _check_limits(self, method: str, params: Dict[str, Any]) -> Optional[web.Response]:
+		"""Flood control как у Telegram: общий лимит бота и лимит сообщений в группу."""
+		now = time.monotonic()
+		if self.global_window is not None:
+			wait = self.global_window.wait(now)
+			if wait > 0:
+				return self._flood(wait)
+		chat_id = params.get("chat_id")
+		if self.args.chat_per_minute and isinstance(chat_id, int) and method.startswith(("send", "edit")):
+			window = self.chat_windows.setdefault(chat_id, _SlidingWindow(self.args.chat_per_minute, 60.0))
+			wait = window.wait(now)
+			if wait > 0:
+				return self._flood(wait)
+		return None
+
+	def _flood(self, wait: float) -> web.Response:
+		retry_after = max(1, int(wait + 0.999))
+		self.stats["flood_429"] += 1
+		return _error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+
+	def _inject_error(self) -> Optional[web.Response]:
+		roll = self.rnd.random()
+		if roll < self.args.error_429:
+			self.stats["injected_429"] += 1
+			return _error(429, f"Too Many Requests: retry after {self.args.retry_after}", retry_after=self.args.retry_after)
+		if roll < self.args.error_429 + self.args.error_5xx:
+			self.stats["injected_5xx"] += 1
+			return _error(502, "Bad Gateway")
+		return None
+
+	async def call(self, method: str, params: Dict[str, Any]) -> web.Response:
+		self.stats[f"call_{method}"] += 1
+		if method not in ("getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo"):
+			if self.args.latency or self.args.jitter:
+				delay = max(0.0, self.args.latency + self.rnd.uniform(-self.args.jitter, self.args.jitter))
+				self.latency_total += delay
+				await asyncio.sleep(delay)
+			failure = self._inject_error() or self._check_limits(method, params)
+			if failure is not None:
+				return failure
+		handler = getattr(self, f"m_{method}", None)
+		if handler is None:
+			self.stats["not_found"] += 1
+			return _error(404, "Not Found: method not found")
+		result = handler(params)
+		if asyncio.iscoroutine(result):
+			result = await result
+		if isinstance(result, web.Response):
+			return result
+		return _ok(result)
+
+	# -------------------- Методы Bot API --------------------
+	def m_getMe(self, params: Dict[str, Any]) -> Any:
+		return BOT_USER
+
+	async def m_getUpdates(self, params: Dict[str, Any]) -> Any:
+		if self.webhook_url:
+			return _error(409, "Conflict: can't use getUpdates method while webhook is active; use deleteWebhook to delete the webhook first")
+		self._bot_ready()
+		return await self.get_updates(params)
+
+	def m_setWebhook(self, params: Dict[str, Any]) -> Any:
+		self.webhook_url = params.get("url", "")
+		self.webhook_secret = params.get("secret_token", "")
+		if self.webhook_url and self.updates:
+			pending, self.updates = self.updates, []
+			for update in pending:
+				self._spawn(self._deliver(update))
+		if self.webhook_url:
+			self._bot_ready()
+		return True
+
+	def m_deleteWebhook(self, params: Dict[str, Any]) -> Any:
+		self.webhook_url = ""
+		if params.get("drop_pending_updates"):
+			self.updates = []
+		return True
+
+	def m_getWebhookInfo(self, params: Dict[str, Any]) -> Any:
+		return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": len(self.updates)}
+
+	def m_sendMessage(self, params: Dict[str, Any]) -> Any:
+		return self._bot_message(params, text=params.get("text", ""))
+
+	def m_sendDocument(self, params: Dict[str, Any]) -> Any:
+		return self._bot_message(params, document={"file_id": f"doc{self.update_id}", "file_unique_id": f"doc{self.update_id}"}, caption=params.get("caption"))
+
+	def m_sendPoll(self, params: Dict[str, Any]) -> Any:
+		options = [o if isinstance(o, str) else o.get("text", "") for o in params.get("options") or []]
+		poll_id = f"local{len(self.polls) + 1}"
+		poll = {
+			"id": poll_id,
+			"question": params.get("question", ""),
+			"options": [{"text": o, "voter_count": 0} for o in options],
+			"total_voter_count": 0,
+			"is_closed": False,
+			"is_anonymous": bool(params.get("is_anonymous", False)),
+			"type": "regular",
+			"allows_multiple_answers": bool(params.get("allows_multiple_answers", False)),
+		}
+		msg = self._bot_message(params, poll=poll)
+		self.polls[poll_id] = {"poll": poll, "chat_id": msg["chat"]["id"], "message_id": msg["message_id"]}
+		self._schedule_votes(poll_id, len(options))
+		return msg
+
+	def m_stopPoll(self, params: Dict[str, Any]) -> Any:
+		for entry in self.polls.values():
+			if entry["chat_id"] == params.get("chat_id") and entry["message_id"] == params.get("message_id"):
+				entry["poll"]["is_closed"] = True
+				return entry["poll"]
+		return _error(400, "Bad Request: poll not found")
+
+	def m_pinChatMessage(self, params: Dict[str, Any]) -> Any:
+		return True
+
+	def m_unpinChatMessage(self, params: Dict[str, Any]) -> Any:
+		return True
+
+	def m_editMessageText(self, params: Dict[str, Any]) -> Any:
+		return self._message(int(params.get("chat_id", 0)), BOT_USER, text=params.get("text", ""))
+
+	def m_editMessageReplyMarkup(self, params: Dict[str, Any]) -> Any:
+		msg = {"message_id": params.get("message_id"), "date": int(time.time()), "chat": {"id": params.get("chat_id"), "type": "supergroup"}, "from": BOT_USER}
+		if isinstance(params.get("reply_markup"), dict):
+			msg["reply_markup"] = params["reply_markup"]
+		return msg
+
+	def m_deleteMessage(self, params: Dict[str, Any]) -> Any:
+		self.stats["deleted"] += 1
+		return True
+
+	def m_deleteMessages(self, params: Dict[str, Any]) -> Any:
+		if self.args.no_bulk_delete:
+			return _error(404, "Not Found: method not found")
+		ids = params.get("message_ids") or []
+		if not 1 <= len(ids) <= 100:
+			return _error(400, "Bad Request: message_ids must contain 1-100 elements")
+		self.stats["deleted"] += len(ids)
+		return True
+
+	def m_answerCallbackQuery(self, params: Dict[str, Any]) -> Any:
+		return True
+
+	def m_getChatMember(self, params: Dict[str, Any]) -> Any:
+		user_id = params.get("user_id")
+		if user_id == BOT_USER["id"]:
+			if self.args.no_restrict:
+				return {"status": "member", "user": BOT_USER}
+			return {"status": "administrator", "user": BOT_USER, "can_be_edited": False, "can_restrict_members": True, "can_delete_messages": True}
+		user = next((u for u in self.users if u["id"] == user_id), {"id": user_id, "is_bot": False, "first_name": str(user_id)})
+		until = self.restricted.get((params.get("chat_id"), user_id))
+		if until is not None:
+			return {"status": "restricted", "user": user, "is_member": True, "can_send_messages": False, "until_date": until}
+		return {"status": "member", "user": user}
+
+	def m_restrictChatMember(self, params: Dict[str, Any]) -> Any:
+		if self.args.no_restrict:
+			return _error(400, "Bad Request: not enough rights to restrict/unrestrict chat member")
+		key = (params.get("chat_id"), params.get("user_id"))
+		permissions = params.get("permissions") or {}
+		if permissions.get("can_send_messages"):
+			self.restricted.pop(key, None)
+			self.stats["unrestricted"] += 1
+		else:
+			self.restricted[key] = params.get("until_date") or 0
+			self.stats["restricted"] += 1
+		return True
+
+	# -------------------- Скриптовые участники --------------------
+	def _schedule_votes(self, poll_id: str, options: int) -> None:
+		if not options:
+			return
+		weights = self.args.weights[:options] if self.args.weights else [1.0] * options
+		weights += [0.0] * (options - len(weights))
+		for voter in self.users:
+			if self.rnd.random() >= self.args.turnout:
+				continue
+			delay = self.rnd.uniform(0, self.args.vote_window)
+			choice = self.rnd.choices(range(options), weights=weights)[0]
+			self._spawn(self._vote_later(poll_id, voter, choice, delay))
+
+	async def _vote_later(self, poll_id: str, voter: Dict[str, Any], choice: int, delay: float) -> None:
+		await asyncio.sleep(delay)
+		entry = self.polls.get(poll_id)
+		if entry is None or entry["poll"]["is_closed"]:
+			return
+		self.push_update({"poll_answer": {"poll_id": poll_id, "user": voter, "option_ids": [choice]}})
+		if self.rnd.random() < self.args.revote:
+			await asyncio.sleep(self.rnd.uniform(0, self.args.vote_window))
+			self.push_update({"poll_answer": {"poll_id": poll_id, "user": voter, "option_ids": []}})
+
+	def _schedule_clicks(self, msg: Dict[str, Any]) -> None:
+		buttons = [b for row in msg["reply_markup"]["inline_keyboard"] for b in row if str(b.get("callback_data", "")).startswith(tuple(self.args.click_prefix))]
+		if not buttons:
+			return
+		for clicker in self.users:
+			if self.rnd.random() >= self.args.click_rate:
+				continue
+			button = self.rnd.choice(buttons)
+			self._spawn(self._click_later(msg, clicker, button["callback_data"], self.rnd.uniform(0, self.args.click_window)))
+
+	async def _click_later(self, msg: Dict[str, Any], clicker: Dict[str, Any], data: str, delay: float) -> None:
+		await asyncio.sleep(delay)
+		# id колбэка совпадает с update_id, который получит это обновление
+		self.push_update({"callback_query": {
+			"id": f"cb{self.update_id + 1}",
+			"from": clicker,
+			"chat_instance": str(msg["chat"]["id"]),
+			"message": {k: msg[k] for k in ("message_id", "date", "chat", "from")},
+			"data": data,
+		}})
+
+	async def close(self) -> None:
+		for task in list(self._tasks):
+			task.cancel()
+		if self._session is not None:
+			await self._session.close()
+
+def create_app(args: argparse.Namespace) -> web.Application:
+	fake = FakeTelegram(args)
+
+	async def api(request: web.Request) -> web.Response:
+		raw: Dict[str, Any] = dict(request.query)
+		if request.method == "POST":
+			if request.content_type == "application/json":
+				raw.update(await request.json())
+			else:
+				post = await request.post()
+				raw.update({k: v for k, v in post.items() if isinstance(v, str)})
+		return await fake.call(request.match_info["method"], _parse_params(raw))
+
+	async def stats(request: web.Request) -> web.Response:
+		calls = {k[5:]: v for k, v in fake.stats.items() if k.startswith("call_")}
+		other = {k: v for k, v in fake.stats.items() if not k.startswith("call_")}
+		return web.json_response({"calls": calls, "calls_total": sum(calls.values()), "latency_seconds_total": round(fake.latency_total, 3), **other})
+
+	async def reset(request: web.Request) -> web.Response:
+		fake.stats.clear()
+		fake.latency_total = 0.0
+		return web.json_response({"ok": True})
+
+	async def command(request: web.Request) -> web.Response:
+		body = await request.json()
+		fake.command(body["text"], body.get("user_id"), body.get("chat_id"))
+		return web.json_response({"ok": True})
+
+	async def update(request: web.Request) -> web.Response:
+		fake.push_update(await request.json())
+		return web.json_response({"ok": True})
+
+	async def cleanup(app: web.Application) -> None:
+		await fake.close()
+
+	app = web.Application()
+	app["fake"] = fake
+	app.router.add_route("*", "/bot{token}/{method}", api)
+	app.router.add_get("/_stats", stats)
+	app.router.add_post("/_reset", reset)
+	app.router.add_post("/_command", command)
+	app.router.add_post("/_update", update)
+	app.on_cleanup.append(cleanup)
+	return app
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8081)
+	parser.add_argument("--chat-id", type=int, default=-1002841862533, help="группа, в которую пишут скриптовые участники")
+	parser.add_argument("--admin-id", type=int, default=914344682, help="от чьего имени идут /_command и --kickoff")
+	parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа на вызов API, с")
+	parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки ±, с")
+	parser.add_argument("--error-429", type=float, default=0.0, help="доля вызовов, получающих 429 с retry_after")
+	parser.add_argument("--retry-after", type=int, default=3)
+	parser.add_argument("--error-5xx", type=float, default=0.0, help="доля вызовов, получающих 502")
+	parser.add_argument("--global-per-second", type=int, default=0, help="лимит вызовов бота в секунду (0 — без лимита)")
+	parser.add_argument("--chat-per-minute", type=int, default=0, help="лимит send*/edit* в один чат в минуту (0 — без лимита)")
+	parser.add_argument("--users", type=int, default=30, help="скриптовых участников группы")
+	parser.add_argument("--turnout", type=float, default=0.9, help="доля участников, голосующих в опросе")
+	parser.add_argument("--weights", type=lambda s: [float(x) for x in s.split(",")], default=None, help="веса вариантов опроса, напр. 0.6,0.2,0.2")
+	parser.add_argument("--vote-window", type=float, default=10.0, help="голоса приходят в течение стольких секунд после опроса")
+	parser.add_argument("--revote", type=float, default=0.05, help="доля голосовавших, которые потом снимают голос")
+	parser.add_argument("--click-prefix", action="append", default=None, help="callback_data, на которые жмут участники (по умолчанию duel_fan:)")
+	parser.add_argument("--click-rate", type=float, default=0.8)
+	parser.add_argument("--click-window", type=float, default=5.0)
+	parser.add_argument("--no-restrict", action="store_true", help="у бота нет права ограничивать участников (getChatMember: member, restrictChatMember: 400)")
+	parser.add_argument("--no-bulk-delete", action="store_true", help="deleteMessages отвечает 404, как старый Bot API server")
+	parser.add_argument("--kickoff", action="append", default=[], help="команда от админа, как только бот начнёт получать обновления, напр. \"/startpoll Игра? | Да | Нет\"")
+	parser.add_argument("--seed", type=int, default=1)
+	args = parser.parse_args(argv)
+	if args.click_prefix is None:
+		args.click_prefix = ["duel_fan:"]
+	return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+	args = parse_args(argv)
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+	log.info("Fake Bot API on http://%s:%s (users=%s, latency=%ss, 429=%s, 5xx=%s)", args.host, args.port, args.users, args.latency, args.error_429, args.error_5xx)
+	web.run_app(create_app(args), host=args.host, port=args.port, print=None)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
+
+
+
+
+
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from typing import Any, List, Optional
+import pickle
+import sqlite3
+import threading
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+class SQLiteJobStore(BaseJobStore):
+	"""Постоянное хранилище заданий APScheduler в файле SQLite (stdlib sqlite3, без SQLAlchemy).
+
+	Схема и поведение — как у SQLAlchemyJobStore: задание хранится целиком (pickle),
+	next_run_time — UTC timestamp для выборки ближайших. Задания должны ссылаться
+	на функции модулей по имени и иметь сериализуемые аргументы.
+	"""
+
+	def __init__(self, path: str, tablename: str = "apscheduler_jobs", pickle_protocol: int = pickle.HIGHEST_PROTOCOL) -> None:
+		super().__init__()
+		self.path = path
+		self.tablename = tablename
+		self.pickle_protocol = pickle_protocol
+		self._conn: Optional[sqlite3.Connection] = None
+		self._lock = threading.RLock()
+
+	def _connect(self) -> sqlite3.Connection:
+		if self._conn is None:
+			conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute(f"CREATE TABLE IF NOT EXISTS {self.tablename} (id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)")
+			conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.tablename}_next_run_time ON {self.tablename} (next_run_time)")
+			self._conn = conn
+		return self._conn
+
+	def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+		with self._lock:
+			return self._connect().execute(sql, params)
+
+	def start(self, scheduler: Any, alias: str) -> None:
+		super().start(scheduler, alias)
+		self._connect()
+
+	def shutdown(self) -> None:
+		with self._lock:
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+
+	def lookup_job(self, job_id: str) -> Optional[Job]:
+		row = self._execute(f"SELECT job_state FROM {self.tablename} WHERE id = ?", (job_id,)).fetchone()
+		return self._reconstitute_job(row[0]) if row else None
+
+	def get_due_jobs(self, now: Any) -> List[Job]:
+		return self._get_jobs("WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now),))
+
+	def get_next_run_time(self) -> Any:
+		row = self._execute(f"SELECT next_run_time FROM {self.tablename} WHERE next_run_time IS NOT NULL ORDER BY next_run_time LIMIT 1").fetchone()
+		return utc_timestamp_to_datetime(row[0]) if row else None
+
+	def get_all_jobs(self) -> List[Job]:
+		jobs = self._get_jobs()
+		self._fix_paused_jobs_sorting(jobs)
+		return jobs
+
+	def add_job(self, job: Job) -> None:
+		try:
+			self._execute(
+				f"INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)",
+				(job.id, datetime_to_utc_timestamp(job.next_run_time), pickle.dumps(job.__getstate__(), self.pickle_protocol)),
+			)
+		except sqlite3.IntegrityError:
+			raise ConflictingIdError(job.id)
+
+	def update_job(self, job: Job) -> None:
+		cur = self._execute(
+			f"UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?",
+			(datetime_to_utc_timestamp(job.next_run_time), pickle.dumps(job.__getstate__(), self.pickle_protocol), job.id),
+		)
+		if cur.rowcount == 0:
+			raise JobLookupError(job.id)
+
+	def remove_job(self, job_id: str) -> None:
+		cur = self._execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+		if cur.rowcount == 0:
+			raise JobLookupError(job_id)
+
+	def remove_all_jobs(self) -> None:
+		self._execute(f"DELETE FROM {self.tablename}")
+
+	def _reconstitute_job(self, job_state: bytes) -> Job:
+		state = pickle.loads(job_state)
+		state["jobstore"] = self
+		job = Job.__new__(Job)
+		job.__setstate__(state)
+		job._scheduler = self._scheduler
+		job._jobstore_alias = self._alias
+		return job
+
+	def _get_jobs(self, where: str = "", params: tuple = ()) -> List[Job]:
+		jobs: List[Job] = []
+		failed: List[str] = []
+		# NULL (приостановленные) в SQLite идут первыми — get_all_jobs переставит их в конец
+		rows = self._execute(f"SELECT id, job_state FROM {self.tablename} {where} ORDER BY next_run_time", params).fetchall()
+		for job_id, job_state in rows:
+			try:
+				jobs.append(self._reconstitute_job(job_state))
+			except BaseException:
+				self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+				failed.append(job_id)
+		for job_id in failed:
+			self._execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+		return jobs
+
+	def __repr__(self) -> str:
+		return f"<{self.__class__.__name__} (path={self.path})>"
+
+
+
+
+
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+class StdoutFilter(logging.Filter):
+	def filter(self, record: logging.LogRecord) -> bool:
+		return record.levelno < logging.ERROR
+
+class JsonFormatter(logging.Formatter):
+	"""Одна JSON-строка на запись: время, уровень, логгер, сообщение и (если есть) traceback."""
+
+	def format(self, record: logging.LogRecord) -> str:
+		payload = {
+			"ts": self.formatTime(record),
+			"level": record.levelname,
+			"logger": record.name,
+			"msg": record.getMessage(),
+		}
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text:
+			payload["exc"] = record.exc_text
+		repeated = getattr(record, "repeated", None)
+		if repeated:
+			payload["repeated"] = repeated
+		return json.dumps(payload, ensure_ascii=False)
+
+class DedupFilter(logging.Filter):
+	"""Схлопывает одинаковые предупреждения: одна запись на interval секунд.
+
+	Одинаковыми считаются записи с тем же логгером, уровнем, шаблоном, аргументами
+	и типом исключения (например, повторные ошибки в колбэках дуэлей).
+	Число пропущенных повторов дописывается к следующей записи, попавшей в лог.
+	"""
+
+	def __init__(self, interval: float = 60.0, level: int = logging.WARNING, max_keys: int = 1024) -> None:
+		super().__init__()
+		self.interval = interval
+		self.level = level
+		self.max_keys = max_keys
+		self._seen: Dict[Tuple, List[float]] = {}  # ключ -> [время последней записи, пропущено]
+		self._lock = threading.Lock()
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		if record.levelno < self.level or self.interval <= 0:
+			return True
+		try:
+			exc_type = record.exc_info[0] if record.exc_info else None
+			key = (record.name, record.levelno, record.msg, tuple(map(repr, record.args or ())), exc_type)
+		except Exception:
+			return True
+		now = time.monotonic()
+		with self._lock:
+			entry = self._seen.get(key)
+			if entry is not None and now - entry[0] < self.interval:
+				entry[1] += 1
+				return False
+			if entry is None and len(self._seen) >= self.max_keys:
+				# Старые ключи больше не подавляют ничего — выбрасываем их
+				self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.interval}
+			suppressed = entry[1] if entry is not None else 0
+			self._seen[key] = [now, 0]
+		if suppressed:
+			record.repeated = suppressed
+			record.msg = f"{record.msg} (repeated {suppressed} more times)"
+		return True
+
+class _QueueHandler(QueueHandler):
+	"""QueueHandler, который не вклеивает traceback в текст сообщения.
+
+	Аргументы подставляются сразу (их объекты могут измениться до записи),
+	а traceback остаётся в exc_text — форматтер слушателя выведет его сам.
+	"""
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		record = copy.copy(record)
+		record.message = record.getMessage()
+		record.msg = record.message
+		record.args = None
+		if record.exc_info:
+			if not record.exc_text:
+				record.exc_text = _exc_formatter.formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+_exc_formatter = logging.Formatter()
+_listener: Optional[QueueListener] = None
+
+def setup_logging(log_file: str, level: int = logging.INFO, json_format: bool = False, dedup_interval: float = 60.0) -> QueueListener:
+	"""Настроить логирование через очередь.
+
+	Корневой логгер получает только QueueHandler: вызов log.* в event loop лишь кладёт
+	запись в очередь, а запись в файл (с ротацией) и в stdout/stderr выполняет фоновый
+	поток QueueListener. Повторяющиеся предупреждения схлопывает DedupFilter.
+	"""
+	global _listener
+	formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+
+	stdout_handler = logging.StreamHandler(sys.stdout)
+	stdout_handler.addFilter(StdoutFilter())
+
+	stderr_handler = logging.StreamHandler(sys.stderr)
+	stderr_handler.setLevel(logging.ERROR)
+
+	file_handler = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=5, encoding="utf-8")
+
+	handlers = [file_handler, stdout_handler, stderr_handler]
+	for handler in handlers:
+		handler.setFormatter(formatter)
+
+	log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+	queue_handler = _QueueHandler(log_queue)
+	queue_handler.addFilter(DedupFilter(dedup_interval))
+
+	root = logging.getLogger()
+	for handler in list(root.handlers):
+		root.removeHandler(handler)
+	root.addHandler(queue_handler)
+	root.setLevel(level)
+
+	if _listener is not None:
+		_listener.stop()
+	_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+	_listener.start()
+	# При выходе дописываем всё, что осталось в очереди
+	atexit.register(stop_logging)
+	return _listener
+
+def stop_logging() -> None:
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		_listener = None
+
+
+
+
+
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import os
+import bisect
+import logging
+import threading
+
+import clock
+
+try:
+	import psutil
+except ImportError:  # psutil необязателен: без него нет метрик процесса
+	psutil = None
+
+log = logging.getLogger("bot")
+
+# Границы гистограмм по умолчанию (секунды): от 5 мс до 10 с
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_value(value: float) -> str:
+	if value == float("inf"):
+		return "+Inf"
+	if float(value).is_integer():
+		return str(int(value))
+	return repr(float(value))
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+	pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+	if extra is not None:
+		pairs.append(f'{extra[0]}="{extra[1]}"')
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+	kind = "untyped"
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._lock = threading.Lock()
+
+	def _key(self, labels: Dict[str, Any]) -> LabelValues:
+		if set(labels) != set(self.labelnames):
+			raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+		return tuple(str(labels[n]) for n in self.labelnames)
+
+	def samples(self) -> List[str]:
+		raise NotImplementedError
+
+	def render(self) -> str:
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+		lines.extend(self.samples())
+		return "\n".join(lines)
+
+class Counter(_Metric):
+	kind = "counter"
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+		super().__init__(name, documentation, labelnames)
+		self._values: Dict[LabelValues, float] = {}
+
+	def inc(self, amount: float = 1.0, **labels: Any) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0.0) + amount
+
+	def set_total(self, value: float, **labels: Any) -> None:
+		"""Выставить накопленное значение, которое считает кто-то другой (например, WeatherClient.stats)."""
+		with self._lock:
+			self._values[self._key(labels)] = float(value)
+
+	def value(self, **labels: Any) -> float:
+		return self._values.get(self._key(labels), 0.0)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+	kind = "gauge"
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+		super().__init__(name, documentation, labelnames)
+		self._values: Dict[LabelValues, float] = {}
+
+	def set(self, value: float, **labels: Any) -> None:
+		with self._lock:
+			self._values[self._key(labels)] = float(value)
+
+	def clear(self) -> None:
+		"""Забыть все серии — для значений, которые сборщик заполняет заново при каждом опросе."""
+		with self._lock:
+			self._values.clear()
+
+	def value(self, **labels: Any) -> float:
+		return self._values.get(self._key(labels), 0.0)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+	kind = "histogram"
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(sorted(buckets))
+		self._series: Dict[LabelValues, List[float]] = {}  # счётчики корзин (последняя — +Inf), затем сумма
+
+	def observe(self, value: float, **labels: Any) -> None:
+		key = self._key(labels)
+		with self._lock:
+			series = self._series.get(key)
+			if series is None:
+				series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+			series[bisect.bisect_left(self.buckets, value)] += 1
+			series[-1] += value
+
+	def count(self, **labels: Any) -> int:
+		series = self._series.get(self._key(labels))
+		return int(sum(series[:-1])) if series else 0
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			items = sorted((k, list(v)) for k, v in self._series.items())
+		lines = []
+		for key, series in items:
+			cumulative = 0.0
+			for bound, n in zip(self.buckets + (float("inf"),), series[:-1]):
+				cumulative += n
+				lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', _fmt_value(bound)))} {_fmt_value(cumulative)}")
+			labels = _fmt_labels(self.labelnames, key)
+			lines.append(f"{self.name}_sum{labels} {_fmt_value(series[-1])}")
+			lines.append(f"{self.name}_count{labels} {_fmt_value(cumulative)}")
+		return lines
+
+class Registry:
+	"""Набор метрик и сборщиков; render() отдаёт текстовый формат Prometheus.
+
+	Сборщики вызываются перед каждой выдачей и обновляют «снимочные» метрики
+	(размеры очередей, число опросов и т. п.), которые дёшево посчитать по запросу.
+	"""
+
+	def __init__(self) -> None:
+		self._metrics: Dict[str, _Metric] = {}
+		self._collectors: Dict[str, Callable[[], None]] = {}
+
+	def register(self, metric: _Metric) -> _Metric:
+		if metric.name in self._metrics:
+			raise ValueError(f"Metric {metric.name} already registered")
+		self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+		return self.register(Counter(name, documentation, labelnames))
+
+	def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+		return self.register(Gauge(name, documentation, labelnames))
+
+	def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+		return self.register(Histogram(name, documentation, labelnames, buckets))
+
+	def add_collector(self, collector: Callable[[], None], name: Optional[str] = None) -> None:
+		"""Добавить сборщик; сборщик с тем же именем (по умолчанию — имя функции) заменяется."""
+		self._collectors[name or collector.__qualname__] = collector
+
+	def render(self) -> str:
+		for collector in list(self._collectors.values()):
+			try:
+				collector()
+			except Exception:
+				log.exception("Metrics collector %s failed", getattr(collector, "__name__", collector))
+		return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+# -------------------- Метрики бота --------------------
+UPDATES = registry.counter("bot_updates_total", "Telegram updates processed", ("type",))
+UPDATE_SECONDS = registry.histogram("bot_update_seconds", "End-to-end update processing time", ("type",))
+HANDLER_SECONDS = registry.histogram("bot_handler_seconds", "Time spent in aiogram handlers", ("handler",))
+TG_CALL_SECONDS = registry.histogram("bot_telegram_call_seconds", "Telegram API call latency per attempt", ("method",))
+TG_RETRIES = registry.counter("bot_telegram_retries_total", "Telegram API call retries", ("method", "reason"))
+TG_FAILURES = registry.counter("bot_telegram_failures_total", "Telegram API calls that gave up after all retries", ("method",))
+TG_QUEUE = registry.gauge("bot_telegram_outbound_pending", "Calls waiting in the outbound dispatcher queue")
+TG_DELETE_QUEUE = registry.gauge("bot_telegram_delete_pending", "Messages waiting in the batched deletion queue")
+TG_DELETE_DROPPED = registry.counter("bot_telegram_delete_dropped_total", "Deletions dropped because the deletion queue was full")
+SAVE_SECONDS = registry.histogram("bot_save_seconds", "State save duration", ("chat",))
+SAVE_BYTES = registry.gauge("bot_save_bytes", "Size of the last JSON snapshot written", ("file",))
+STORAGE_BYTES = registry.counter("bot_storage_bytes_written_total", "Bytes written to JSON snapshots and the journal", ("kind",))
+SAVE_FAILURES = registry.counter("bot_save_failures_total", "Failed state saves", ("chat",))
+JOBS = registry.gauge("bot_scheduler_jobs", "Scheduled jobs per job store", ("jobstore",))
+JOB_RUNS = registry.counter("bot_scheduler_job_runs_total", "Scheduler job runs by outcome", ("kind", "outcome"))
+JOB_LAG_SECONDS = registry.histogram("bot_scheduler_job_lag_seconds", "Delay between planned and actual job start", ("kind",), buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 3600.0))
+ACTIVE_POLLS = registry.gauge("bot_active_polls", "Open polls", ("chat",))
+POLL_VOTES = registry.gauge("bot_poll_votes", "Votes in open polls", ("chat",))
+DUEL_TIMEOUTS = registry.gauge("bot_duel_timeouts", "Users currently in duel timeout", ("chat",))
+WEATHER_READS = registry.counter("bot_weather_reads_total", "Weather forecast reads and fetches by result", ("result",))
+WEATHER_HIT_RATIO = registry.gauge("bot_weather_cache_hit_ratio", "Share of weather reads served from cache (fresh or stale)")
+PROCESS_RSS = registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes")
+PROCESS_CPU = registry.counter("process_cpu_seconds_total", "Total user and system CPU time in seconds")
+PROCESS_START = registry.gauge("process_start_time_seconds", "Start time of the process since unix epoch in seconds")
+
+def job_kind(job_id: str) -> str:
+	"""Вид задания для метки: "-100123:poll_tue_0" -> "poll", "duel_expire_..." -> "duel"."""
+	return job_id.rsplit(":", 1)[-1].split("_", 1)[0] or "unknown"
+
+def _collect_process() -> None:
+	if psutil is None:
+		return
+	proc = psutil.Process(os.getpid())
+	with proc.oneshot():
+		PROCESS_RSS.set(proc.memory_info().rss)
+		cpu = proc.cpu_times()
+		PROCESS_CPU.set_total(cpu.user + cpu.system)
+		PROCESS_START.set(proc.create_time())
+
+registry.add_collector(_collect_process)
+
+def collect_weather(stats: Dict[str, int]) -> None:
+	"""Перенести счётчики WeatherClient.stats в метрики."""
+	for result, value in stats.items():
+		WEATHER_READS.set_total(value, result=result)
+	reads = stats.get("hit", 0) + stats.get("stale", 0) + stats.get("miss", 0)
+	WEATHER_HIT_RATIO.set((stats.get("hit", 0) + stats.get("stale", 0)) / reads if reads else 0.0)
+
+def instrument_scheduler(scheduler: Any) -> None:
+	"""Считать запуски заданий планировщика и задержку старта относительно плановой даты.
+
+	Перезапуск main() приходит с новым планировщиком — сборщик заданий заменяет прежний,
+	а не копится рядом с остановленными; повторный вызов для того же планировщика ничего не делает.
+	"""
+	if getattr(scheduler, "_metrics_instrumented", False):
+		return
+	scheduler._metrics_instrumented = True
+	from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+	outcomes = {EVENT_JOB_EXECUTED: "ok", EVENT_JOB_ERROR: "error", EVENT_JOB_MISSED: "missed", EVENT_JOB_MAX_INSTANCES: "skipped"}
+
+	def _listener(event: Any) -> None:
+		kind = job_kind(event.job_id)
+		if event.code == EVENT_JOB_SUBMITTED:
+			# Плановые даты идут по часам проекта — по ним же и задержка (в симуляции время виртуальное)
+			now = clock.time()
+			for run_time in event.scheduled_run_times:
+				JOB_LAG_SECONDS.observe(max(0.0, now - run_time.timestamp()), kind=kind)
+			return
+		JOB_RUNS.inc(kind=kind, outcome=outcomes.get(event.code, "other"))
+
+	scheduler.add_listener(_listener, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
+	def _collect_jobs() -> None:
+		JOBS.clear()
+		for alias in scheduler._jobstores:
+			JOBS.set(len(scheduler.get_jobs(jobstore=alias)), jobstore=alias)
+
+	registry.add_collector(_collect_jobs, name="scheduler_jobs")
+
+
+
+
+
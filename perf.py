@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+import math
+import time
+import logging
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from metrics import UPDATES, UPDATE_SECONDS, HANDLER_SECONDS
+
+log = logging.getLogger("bot")
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+	"""Перцентиль q (0..100) по отсортированной выборке, метод ближайшего ранга."""
+	if not sorted_values:
+		return 0.0
+	rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+	return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class PerfTracker:
+	"""Скользящая статистика времени обработки: по последним size замерам на каждый ключ.
+
+	Кольца ограничены по длине (deque(maxlen)), а ключей не больше, чем обработчиков,
+	поэтому память не растёт со временем работы.
+	"""
+
+	def __init__(self, size: int = 1000) -> None:
+		self.size = size
+		self.updates: Deque[float] = deque(maxlen=size)
+		self.handlers: Dict[str, Deque[float]] = {}
+		self.slow = 0  # сколько обновлений превысили порог с момента запуска
+
+	def reset(self) -> None:
+		self.updates.clear()
+		self.handlers.clear()
+		self.slow = 0
+
+	def add_update(self, seconds: float) -> None:
+		self.updates.append(seconds)
+
+	def add_handler(self, name: str, seconds: float) -> None:
+		ring = self.handlers.get(name)
+		if ring is None:
+			ring = self.handlers[name] = deque(maxlen=self.size)
+		ring.append(seconds)
+
+	@staticmethod
+	def summary(values: Sequence[float]) -> Dict[str, float]:
+		ordered = sorted(values)
+		return {
+			"count": len(ordered),
+			"p50": percentile(ordered, 50),
+			"p95": percentile(ordered, 95),
+			"p99": percentile(ordered, 99),
+			"max": ordered[-1] if ordered else 0.0,
+		}
+
+	def top_handlers(self, limit: int = 10) -> List[Tuple[str, Dict[str, float]]]:
+		"""Самые медленные обработчики по p95."""
+		rows = [(name, self.summary(ring)) for name, ring in self.handlers.items() if ring]
+		rows.sort(key=lambda row: row[1]["p95"], reverse=True)
+		return rows[:limit]
+
+class _UpdateTiming:
+	__slots__ = ("started", "handlers")
+
+	def __init__(self) -> None:
+		self.started = time.perf_counter()
+		self.handlers: List[Tuple[str, float]] = []
+
+# Замер текущего обновления: обработчики сообщений/колбэков вызываются в той же задаче,
+# что и pre/post_process_update, но со своим словарём data
+_current: ContextVar[Optional[_UpdateTiming]] = ContextVar("perf_update", default=None)
+
+class TimingMiddleware(BaseMiddleware):
+	"""Засекает обновление целиком и каждый вызванный обработчик.
+
+	Обработчик засекается от on_process_* (фильтры пройдены, вызывается handler)
+	до следующего on_process_* или on_post_process_* того же события. Результаты идут
+	в гистограммы /metrics и в PerfTracker; обновления дольше slow_threshold
+	секунд пишутся в лог с видом обновления и именами обработчиков.
+	"""
+
+	def __init__(self, tracker: PerfTracker, slow_threshold: float = 1.0) -> None:
+		super().__init__()
+		self.tracker = tracker
+		self.slow_threshold = slow_threshold
+
+	async def trigger(self, action: str, args: Any) -> None:
+		if action == "pre_process_update":
+			_current.set(_UpdateTiming())
+		elif action == "post_process_update":
+			self._finish_update(args[0])
+		elif action.startswith("process_"):
+			data = args[-1]
+			self._finish_handler(data)
+			handler = current_handler.get(None)
+			data["_perf_handler"] = (getattr(handler, "__name__", "unknown"), time.perf_counter())
+		elif action.startswith("post_process_"):
+			self._finish_handler(args[-1])
+
+	def _finish_handler(self, data: Dict[str, Any]) -> None:
+		running = data.pop("_perf_handler", None)
+		if running is None:
+			return
+		name, started = running
+		elapsed = time.perf_counter() - started
+		HANDLER_SECONDS.observe(elapsed, handler=name)
+		self.tracker.add_handler(name, elapsed)
+		timing = _current.get()
+		if timing is not None:
+			timing.handlers.append((name, elapsed))
+
+	def _finish_update(self, update: Any) -> None:
+		timing = _current.get()
+		if timing is None:
+			return
+		_current.set(None)
+		elapsed = time.perf_counter() - timing.started
+		kind = update_type(update)
+		UPDATES.inc(type=kind)
+		UPDATE_SECONDS.observe(elapsed, type=kind)
+		self.tracker.add_update(elapsed)
+		if self.slow_threshold > 0 and elapsed >= self.slow_threshold:
+			self.tracker.slow += 1
+			handlers = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timing.handlers) or "no handler"
+			log.warning("Slow update %s (%s): %.3fs [%s]", getattr(update, "update_id", "?"), kind, elapsed, handlers)
+
+def update_type(update: Any) -> str:
+	"""Вид обновления Telegram: message, callback_query, poll_answer, ..."""
+	for key in update.values:
+		if key != "update_id":
+			return key
+	return "unknown"
+
+
+
+
+
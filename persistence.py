@@ -1,34 +1,298 @@
 from __future__ import annotations
 
-from typing import Dict, Any, Tuple, Set
+from typing import Dict, Any, Tuple, Set, List, Optional, Callable, Awaitable
 import os
 import json
+import asyncio
+import logging
 import aiofiles
 
-async def save_data(path: str, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True) -> None:
-	"""Сохранить основные данные бота в JSON-файл."""
-	payload = {
+from metrics import SAVE_BYTES, STORAGE_BYTES
+
+log = logging.getLogger("bot")
+
+JOURNAL_SUFFIX = ".journal"
+
+def empty_duels_state() -> Dict[str, Dict[str, Any]]:
+	"""Пустое состояние дуэлей: таймауты, дневные счётчики и карта username -> user_id."""
+	return {"timeouts": {}, "daily": {}, "usernames": {}}
+
+def _build_payload(active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool, duels: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+	"""Собрать словарь снимка состояния."""
+	return {
 		"active_polls": active_polls,
 		"stats": stats,
 		"disabled_days": sorted(list(disabled_days)),
 		"questionable_reminders_enabled": bool(questionable_reminders_enabled),
+		"duels": duels if duels is not None else empty_duels_state(),
 	}
+
+async def save_data(path: str, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+	"""Сохранить основные данные бота в JSON-файл."""
+	payload = _build_payload(active_polls, stats, disabled_days, questionable_reminders_enabled, duels)
+	text = json.dumps(payload, ensure_ascii=False, indent=2)
 	tmp = path + ".tmp"
 	async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
-		await f.write(json.dumps(payload, ensure_ascii=False, indent=2))
+		await f.write(text)
 	os.replace(tmp, path)
+	size = len(text.encode("utf-8"))
+	SAVE_BYTES.set(size, file=os.path.basename(path))
+	STORAGE_BYTES.inc(size, kind="snapshot")
+
+def _apply_journal_record(rec: Dict[str, Any], active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], duels: Dict[str, Dict[str, Any]]) -> None:
+	"""Применить одну запись журнала к состоянию. Записи идемпотентны."""
+	op = rec.get("op")
+	pid = rec.get("poll_id")
+	if op == "poll_open":
+		active_polls[pid] = rec.get("entry", {})
+	elif op == "vote":
+		data = active_polls.get(pid)
+		if data is not None:
+			data.setdefault("votes", {})[str(rec.get("user"))] = rec.get("vote", {})
+	elif op == "unvote":
+		data = active_polls.get(pid)
+		if data is not None:
+			data.setdefault("votes", {}).pop(str(rec.get("user")), None)
+	elif op == "poll_close":
+		active_polls.pop(pid, None)
+		stats.update(rec.get("stats") or {})
+	elif op == "timeout_set":
+		duels["timeouts"][str(rec.get("user"))] = {"until": rec.get("until"), "chat_id": rec.get("chat_id"), "name": rec.get("name")}
+	elif op == "timeout_clear":
+		duels["timeouts"].pop(str(rec.get("user")), None)
+	elif op == "duel_count":
+		duels["daily"][str(rec.get("user"))] = {"date": rec.get("date"), "count": rec.get("count")}
+	elif op == "username":
+		duels["usernames"][str(rec.get("username"))] = rec.get("user_id")
+
+def _replay_journal(journal_path: str, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], duels: Dict[str, Dict[str, Any]]) -> int:
+	"""Проиграть журнал поверх загруженного снимка. Возвращает число применённых записей."""
+	if not os.path.exists(journal_path):
+		return 0
+	applied = 0
+	with open(journal_path, "r", encoding="utf-8") as f:
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+			try:
+				rec = json.loads(line)
+			except ValueError:
+				# Оборванная последняя строка после падения — пропускаем
+				log.warning("Skipping corrupted journal record in %s", journal_path)
+				continue
+			_apply_journal_record(rec, active_polls, stats, duels)
+			applied += 1
+	return applied
+
+async def load_data(path: str) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any], Set[str], bool, Dict[str, Dict[str, Any]]]:
+	"""Загрузить данные из JSON-файла и проиграть журнал. Если файлов нет — вернуть пустые структуры."""
+	active_polls: Dict[str, Dict[str, Any]] = {}
+	stats: Dict[str, Any] = {}
+	disabled_days: Set[str] = set()
+	qrem = True
+	duels = empty_duels_state()
+	if os.path.exists(path):
+		async with aiofiles.open(path, "r", encoding="utf-8") as f:
+			data = json.loads(await f.read())
+		active_polls = data.get("active_polls", {})
+		stats = data.get("stats", {})
+		disabled_days = set(d for d in data.get("disabled_days", []) if isinstance(d, str))
+		qrem = bool(data.get("questionable_reminders_enabled", True))
+		for key, value in (data.get("duels") or {}).items():
+			if key in duels and isinstance(value, dict):
+				duels[key] = value
+	applied = _replay_journal(path + JOURNAL_SUFFIX, active_polls, stats, duels)
+	if applied:
+		log.info("Replayed %s journal records from %s", applied, path + JOURNAL_SUFFIX)
+	return active_polls, stats, disabled_days, qrem, duels
+
+class SaveCoordinator:
+	"""Координатор сохранений с флагом «грязного» состояния и одной фоновой задачей записи.
+
+	Серия изменений схлопывается в одну запись после паузы debounce (но не позже max_delay
+	от первого изменения). Если состояние снова изменили во время записи, флаг поднимается
+	заново и последнее изменение гарантированно попадёт на диск следующей записью.
+	"""
+
+	def __init__(self, write_cb: Callable[[], Awaitable[None]], debounce: float = 2.0, max_delay: float = 10.0) -> None:
+		self.write_cb = write_cb
+		self.debounce = debounce
+		self.max_delay = max_delay
+		self._dirty = False
+		self._first_dirty = 0.0
+		self._last_dirty = 0.0
+		self._event: Optional[asyncio.Event] = None
+		self._lock: Optional[asyncio.Lock] = None
+		self._task: Optional[asyncio.Task] = None
+
+	def start(self) -> None:
+		"""Запустить фоновую задачу записи в текущем event loop."""
+		self._event = asyncio.Event()
+		self._lock = asyncio.Lock()
+		if self._dirty:
+			self._event.set()
+		self._task = asyncio.create_task(self._run())
+
+	def mark_dirty(self) -> None:
+		"""Отметить, что состояние изменилось и должно быть записано."""
+		now = asyncio.get_event_loop().time()
+		if not self._dirty:
+			self._dirty = True
+			self._first_dirty = now
+		self._last_dirty = now
+		if self._event is not None:
+			self._event.set()
+
+	async def _write(self) -> None:
+		lock = self._lock or asyncio.Lock()
+		async with lock:
+			if not self._dirty:
+				return
+			self._dirty = False
+			if self._event is not None:
+				self._event.clear()
+			try:
+				await self.write_cb()
+			except Exception:
+				# Не теряем изменения: повторим запись на следующем цикле
+				self.mark_dirty()
+				raise
+
+	async def flush(self) -> None:
+		"""Немедленно записать состояние, если есть несохранённые изменения."""
+		await self._write()
+
+	async def _run(self) -> None:
+		loop = asyncio.get_running_loop()
+		while True:
+			await self._event.wait()
+			# Ждём паузы в потоке изменений, но не дольше max_delay от первого
+			while self._dirty:
+				deadline = min(self._last_dirty + self.debounce, self._first_dirty + self.max_delay)
+				delay = deadline - loop.time()
+				if delay <= 0:
+					break
+				await asyncio.sleep(delay)
+			try:
+				await self._write()
+			except Exception:
+				log.exception("Failed to save data")
+				await asyncio.sleep(self.debounce)
+
+	async def close(self) -> None:
+		"""Остановить фоновую задачу и записать остаток изменений."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except (asyncio.CancelledError, Exception):
+				pass
+			self._task = None
+		await self.flush()
+
+class DataJournal:
+	"""Журнал изменений (write-ahead) поверх JSON-снимка.
+
+	Каждое событие (голос, снятие голоса, открытие/закрытие опроса, таймауты дуэлей) — одна компактная
+	JSON-строка в `<path>.journal`. Записи копятся в памяти и сбрасываются пачкой с
+	одним fsync; при накоплении compact_threshold записей журнал сворачивается в снимок.
+	"""
+
+	def __init__(self, path: str, flush_interval: float = 1.0, compact_threshold: int = 500) -> None:
+		self.path = path
+		self.journal_path = path + JOURNAL_SUFFIX
+		self.flush_interval = flush_interval
+		self.compact_threshold = compact_threshold
+		self._pending: List[str] = []
+		self._records_since_compact = 0
+		self._lock: Optional[asyncio.Lock] = None
+		self._task: Optional[asyncio.Task] = None
+		self._snapshot_cb: Optional[Callable[[], Tuple[Any, ...]]] = None
+
+	def start(self, snapshot_cb: Callable[[], Tuple[Any, ...]]) -> None:
+		"""Запустить фоновую задачу сброса и сворачивания журнала в текущем event loop."""
+		self._lock = asyncio.Lock()
+		self._snapshot_cb = snapshot_cb
+		self._task = asyncio.create_task(self._run())
+
+	def append(self, op: str, **fields: Any) -> None:
+		"""Добавить запись в буфер журнала (на диск попадёт при ближайшем сбросе)."""
+		rec = {"op": op}
+		rec.update(fields)
+		self._pending.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+		self._records_since_compact += 1
+
+	def _write_lines(self, lines: List[str]) -> None:
+		text = "\n".join(lines) + "\n"
+		with open(self.journal_path, "a", encoding="utf-8") as f:
+			f.write(text)
+			f.flush()
+			os.fsync(f.fileno())
+		STORAGE_BYTES.inc(len(text.encode("utf-8")), kind="journal")
+
+	def _write_snapshot(self, text: str) -> None:
+		tmp = self.path + ".tmp"
+		with open(tmp, "w", encoding="utf-8") as f:
+			f.write(text)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, self.path)
+		size = len(text.encode("utf-8"))
+		SAVE_BYTES.set(size, file=os.path.basename(self.path))
+		STORAGE_BYTES.inc(size, kind="snapshot")
+		# Снимок уже содержит всё, что было в журнале, — обнуляем журнал
+		with open(self.journal_path, "w", encoding="utf-8"):
+			pass
+
+	async def flush(self) -> None:
+		"""Записать накопленные записи в журнал одним fsync."""
+		if not self._pending:
+			return
+		lock = self._lock or asyncio.Lock()
+		async with lock:
+			lines, self._pending = self._pending, []
+			if lines:
+				await asyncio.get_running_loop().run_in_executor(None, self._write_lines, lines)
+
+	async def compact(self, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+		"""Свернуть журнал в снимок: записать полный JSON и очистить журнал.
+
+		Состояние сериализуется синхронно, поэтому снимок точно включает все записи,
+		добавленные до вызова; записи, пришедшие во время записи на диск, останутся в буфере.
+		"""
+		lock = self._lock or asyncio.Lock()
+		async with lock:
+			lines, self._pending = self._pending, []
+			text = json.dumps(_build_payload(active_polls, stats, disabled_days, questionable_reminders_enabled, duels), ensure_ascii=False, indent=2)
+			self._records_since_compact = 0
+			loop = asyncio.get_running_loop()
+			if lines:
+				await loop.run_in_executor(None, self._write_lines, lines)
+			await loop.run_in_executor(None, self._write_snapshot, text)
+
+	async def _run(self) -> None:
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			try:
+				if self._snapshot_cb and self._records_since_compact >= self.compact_threshold:
+					await self.compact(*self._snapshot_cb())
+					log.debug("Journal compacted into %s", self.path)
+				else:
+					await self.flush()
+			except Exception:
+				log.exception("Journal flush failed")
 
-async def load_data(path: str) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any], Set[str], bool]:
-	"""Загрузить данные из JSON-файла. Если файла нет — вернуть пустые структуры."""
-	if not os.path.exists(path):
-		return {}, {}, set(), True
-	async with aiofiles.open(path, "r", encoding="utf-8") as f:
-		data = json.loads(await f.read())
-	active_polls = data.get("active_polls", {})
-	stats = data.get("stats", {})
-	disabled_days = set(d for d in data.get("disabled_days", []) if isinstance(d, str))
-	qrem = bool(data.get("questionable_reminders_enabled", True))
-	return active_polls, stats, disabled_days, qrem
+	async def close(self) -> None:
+		"""Остановить фоновую задачу и сбросить остаток буфера."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except (asyncio.CancelledError, Exception):
+				pass
+			self._task = None
+		await self.flush()
 
 
 
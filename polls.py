@@ -1,9 +1,214 @@
 from __future__ import annotations
 
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Iterable, List, Callable
+
+# Категории вариантов ответа
+CATEGORY_YES = "yes"
+CATEGORY_NO = "no"
+CATEGORY_MAYBE = "maybe"
+CATEGORY_OTHER = "other"
+CATEGORIES = (CATEGORY_YES, CATEGORY_NO, CATEGORY_MAYBE, CATEGORY_OTHER)
+
+def categorize_answer(answer: str) -> str:
+	"""Единое правило отнесения текста варианта к категории (Да/Нет/Под вопросом/прочее)."""
+	text = str(answer or "")
+	low = text.lower()
+	if text.startswith("Да"):
+		return CATEGORY_YES
+	if text.startswith("Нет"):
+		return CATEGORY_NO
+	if "вопрос" in low or "?" in text:
+		return CATEGORY_MAYBE
+	return CATEGORY_OTHER
+
+# Таймаут на 36 часов — только за вариант «Под вопросом», а не за любой вариант категории maybe
+PENALTY_PREFIX = "под вопрос"
+
+def is_penalized_answer(answer: str) -> bool:
+	"""Наказывается ли ответ таймаутом (ручной вариант с «?» — нет).
+
+	>>> is_penalized_answer("Под вопросом ❔")
+	True
+	>>> is_penalized_answer("Может быть?")
+	False
+	"""
+	return str(answer or "").lower().startswith(PENALTY_PREFIX)
+
+def option_categories(options: List[str]) -> List[str]:
+	"""Категории вариантов опроса по индексам — вычисляются один раз при создании опроса."""
+	return [categorize_answer(opt) for opt in options]
+
+def vote_category(vote: Dict[str, Any]) -> str:
+	"""Категория голоса: сохранённая при голосовании, а для старых записей — по тексту ответа."""
+	return vote.get("category") or categorize_answer(vote.get("answer", ""))
+
+class PollTally:
+	"""Живые счётчики опроса: голосующие по категориям в порядке голосования.
+
+	version растёт при каждом изменении голосов; по ней проверяется кэш отрисовки (cached).
+	"""
+
+	__slots__ = ("members", "by_voter", "version", "_render")
+
+	def __init__(self, votes: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+		self.members: Dict[str, Dict[str, None]] = {c: {} for c in CATEGORIES}
+		self.by_voter: Dict[str, str] = {}
+		self.version = 0
+		self._render: Dict[str, Tuple[int, Any]] = {}
+		for key, vote in (votes or {}).items():
+			self.add(key, vote_category(vote))
+
+	def add(self, key: str, category: str) -> None:
+		self.remove(key)
+		self.members[category][key] = None
+		self.by_voter[key] = category
+		self.version += 1
+
+	def remove(self, key: str) -> None:
+		category = self.by_voter.pop(key, None)
+		if category is not None:
+			self.members[category].pop(key, None)
+			self.version += 1
+
+	def cached(self, kind: str, build: Callable[[], Any]) -> Any:
+		"""Вернуть отрисованное значение kind для текущей версии голосов или построить заново."""
+		hit = self._render.get(kind)
+		if hit is not None and hit[0] == self.version:
+			return hit[1]
+		value = build()
+		self._render[kind] = (self.version, value)
+		return value
+
+	def count(self, category: str) -> int:
+		return len(self.members[category])
+
+	def voters(self, category: str) -> List[str]:
+		"""Ключи голосов (user_id или admin_*) в категории."""
+		return list(self.members[category])
+
+	def __len__(self) -> int:
+		return len(self.by_voter)
+
+class PollRegistry(dict):
+	"""Словарь активных опросов poll_id -> данные с индексами по дню и последнему активному опросу.
+
+	Индексы обновляются при вставке, удалении и закрытии (mark_closed), поэтому поиск
+	последнего активного опроса и опроса по дню не зависит от числа хранимых опросов.
+	Флаг "active" нужно менять через mark_closed, а не напрямую в данных опроса.
+	"""
+
+	def __init__(self, *args: Any, **kwargs: Any) -> None:
+		super().__init__()
+		self._active: Dict[str, str] = {}  # poll_id -> created_at активных опросов
+		self._by_day: Dict[str, Dict[str, str]] = {}  # день -> {poll_id: created_at} активных опросов
+		self._latest: Optional[str] = None
+		self._tallies: Dict[str, PollTally] = {}
+		self.update(*args, **kwargs)
+
+	def _index(self, pid: str, data: Dict[str, Any]) -> None:
+		if not data.get("active"):
+			return
+		created = str(data.get("created_at", ""))
+		self._active[pid] = created
+		day = (data.get("poll") or {}).get("day")
+		if day:
+			self._by_day.setdefault(day, {})[pid] = created
+		if self._latest is None or created >= self._active.get(self._latest, ""):
+			self._latest = pid
+
+	def _unindex(self, pid: str) -> None:
+		if self._active.pop(pid, None) is None:
+			return
+		for day, pids in list(self._by_day.items()):
+			if pids.pop(pid, None) is not None and not pids:
+				del self._by_day[day]
+		if self._latest == pid:
+			# Пересчёт только по активным опросам (обычно их единицы)
+			self._latest = max(self._active, key=self._active.get) if self._active else None
+
+	def __setitem__(self, pid: str, data: Dict[str, Any]) -> None:
+		if pid in self:
+			self._unindex(pid)
+		super().__setitem__(pid, data)
+		self._index(pid, data)
+		self._tallies[pid] = PollTally(data.get("votes"))
+
+	def __delitem__(self, pid: str) -> None:
+		super().__delitem__(pid)
+		self._unindex(pid)
+		self._tallies.pop(pid, None)
+
+	def pop(self, pid: str, *default: Any) -> Any:
+		self._unindex(pid)
+		self._tallies.pop(pid, None)
+		return super().pop(pid, *default)
+
+	def popitem(self) -> Tuple[str, Dict[str, Any]]:
+		pid, data = super().popitem()
+		self._unindex(pid)
+		self._tallies.pop(pid, None)
+		return pid, data
+
+	def clear(self) -> None:
+		super().clear()
+		self._active.clear()
+		self._by_day.clear()
+		self._tallies.clear()
+		self._latest = None
+
+	def update(self, *args: Any, **kwargs: Any) -> None:
+		for pid, data in dict(*args, **kwargs).items():
+			self[pid] = data
+
+	def setdefault(self, pid: str, default: Any = None) -> Any:
+		if pid not in self:
+			self[pid] = default
+		return self[pid]
+
+	def mark_closed(self, pid: str) -> None:
+		"""Пометить опрос неактивным и убрать его из индексов."""
+		data = self.get(pid)
+		if data is not None:
+			data["active"] = False
+		self._unindex(pid)
+
+	def tally(self, pid: str) -> PollTally:
+		"""Счётчики голосов опроса."""
+		return self._tallies[pid]
+
+	def set_vote(self, pid: str, key: str, vote: Dict[str, Any]) -> None:
+		"""Записать голос и обновить счётчики за O(1). В vote должна быть "category"."""
+		self[pid].setdefault("votes", {})[key] = vote
+		self._tallies[pid].add(key, vote_category(vote))
+
+	def remove_vote(self, pid: str, key: str) -> bool:
+		"""Снять голос. Возвращает True, если он был."""
+		existed = self[pid].setdefault("votes", {}).pop(key, None) is not None
+		self._tallies[pid].remove(key)
+		return existed
+
+	def last_active(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+		"""Последний по времени создания активный опрос — O(1)."""
+		if self._latest is None:
+			return None
+		return self._latest, self[self._latest]
+
+	def active_for_day(self, day: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+		"""Самый свежий активный опрос для дня недели."""
+		pids = self._by_day.get(day)
+		if not pids:
+			return None
+		pid = max(pids, key=pids.get)
+		return pid, self[pid]
+
+	def active_items(self) -> Iterable[Tuple[str, Dict[str, Any]]]:
+		"""Активные опросы (без перебора закрытых)."""
+		return [(pid, self[pid]) for pid in self._active]
 
 def find_last_active_poll(active_polls: Dict[str, Dict[str, Any]]) -> Optional[Tuple[str, Dict[str, Any]]]:
 	"""Найти последний активный опрос (по времени создания)."""
+	if isinstance(active_polls, PollRegistry):
+		return active_polls.last_active()
 	if not active_polls:
 		return None
 	items = sorted(active_polls.items(), key=lambda it: it[1].get("created_at", ""), reverse=True)
@@ -12,32 +217,18 @@ def find_last_active_poll(active_polls: Dict[str, Dict[str, Any]]) -> Optional[T
 			return pid, data
 	return None
 
-def format_poll_votes(data: Dict[str, Any]) -> str:
+def format_poll_votes(data: Dict[str, Any], tally: Optional[PollTally] = None) -> str:
 	"""Сформировать текст со списком голосов (имя — ответ)."""
 	votes = data.get("votes", {})
 	if not votes:
 		return "— Никто ещё не голосовал."
-	# Печатаем единым форматом с иконками статуса: Да/Нет/Под вопросом
-	yes_list = []
-	no_list = []
-	maybe_list = []
-	for v in votes.values():
-		name = v.get("name")
-		answer = str(v.get("answer", ""))
-		low = answer.lower()
-		if answer.startswith("Да"):
-			yes_list.append(f"✅ {name}")
-		elif answer.startswith("Нет"):
-			# используем грустный смайлик для наглядности
-			no_list.append(f"😞 {name}")
-		elif "вопрос" in low or "?" in answer:
-			maybe_list.append(f"❔ {name}")
-		else:
-			# по умолчанию без иконки
-			maybe_list.append(f"❔ {name}")
-	lines = []
-	for lst in (yes_list, maybe_list, no_list):
-		lines.extend(lst)
+	if tally is None:
+		tally = PollTally(votes)
+	# Печатаем единым форматом с иконками статуса: Да, затем Под вопросом (и прочие), затем Нет
+	lines = [f"✅ {votes[k].get('name')}" for k in tally.voters(CATEGORY_YES)]
+	lines += [f"❔ {votes[k].get('name')}" for k in tally.voters(CATEGORY_MAYBE) + tally.voters(CATEGORY_OTHER)]
+	# используем грустный смайлик для наглядности
+	lines += [f"😞 {votes[k].get('name')}" for k in tally.voters(CATEGORY_NO)]
 	return "\n".join(lines)
 
 
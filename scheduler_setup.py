@@ -1,28 +1,129 @@
 from __future__ import annotations
 
-from typing import Any, Callable
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import logging
 from apscheduler.triggers.cron import CronTrigger
 
 from state import WEEKDAY_MAP
+from scheduling import summary_cron_slot
+
+log = logging.getLogger("bot")
+
+# Хранилище для заданий, которые должны пережить рестарт (опросы, итоги, напоминания, закрытие)
+PERSISTENT_JOBSTORE = "persistent"
+
+# Политика пропусков по видам заданий: сколько секунд после плановой даты задание ещё
+# догоняется после простоя и схлопываются ли несколько пропущенных запусков в один
+JOB_POLICIES: Dict[str, Dict[str, Any]] = {
+	"poll": {"misfire_grace_time": 3 * 3600, "coalesce": True},
+	"summary": {"misfire_grace_time": 3 * 3600, "coalesce": True},
+	"close": {"misfire_grace_time": 24 * 3600, "coalesce": True},
+	"reminder": {"misfire_grace_time": 10 * 60, "coalesce": True},
+	"tagq": {"misfire_grace_time": 5 * 60, "coalesce": True},
+	"prefetch": {"misfire_grace_time": 5 * 60, "coalesce": True},
+}
+
+# Виды заданий недельного расписания (id: [<префикс>]<вид>_<день>_<индекс>) — ими управляет setup_scheduler_jobs
+SCHEDULE_JOB_KINDS = ("poll", "summary", "prefetch")
+
+_job_handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+def register_job_handler(name: str, handler: Callable[..., Awaitable[Any]]) -> None:
+	"""Зарегистрировать обработчик для сохраняемых заданий run_job(name, *args)."""
+	_job_handlers[name] = handler
+
+async def run_job(name: str, *args: Any) -> None:
+	"""Точка входа сохраняемых заданий: в хранилище лежит ссылка на эту функцию, имя и аргументы."""
+	handler = _job_handlers.get(name)
+	if handler is None:
+		log.warning("No handler registered for scheduled job %s", name)
+		return
+	await handler(*args)
+
+def upsert_job(scheduler, job_id: str, kind: str, name: str, args: tuple, trigger, keep_existing: bool = False) -> Optional[str]:
+	"""Привести сохраняемое задание run_job(name, *args) к нужному виду.
+
+	Нет задания — добавляет ("added"). Есть — меняет на месте только то, что отличается:
+	триггер (reschedule_job), аргументы и политику пропусков (modify_job) — "modified".
+	Неизменное задание остаётся как есть вместе с пропущенным за время простоя запуском (None).
+	keep_existing оставляет сохранённое задание, даже если триггер пересчитан заново.
+	"""
+	policy = JOB_POLICIES[kind]
+	job_args = (name,) + tuple(args)
+	existing = scheduler.get_job(job_id)
+	if existing is None:
+		scheduler.add_job(run_job, trigger=trigger, args=list(job_args), id=job_id, jobstore=PERSISTENT_JOBSTORE, replace_existing=True, **policy)
+		return "added"
+	if keep_existing:
+		return None
+	changed = False
+	# repr триггера включает часовой пояс и границы, str — нет
+	if repr(existing.trigger) != repr(trigger):
+		scheduler.reschedule_job(job_id, trigger=trigger)
+		changed = True
+	if tuple(existing.args) != job_args or existing.misfire_grace_time != policy["misfire_grace_time"] or existing.coalesce != policy["coalesce"]:
+		scheduler.modify_job(job_id, args=list(job_args), **policy)
+		changed = True
+	return "modified" if changed else None
+
+def is_schedule_job(job_id: str, job_prefix: str = "") -> bool:
+	"""Задание недельного расписания с этим префиксом (а не напоминание, закрытие или дуэль)."""
+	if not job_id.startswith(job_prefix):
+		return False
+	return job_id[len(job_prefix):].split("_", 1)[0] in SCHEDULE_JOB_KINDS
+
+def reconcile_jobs(scheduler, desired: Dict[str, Tuple[str, str, tuple, Any]], owns: Callable[[str], bool]) -> Dict[str, int]:
+	"""Сверить сохранённые задания с желаемым набором {job_id: (kind, name, args, trigger)}.
+
+	Удаляются только задания, которые owns() признаёт своими и которых нет в desired;
+	остальные добавляются или меняются через upsert_job. Возвращает счётчики изменений.
+	"""
+	counts = {"added": 0, "modified": 0, "removed": 0}
+	for job in scheduler.get_jobs(jobstore=PERSISTENT_JOBSTORE):
+		if job.id not in desired and owns(job.id):
+			scheduler.remove_job(job.id, jobstore=PERSISTENT_JOBSTORE)
+			counts["removed"] += 1
+	for job_id, (kind, name, args, trigger) in desired.items():
+		try:
+			result = upsert_job(scheduler, job_id, kind, name, args, trigger)
+		except Exception:
+			log.exception("Failed to schedule job %s", job_id)
+			continue
+		if result:
+			counts[result] += 1
+	return counts
+
+def shift_cron_time(day_of_week: str, hour: int, minute: int, minutes_before: int) -> Tuple[str, int, int]:
+	"""Сдвинуть время недельного cron-задания на minutes_before минут назад (с переходом через полночь)."""
+	days = list(WEEKDAY_MAP.keys())
+	total = WEEKDAY_MAP[day_of_week] * 24 * 60 + hour * 60 + minute - minutes_before
+	total %= 7 * 24 * 60
+	day_index, rest = divmod(total, 24 * 60)
+	return days[day_index], rest // 60, rest % 60
 
 def setup_scheduler_jobs(
 	scheduler,
 	polls_config: list,
 	disabled_days: set,
 	tz,
-	start_poll_cb: Callable[[dict], Any],
-	send_summary_by_day_cb: Callable[[dict], Any],
 	save_data_cb: Callable[[], Any],
 	log,
+	job_args: tuple = (),
+	prefetch: bool = False,
+	prefetch_lead_minutes: int = 5,
+	job_prefix: str = "",
 ) -> None:
-	"""Зарегистрировать все плановые задания (опросы, итоги, автосейв, бэкап)."""
-	scheduler.remove_all_jobs()
+	"""Зарегистрировать все плановые задания (опросы, итоги, автосейв, бэкап).
 
-	def _schedule_poll_job(poll):
-		start_poll_cb(poll)
-
-	def _schedule_summary_job(poll):
-		send_summary_by_day_cb(poll)
+	Опросы и итоги — сохраняемые задания run_job("start_poll" / "summary_by_day", *job_args, poll);
+	с prefetch ещё и run_job("prefetch", *job_args, poll) за prefetch_lead_minutes минут до
+	каждого опроса и итога. Расписание сверяется с сохранёнными заданиями (reconcile_jobs):
+	добавляется, меняется и удаляется только разница, так что отключение одного дня трогает
+	лишь его задания, а напоминания, закрытия опросов и дуэли не затрагиваются.
+	С job_prefix (например, "<chat_id>:") сверяются только задания с этим префиксом —
+	так у каждой группы своё расписание.
+	"""
+	desired: Dict[str, Tuple[str, str, tuple, Any]] = {}
 
 	for idx, poll in enumerate(polls_config):
 		try:
@@ -30,54 +131,42 @@ def setup_scheduler_jobs(
 				log.info("⏭️ Skipping scheduling for %s (disabled)", poll.get("day"))
 				continue
 			tp = list(map(int, poll["time_poll"].split(":")))
-			tg = list(map(int, poll["time_game"].split(":")))
-			poll_job_id = f"poll_{poll['day']}_{idx}"
-			scheduler.add_job(
-				_schedule_poll_job,
-				trigger=CronTrigger(
-					day_of_week=poll["day"],
-					hour=tp[0],
-					minute=tp[1],
-					timezone=tz,
-				),
-				args=[poll],
-				id=poll_job_id,
-			)
-			summary_hour = max(tg[0] - 1, 0)
-			summary_job_id = f"summary_{poll['day']}_{idx}"
-			if poll["day"] in ("tue", "thu"):
-				summary_dow = poll["day"]
-			else:
-				day_index = WEEKDAY_MAP[poll["day"]]
-				next_day_index = (day_index + 1) % 7
-				summary_dow = list(WEEKDAY_MAP.keys())[next_day_index]
-
-			scheduler.add_job(
-				_schedule_summary_job,
-				trigger=CronTrigger(
-					day_of_week=summary_dow,
-					hour=summary_hour,
-					minute=tg[1],
-					timezone=tz,
-				),
-				args=[poll],
-				id=summary_job_id,
-			)
+			args = tuple(job_args) + (poll,)
+			desired[f"{job_prefix}poll_{poll['day']}_{idx}"] = ("poll", "start_poll", args, CronTrigger(
+				day_of_week=poll["day"],
+				hour=tp[0],
+				minute=tp[1],
+				timezone=tz,
+			))
+			summary_dow, summary_hour, summary_minute = summary_cron_slot(poll)
+			desired[f"{job_prefix}summary_{poll['day']}_{idx}"] = ("summary", "summary_by_day", args, CronTrigger(
+				day_of_week=summary_dow,
+				hour=summary_hour,
+				minute=summary_minute,
+				timezone=tz,
+			))
+			if prefetch:
+				for job_id, (dow, h, m) in (
+					(f"{job_prefix}prefetch_poll_{poll['day']}_{idx}", shift_cron_time(poll["day"], tp[0], tp[1], prefetch_lead_minutes)),
+					(f"{job_prefix}prefetch_summary_{poll['day']}_{idx}", shift_cron_time(summary_dow, summary_hour, summary_minute, prefetch_lead_minutes)),
+				):
+					desired[job_id] = ("prefetch", "prefetch", args, CronTrigger(day_of_week=dow, hour=h, minute=m, timezone=tz))
 			log.info("✅ Scheduled poll for %s at %s (Kaliningrad)", poll['day'], poll['time_poll'])
 		except Exception:
 			log.exception("Failed to schedule poll: %s", poll)
 
-	try:
-		scheduler.add_job(lambda: save_data_cb(), "interval", minutes=10)
-	except Exception:
-		log.exception("Failed to schedule autosave job")
-
-	try:
-		scheduler.add_job(lambda: None, "cron", hour=3, minute=0, timezone=tz)
-	except Exception:
-		log.exception("Failed to schedule backup job")
-
-
-
+	counts = reconcile_jobs(scheduler, desired, lambda job_id: is_schedule_job(job_id, job_prefix))
+	log.info("Schedule reconciled (%s): +%s ~%s -%s", job_prefix or "all", counts["added"], counts["modified"], counts["removed"])
 
+	# Служебные задания живут в памяти и создаются один раз на планировщик
+	if scheduler.get_job(f"{job_prefix}autosave") is None:
+		try:
+			scheduler.add_job(lambda: save_data_cb(), "interval", minutes=10, id=f"{job_prefix}autosave")
+		except Exception:
+			log.exception("Failed to schedule autosave job")
 
+	if scheduler.get_job(f"{job_prefix}backup") is None:
+		try:
+			scheduler.add_job(lambda: None, "cron", hour=3, minute=0, timezone=tz, id=f"{job_prefix}backup")
+		except Exception:
+			log.exception("Failed to schedule backup job")
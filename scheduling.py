@@ -1,9 +1,13 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Callable, List, NamedTuple, Optional, Set, Tuple
 from state import WEEKDAY_MAP, KALININGRAD_TZ, now_tz
 
+REMINDER_INTERVAL = timedelta(hours=3)
+TAG_WINDOW = timedelta(hours=2)
+TAG_INTERVAL = timedelta(minutes=20)
+
 def compute_poll_close_dt(poll: Dict[str, Any], start_dt: datetime) -> datetime:
 	"""Рассчитать время закрытия опроса.
 
@@ -29,26 +33,174 @@ def compute_poll_close_dt(poll: Dict[str, Any], start_dt: datetime) -> datetime:
 	except Exception:
 		return start_dt + timedelta(hours=24)
 
+def _hm(value: str) -> Tuple[int, int]:
+	hour, minute = map(int, value.split(":"))
+	return hour, minute
+
+def _localize(day: date, hour: int, minute: int, tz=KALININGRAD_TZ) -> datetime:
+	return tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+def _next_weekday_at(start_dt: datetime, weekday: int, hour: int, minute: int, tz=KALININGRAD_TZ) -> datetime:
+	"""Ближайший weekday в hour:minute не раньше дня start_dt; если уже прошёл — через неделю."""
+	day = start_dt.date() + timedelta(days=(weekday - start_dt.weekday()) % 7)
+	dt = _localize(day, hour, minute, tz)
+	return dt if dt > start_dt else dt + timedelta(days=7)
+
+def summary_cron_slot(poll: Dict[str, Any]) -> Tuple[str, int, int]:
+	"""День и время итогов: для вт/чт — в день игры, иначе на следующий день; за час до игры."""
+	day = poll["day"]
+	hour, minute = _hm(poll["time_game"])
+	if day in ("tue", "thu"):
+		summary_day = day
+	else:
+		summary_day = list(WEEKDAY_MAP.keys())[(WEEKDAY_MAP[day] + 1) % 7]
+	return summary_day, max(hour - 1, 0), minute
+
+class Occurrence(NamedTuple):
+	"""Один запуск опроса: все его моменты времени, посчитанные и локализованные один раз."""
+	index: Optional[int]  # номер в polls_config; None — ручной опрос
+	poll: Dict[str, Any]
+	open_dt: datetime
+	game_dt: datetime
+	close_dt: datetime
+	summary_dt: Optional[datetime]
+	tag_start: datetime
+	reminders: Tuple[datetime, ...]
+
+	def as_dict(self) -> Dict[str, Optional[str]]:
+		"""Сериализуемый вид для хранения в данных опроса."""
+		return {
+			"open": self.open_dt.isoformat(),
+			"game": self.game_dt.isoformat(),
+			"close": self.close_dt.isoformat(),
+			"summary": self.summary_dt.isoformat() if self.summary_dt else None,
+		}
+
+def build_occurrence(poll: Dict[str, Any], open_dt: datetime, index: Optional[int] = None, tz=KALININGRAD_TZ) -> Occurrence:
+	"""Рассчитать все моменты запуска опроса, открытого в open_dt.
+
+	Игра — в день итогов (summary_cron_slot: для вт/чт в день опроса, иначе назавтра),
+	для ручных опросов — сразу. Закрытие — по manual_close_day/manual_close_time, иначе
+	по compute_poll_close_dt, но не позже итогов: итоги закрывают опрос.
+	"""
+	day = poll.get("day")
+	scheduled = day in WEEKDAY_MAP
+	summary_dt = None
+	if scheduled:
+		game_hour, game_minute = _hm(poll.get("time_game", open_dt.strftime("%H:%M")))
+		game_day = open_dt.date() + timedelta(days=(WEEKDAY_MAP[day] - open_dt.weekday()) % 7)
+		if day not in ("tue", "thu"):
+			game_day += timedelta(days=1)
+		game_dt = _localize(game_day, game_hour, game_minute, tz)
+		if poll.get("time_game"):
+			s_day, s_hour, s_minute = summary_cron_slot(poll)
+			summary_dt = _next_weekday_at(open_dt, WEEKDAY_MAP[s_day], s_hour, s_minute, tz)
+	else:
+		game_dt = open_dt
+	mclose_day = poll.get("manual_close_day")
+	mclose_time = poll.get("manual_close_time")
+	manual_close = bool(mclose_day or mclose_time)
+	if manual_close:
+		try:
+			c_day = mclose_day or day
+			hour, minute = _hm(mclose_time or poll.get("time_game", "23:59"))
+			if c_day in WEEKDAY_MAP:
+				close_dt = _next_weekday_at(open_dt, WEEKDAY_MAP[c_day], hour, minute, tz)
+			else:
+				close_dt = open_dt + timedelta(hours=24)
+		except Exception:
+			close_dt = open_dt + timedelta(hours=24)
+	else:
+		close_dt = compute_poll_close_dt(poll, open_dt)
+		if summary_dt is not None and summary_dt < close_dt:
+			close_dt = summary_dt
+	# Слишком короткий опрос — как раньше, сутки на голосование
+	if close_dt <= open_dt + timedelta(minutes=5):
+		close_dt = open_dt + timedelta(hours=24)
+	reminders: List[datetime] = []
+	if day in ("tue", "thu") and not manual_close:
+		at = open_dt
+		while at <= close_dt:
+			reminders.append(at)
+			at += REMINDER_INTERVAL
+	return Occurrence(index, poll, open_dt, game_dt, close_dt, summary_dt, max(open_dt, close_dt - TAG_WINDOW), tuple(reminders))
+
+class ScheduleEngine:
+	"""Расписание группы на weeks недель вперёд: неизменяемые Occurrence, отсортированные по открытию.
+
+	source() возвращает (polls_config, disabled_days). Временная шкала строится один раз и
+	пересчитывается только после invalidate(), при смене набора отключённых дней или когда
+	горизонт сдвинулся больше чем на неделю.
+	"""
+
+	def __init__(self, source: Callable[[], Tuple[List[Dict[str, Any]], Set[str]]], weeks: int = 4, tz=KALININGRAD_TZ) -> None:
+		self.source = source
+		self.weeks = weeks
+		self.tz = tz
+		self._timeline: Tuple[Occurrence, ...] = ()
+		self._key: Optional[tuple] = None
+		self._valid_until: Optional[datetime] = None
+
+	def invalidate(self) -> None:
+		self._key = None
+
+	def _build(self, now: datetime) -> Tuple[Occurrence, ...]:
+		polls_config, disabled_days = self.source()
+		start = now - timedelta(days=7)  # захватываем опросы, которые ещё идут
+		items: List[Occurrence] = []
+		for idx, poll in enumerate(polls_config):
+			day = poll.get("day")
+			if day not in WEEKDAY_MAP or day in disabled_days:
+				continue
+			try:
+				hour, minute = _hm(poll["time_poll"])
+			except Exception:
+				continue
+			open_dt = _next_weekday_at(start, WEEKDAY_MAP[day], hour, minute, self.tz)
+			for week in range(self.weeks + 1):
+				day_dt = open_dt.date() + timedelta(days=7 * week)
+				items.append(build_occurrence(poll, _localize(day_dt, hour, minute, self.tz), idx, self.tz))
+		items.sort(key=lambda occ: occ.open_dt)
+		return tuple(items)
+
+	def timeline(self, now: Optional[datetime] = None) -> Tuple[Occurrence, ...]:
+		now = now or now_tz()
+		polls_config, disabled_days = self.source()
+		key = (id(polls_config), len(polls_config), frozenset(disabled_days))
+		if key != self._key or self._valid_until is None or now >= self._valid_until:
+			self._timeline = self._build(now)
+			self._key = key
+			self._valid_until = now + timedelta(days=7)
+		return self._timeline
+
+	def upcoming(self, now: Optional[datetime] = None, limit: Optional[int] = None) -> List[Occurrence]:
+		"""Ещё не открытые опросы по порядку."""
+		now = now or now_tz()
+		items = [occ for occ in self.timeline(now) if occ.open_dt > now]
+		return items[:limit] if limit is not None else items
+
+	def next_poll(self, now: Optional[datetime] = None) -> Optional[Occurrence]:
+		items = self.upcoming(now, limit=1)
+		return items[0] if items else None
+
+	def occurrence_for(self, poll: Dict[str, Any], now: Optional[datetime] = None) -> Occurrence:
+		"""Запуск, к которому относится опрос, открываемый сейчас.
+
+		Плановый опрос (в т.ч. догнанный после простоя) берётся из шкалы; ручной или
+		запущенный вне расписания — считается от текущего момента.
+		"""
+		now = now or now_tz()
+		for occ in self.timeline(now):
+			if occ.open_dt > now:
+				break
+			if occ.close_dt > now and occ.poll.get("day") == poll.get("day") and occ.poll.get("time_poll") == poll.get("time_poll") and occ.poll.get("time_game") == poll.get("time_game"):
+				return occ._replace(poll=poll)
+		return build_occurrence(poll, now, tz=self.tz)
+
 def compute_next_poll_datetime(polls_config: Any, disabled_days: set) -> Optional[Tuple[datetime, Dict[str, Any]]]:
 	"""Найти ближайший по времени автозапуск опроса с учётом отключённых дней."""
-	now = now_tz()
-	candidates = []
-	for cfg in polls_config:
-		day = cfg.get("day")
-		if day not in WEEKDAY_MAP:
-			continue
-		if day in disabled_days:
-			continue
-		hour, minute = map(int, cfg["time_poll"].split(":"))
-		target = WEEKDAY_MAP[day]
-		days_ahead = (target - now.weekday()) % 7
-		dt = now_tz().replace(hour=hour, minute=minute, second=0, microsecond=0) + timedelta(days=days_ahead)
-		if dt <= now:
-			dt += timedelta(days=7)
-		candidates.append((dt, cfg))
-	if not candidates:
-		return None
-	return sorted(candidates, key=lambda x: x[0])[0]
+	occ = ScheduleEngine(lambda: (polls_config, disabled_days), weeks=1).next_poll()
+	return (occ.open_dt, occ.poll) if occ else None
 
 
 
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Iterable
+import os
+import asyncio
+import logging
+import aiohttp
+
+log = logging.getLogger("bot")
+
+# Внутренний канал фронт -> воркер: POST на localhost с общим секретом
+SHARD_UPDATE_PATH = "/shard/update"
+SHARD_SECRET_HEADER = "X-Shard-Secret"
+
+# Виды обновлений, в которых чат лежит прямо в объекте
+_CHAT_UPDATE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member", "chat_join_request")
+
+def shard_for(chat_id: int, shard_count: int) -> int:
+	"""Номер шарда для чата: детерминированно, одинаково во всех процессах."""
+	return abs(int(chat_id)) % max(1, shard_count)
+
+def shard_path(path: str, shard_index: int) -> str:
+	"""Файл конкретного шарда (лок, лог): bot.lock -> bot.shard1.lock."""
+	root, ext = os.path.splitext(path)
+	return f"{root}.shard{shard_index}{ext}"
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+	"""chat.id из сырого обновления Telegram или None, если чата в нём нет (poll_answer, inline)."""
+	for key in _CHAT_UPDATE_KEYS:
+		obj = update.get(key)
+		if obj and obj.get("chat"):
+			return obj["chat"].get("id")
+	message = (update.get("callback_query") or {}).get("message")
+	if message and message.get("chat"):
+		return message["chat"].get("id")
+	return None
+
+class ShardRouter:
+	"""Выбор воркера для обновления.
+
+	Группы из списка тенантов живут на shard_for(chat_id); личные чаты и незнакомые группы
+	идут на шард основной группы (там их обрабатывали и без шардирования). Для poll_answer
+	чата нет — владелец опроса запоминается после первого успешного ответа воркера.
+	"""
+
+	def __init__(self, shard_count: int, tenant_chats: Iterable[int], default_chat_id: int, max_polls: int = 10000) -> None:
+		self.shard_count = max(1, shard_count)
+		self.tenant_chats = set(tenant_chats)
+		self.default_shard = shard_for(default_chat_id, self.shard_count)
+		self.max_polls = max_polls
+		self._poll_owner: "OrderedDict[str, int]" = OrderedDict()
+
+	def shard_for_chat(self, chat_id: Optional[int]) -> int:
+		if chat_id is None or chat_id not in self.tenant_chats:
+			return self.default_shard
+		return shard_for(chat_id, self.shard_count)
+
+	def route(self, update: Dict[str, Any]) -> Optional[int]:
+		"""Шард для обновления; None — poll_answer для опроса, владелец которого ещё неизвестен."""
+		answer = update.get("poll_answer")
+		if answer:
+			return self._poll_owner.get(answer.get("poll_id"))
+		return self.shard_for_chat(update_chat_id(update))
+
+	def learn_poll(self, poll_id: str, shard_index: int) -> None:
+		self._poll_owner[poll_id] = shard_index
+		self._poll_owner.move_to_end(poll_id)
+		while len(self._poll_owner) > self.max_polls:
+			self._poll_owner.popitem(last=False)
+
+class ShardSupervisor:
+	"""Запускает воркеры шардов, перезапускает упавшие и пересылает им обновления.
+
+	Воркер i — отдельный процесс `command` с SHARD_INDEX=i; он слушает 127.0.0.1:base_port+i
+	и отвечает {"handled": bool}. Обработка идёт в воркере в фоне, так что пересылка
+	быстрая и порядок обновлений одного чата сохраняется.
+	"""
+
+	def __init__(self, router: ShardRouter, command: List[str], base_port: int, secret: str, env: Optional[Dict[str, str]] = None, restart_delay: float = 5.0) -> None:
+		self.router = router
+		self.command = command
+		self.base_port = base_port
+		self.secret = secret
+		self.env = dict(env if env is not None else os.environ)
+		self.restart_delay = restart_delay
+		self.stopping = False
+		self._procs: Dict[int, asyncio.subprocess.Process] = {}
+		self._tasks: List[asyncio.Task] = []
+		self._session: Optional[aiohttp.ClientSession] = None
+
+	@property
+	def shard_count(self) -> int:
+		return self.router.shard_count
+
+	def _worker_env(self, index: int) -> Dict[str, str]:
+		env = dict(self.env)
+		env["SHARD_INDEX"] = str(index)
+		env["SHARD_COUNT"] = str(self.shard_count)
+		env["SHARD_BASE_PORT"] = str(self.base_port)
+		# Свой лог-файл: RotatingFileHandler не умеет делить файл между процессами
+		env["LOG_FILE"] = shard_path(env.get("LOG_FILE", "bot.log"), index)
+		return env
+
+	async def _keep_alive(self, index: int) -> None:
+		while not self.stopping:
+			proc = await asyncio.create_subprocess_exec(*self.command, env=self._worker_env(index))
+			self._procs[index] = proc
+			log.info("Shard %s worker started (pid=%s, port=%s)", index, proc.pid, self.base_port + index)
+			code = await proc.wait()
+			self._procs.pop(index, None)
+			if self.stopping:
+				break
+			log.warning("Shard %s worker exited with code %s — restarting in %ss", index, code, self.restart_delay)
+			await asyncio.sleep(self.restart_delay)
+
+	def start(self) -> None:
+		"""Запустить воркеры в текущем event loop."""
+		self.stopping = False
+		self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+		self._tasks = [asyncio.create_task(self._keep_alive(i)) for i in range(self.shard_count)]
+
+	async def stop(self, timeout: float = 20.0) -> None:
+		"""Остановить воркеры (SIGTERM, затем SIGKILL по таймауту)."""
+		self.stopping = True
+		for proc in list(self._procs.values()):
+			if proc.returncode is None:
+				proc.terminate()
+		for index, proc in list(self._procs.items()):
+			try:
+				await asyncio.wait_for(proc.wait(), timeout=timeout)
+			except asyncio.TimeoutError:
+				log.warning("Shard %s worker did not stop in %ss — killing", index, timeout)
+				proc.kill()
+		for task in self._tasks:
+			task.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		self._tasks = []
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	async def _send(self, index: int, update: Dict[str, Any]) -> Optional[bool]:
+		"""Отправить обновление воркеру; False — воркер его отклонил, None — воркер недоступен."""
+		url = f"http://127.0.0.1:{self.base_port + index}{SHARD_UPDATE_PATH}"
+		try:
+			async with self._session.post(url, json=update, headers={SHARD_SECRET_HEADER: self.secret}) as resp:
+				if resp.status != 200:
+					log.warning("Shard %s rejected update %s: HTTP %s", index, update.get("update_id"), resp.status)
+					# 4xx (битое обновление, чужой секрет) повтор не исправит
+					return False if 400 <= resp.status < 500 else None
+				return bool((await resp.json()).get("handled"))
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			log.warning("Shard %s unreachable for update %s: %s", index, update.get("update_id"), e)
+			return None
+
+	async def forward(self, update: Dict[str, Any]) -> Optional[bool]:
+		"""Переслать обновление воркеру-владельцу.
+
+		True — принято, False — отклонено окончательно (например, ответ на опрос, которого нет ни у одного
+		воркера), None — нужный воркер сейчас недоступен, пересылку стоит повторить.
+		"""
+		index = self.router.route(update)
+		if index is not None:
+			return await self._send(index, update)
+		# Владелец опроса неизвестен (например, после рестарта фронта) — спрашиваем воркеры по очереди
+		poll_id = update["poll_answer"].get("poll_id")
+		result: Optional[bool] = False
+		for index in range(self.shard_count):
+			handled = await self._send(index, update)
+			if handled:
+				self.router.learn_poll(poll_id, index)
+				return True
+			if handled is None:
+				# Опрос может оказаться у недоступного воркера — отказ не окончательный
+				result = None
+		return result
+
+
+
+
+
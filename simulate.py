@@ -0,0 +1,280 @@
+"""Ускоренная симуляция расписания: неделя polls_config за секунды на виртуальных часах.
+
+Бот из bot.py работает с поддельным Telegram (bench_replay.FakeTransport) и на clock.VirtualClock:
+симулятор переводит часы сразу к следующему событию — заданию планировщика, голосу игрока
+или концу таймаута — и ждёт, пока бот его обработает. В каждом открытом опросе голосуют
+игроки; часть выбирает «Под вопросом», чтобы прошли теги, итоги и 36-часовые блокировки.
+
+	python simulate.py                                  # неделя с ближайшего понедельника
+	python simulate.py --start 2026-10-19T00:00 --days 14 --yes 12 --maybe 0
+	python simulate.py --hide autosave,prefetch,vote --out week.json
+
+Печатается каждое событие с виртуальным временем, в конце — сводка нагрузки на планировщик
+(запуски по видам заданий, реальное время их обработки, пик числа заданий); --out пишет
+события и сводку в JSON.
+"""
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, time as dtime
+from typing import Any, Dict, List, Optional, Tuple
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import asyncio
+import argparse
+
+# bench_replay готовит окружение (временный каталог, без сети и файлов в рабочем каталоге) и импортирует бот
+import bench_replay as bench
+import bot as app
+import clock
+import tenants
+from aiogram import types
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+from metrics import job_kind
+from polls import CATEGORY_YES, CATEGORY_NO, CATEGORY_MAYBE
+from state import KALININGRAD_TZ
+
+# Сколько раз подряд можно обработать один и тот же момент, прежде чем считать симуляцию зависшей
+MAX_STEPS_PER_INSTANT = 100
+
+def _short(text: Any, limit: int = 70) -> str:
+	text = " ".join(str(text).split())
+	return text if len(text) <= limit else text[:limit - 1] + "…"
+
+class RecordingTransport(bench.FakeTransport):
+	"""Поддельный Telegram, который заносит каждый вызов API в журнал событий симуляции."""
+
+	def __init__(self, sim: "Simulation") -> None:
+		super().__init__()
+		self.sim = sim
+
+	async def request(self, method: str, data: Optional[Dict[str, Any]] = None, files: Any = None, **kwargs: Any) -> Any:
+		result = await super().request(method, data, files, **kwargs)
+		data = data or {}
+		if method != "getMe":
+			detail = data.get("question") or data.get("text") or data.get("message_id") or data.get("user_id") or ""
+			self.sim.record("api", method, f"chat {data.get('chat_id')}: {_short(detail)}")
+		if method == "sendPoll":
+			self.sim.plan_votes(result["poll"]["id"])
+		return result
+
+class Simulation:
+	"""Прогон бота на виртуальных часах от start на days суток."""
+
+	def __init__(self, args: argparse.Namespace, start: datetime) -> None:
+		self.args = args
+		self.start = start
+		self.end_ts = start.timestamp() + args.days * 86400
+		self.clock = clock.VirtualClock(start.timestamp())
+		self.harness = bench.BenchHarness()
+		self.harness.transport = RecordingTransport(self)
+		self.rnd = random.Random(args.seed)
+		self.events: List[Dict[str, Any]] = []
+		self._votes: List[Tuple[float, int, str, int, str]] = []  # (ts, seq, poll_id, user_id, категория)
+		self._seq = 0
+		self._inflight = 0
+		self._job_started: Dict[str, float] = {}
+		self.job_runs: Counter = Counter()
+		self.job_errors: Counter = Counter()
+		self.job_seconds: Dict[str, float] = defaultdict(float)
+		self.peak_jobs = 0
+
+	def record(self, kind: str, name: str, detail: str = "") -> None:
+		now = self.clock.now(KALININGRAD_TZ)
+		self.events.append({"at": now.isoformat(), "kind": kind, "name": name, "detail": detail})
+
+	def plan_votes(self, poll_id: str) -> None:
+		"""Запланировать голоса игроков в только что открытый опрос (в пределах --vote-hours)."""
+		now = self.clock.time()
+		window = self.args.vote_hours * 3600
+		voters = [CATEGORY_YES] * self.args.yes + [CATEGORY_NO] * self.args.no + [CATEGORY_MAYBE] * self.args.maybe
+		for i, category in enumerate(voters):
+			self._seq += 1
+			# Одни и те же игроки во всех опросах: голоса заблокированных после итогов игнорируются ботом
+			heapq.heappush(self._votes, (now + self.rnd.uniform(60, window), self._seq, poll_id, bench.USER_ID_BASE + i, category))
+
+	def _on_job_event(self, event: Any) -> None:
+		kind = job_kind(event.job_id)
+		if event.code == EVENT_JOB_SUBMITTED:
+			self._inflight += 1
+			self._job_started[event.job_id] = time.perf_counter()
+			self.record("job", event.job_id)
+		elif event.code == EVENT_JOB_MISSED:
+			self.record("missed", event.job_id, str(event.scheduled_run_time))
+		else:
+			self._inflight -= 1
+			self.job_runs[kind] += 1
+			self.job_seconds[kind] += time.perf_counter() - self._job_started.pop(event.job_id, time.perf_counter())
+			if event.exception is not None:
+				self.job_errors[kind] += 1
+				self.record("error", event.job_id, _short(repr(event.exception)))
+
+	def _next_event(self) -> Optional[float]:
+		candidates = []
+		jobs = app.scheduler.get_jobs()
+		self.peak_jobs = max(self.peak_jobs, len(jobs))
+		candidates.extend(job.next_run_time.timestamp() for job in jobs if job.next_run_time)
+		for t in tenants.registry:
+			deadline = t.duels.timeouts.next_deadline()
+			if deadline is not None:
+				candidates.append(deadline)
+		if self._votes:
+			candidates.append(self._votes[0][0])
+		return min(candidates, default=None)
+
+	async def _settle(self) -> None:
+		"""Дождаться, пока бот доделает всё, что вызвало текущее событие."""
+		idle, seen = 0, len(self.events)
+		while idle < 10:
+			if self._inflight > 0:
+				# Синхронные задания (автосейв) выполняются в пуле потоков
+				await asyncio.sleep(0.001)
+				idle = 0
+				continue
+			await asyncio.sleep(0)
+			if len(self.events) != seen:
+				idle, seen = 0, len(self.events)
+			else:
+				idle += 1
+
+	def _vote_update(self, poll_id: str, user_id: int, category: str) -> Optional[Tuple[Dict[str, Any], str]]:
+		t = tenants.registry.for_poll(poll_id)
+		data = t.active_polls.get(poll_id) if t is not None else None
+		if not data or not data.get("active"):
+			return None
+		categories = data.get("categories") or []
+		if category not in categories:
+			# В опросе без «Под вопросом» (пятница) сомневающиеся отвечают «Нет»
+			category = CATEGORY_NO
+		if category not in categories:
+			return None
+		return bench.poll_answer_update(user_id, poll_id, [categories.index(category)]), category
+
+	async def _fire_due(self) -> None:
+		now = self.clock.time()
+		while self._votes and self._votes[0][0] <= now:
+			_, _, poll_id, user_id, category = heapq.heappop(self._votes)
+			vote = self._vote_update(poll_id, user_id, category)
+			if vote is None:
+				continue
+			raw, category = vote
+			self.record("vote", str(user_id), f"{poll_id}: {category}")
+			await app._process_webhook_update(types.Update(**raw))
+		for t in tenants.registry:
+			timeouts = t.duels.timeouts
+			for uid, until in list(timeouts.deadlines.items()):
+				if until <= now:
+					self.record("timeout", uid, f"chat {t.chat_id}: expired")
+			timeouts.wake()
+		app.scheduler.wakeup()
+		await self._settle()
+
+	async def run(self) -> None:
+		previous = clock.set_clock(self.clock)
+		h = self.harness
+		try:
+			await h.setup()
+			app.START_TIME = self.clock.now()
+			app.scheduler.add_listener(self._on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+			app.schedule_polls()
+			app.scheduler.resume()
+			await self._settle()
+			last, steps = None, 0
+			while True:
+				nxt = self._next_event()
+				if nxt is None or nxt > self.end_ts:
+					break
+				if nxt > self.clock.time():
+					self.clock.set(nxt)
+				steps = steps + 1 if nxt == last else 0
+				if steps > MAX_STEPS_PER_INSTANT:
+					raise RuntimeError(f"Simulation is stuck at {self.clock.now(KALININGRAD_TZ)}")
+				last = nxt
+				await self._fire_due()
+			self.clock.set(max(self.end_ts, self.clock.time()))
+			await h.teardown()
+		finally:
+			clock.set_clock(previous)
+
+	def summary(self, real_seconds: float) -> Dict[str, Any]:
+		return {
+			"start": self.start.isoformat(),
+			"end": datetime.fromtimestamp(self.end_ts, KALININGRAD_TZ).isoformat(),
+			"real_seconds": round(real_seconds, 3),
+			"events": dict(Counter(e["kind"] for e in self.events)),
+			"job_runs": dict(sorted(self.job_runs.items())),
+			"job_errors": dict(sorted(self.job_errors.items())),
+			"job_seconds": {kind: round(s, 4) for kind, s in sorted(self.job_seconds.items())},
+			"peak_jobs": self.peak_jobs,
+			"api_calls": dict(sorted(self.harness.transport.calls.items())),
+		}
+
+def _default_start() -> datetime:
+	"""Полночь ближайшего понедельника (Калининград)."""
+	today = datetime.now(KALININGRAD_TZ).date()
+	monday = today + timedelta(days=(7 - today.weekday()) % 7 or 7)
+	return KALININGRAD_TZ.localize(datetime.combine(monday, dtime()))
+
+def _parse_start(value: Optional[str]) -> datetime:
+	if not value:
+		return _default_start()
+	dt = datetime.fromisoformat(value)
+	return KALININGRAD_TZ.localize(dt) if dt.tzinfo is None else dt.astimezone(KALININGRAD_TZ)
+
+def _print_event(event: Dict[str, Any]) -> None:
+	at = datetime.fromisoformat(event["at"])
+	print(f"{at:%a %Y-%m-%d %H:%M:%S}  {event['kind']:<7} {event['name']}  {event['detail']}".rstrip())
+
+def _hidden(event: Dict[str, Any], hide: set) -> bool:
+	if event["kind"] in hide:
+		return True
+	return event["kind"] in ("job", "missed", "error") and job_kind(event["name"]) in hide
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--start", help="начало симуляции, ISO (по умолчанию — ближайший понедельник 00:00, Калининград)")
+	parser.add_argument("--days", type=float, default=7.0, help="длительность в сутках")
+	parser.add_argument("--yes", type=int, default=8, help="игроков, голосующих «Да» в каждом опросе")
+	parser.add_argument("--no", type=int, default=3, help="игроков, голосующих «Нет»")
+	parser.add_argument("--maybe", type=int, default=2, help="игроков, голосующих «Под вопросом»")
+	parser.add_argument("--vote-hours", type=float, default=4.0, help="в течение скольких часов после открытия приходят голоса")
+	parser.add_argument("--hide", default="autosave", help="не печатать эти виды событий/заданий, через запятую (job, api, vote, autosave, prefetch...)")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--out", help="записать события и сводку в JSON")
+	return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+	args = parse_args(argv)
+	sim = Simulation(args, _parse_start(args.start))
+	started = time.perf_counter()
+	try:
+		asyncio.run(sim.run())
+	finally:
+		shutil.rmtree(bench.WORKDIR, ignore_errors=True)
+	summary = sim.summary(time.perf_counter() - started)
+	hide = {kind.strip() for kind in args.hide.split(",") if kind.strip()}
+	for event in sim.events:
+		if not _hidden(event, hide):
+			_print_event(event)
+	print(f"\nSimulated {summary['start']} .. {summary['end']} in {summary['real_seconds']}s: "
+		f"{len(sim.events)} events, peak {summary['peak_jobs']} scheduled jobs")
+	for kind, runs in summary["job_runs"].items():
+		print(f"    {kind}: {runs} runs, {summary['job_seconds'][kind]}s, {summary['job_errors'].get(kind, 0)} errors")
+	print(f"    API calls: {summary['api_calls']}")
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			json.dump({"summary": summary, "config": vars(args), "events": sim.events}, f, ensure_ascii=False, indent=2)
+		print(f"Events written to {args.out}")
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
+
+
+
+
+
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Dict, Optional
 from pytz import timezone
 
+import clock
+
 # Общая таймзона проекта
 KALININGRAD_TZ = timezone("Europe/Kaliningrad")
 
 # Отображение дней недели
 WEEKDAY_MAP: Dict[str, int] = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
 
+# chat_id группы, для которой обрабатывается текущее обновление или задание (см. tenants)
+current_chat: ContextVar[Optional[int]] = ContextVar("current_chat", default=None)
+
 def now_tz() -> datetime:
 	"""Текущее время в таймзоне Калининграда."""
-	return datetime.now(KALININGRAD_TZ)
+	return clock.now(KALININGRAD_TZ)
 
 def iso_now() -> str:
 	"""ISO-строка текущего времени (в таймзоне Калининграда)."""
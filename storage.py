@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Tuple, Set, List, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+from abc import ABC, abstractmethod
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+
+from persistence import save_data as _json_save, load_data as _json_load, DataJournal, JOURNAL_SUFFIX, empty_duels_state
+
+log = logging.getLogger("bot")
+
+# active_polls, stats, disabled_days, questionable_reminders_enabled, duels
+State = Tuple[Dict[str, Dict[str, Any]], Dict[str, Any], Set[str], bool, Dict[str, Dict[str, Any]]]
+
+class Storage(ABC):
+	"""Интерфейс хранилища состояния бота (опросы, голоса, статистика, настройки).
+
+	incremental=True означает, что record() сам надёжно сохраняет отдельные изменения
+	и полная перезапись после каждого голоса не нужна.
+	"""
+
+	incremental = False
+
+	def __init__(self) -> None:
+		self._snapshot_cb: Optional[Callable[[], State]] = None
+
+	@abstractmethod
+	async def load(self) -> State:
+		"""Прочитать состояние из хранилища."""
+
+	def start(self, snapshot_cb: Callable[[], State]) -> None:
+		"""Запустить фоновые задачи хранилища; snapshot_cb возвращает текущее состояние."""
+		self._snapshot_cb = snapshot_cb
+
+	def record(self, op: str, **fields: Any) -> None:
+		"""Зафиксировать одно изменение (poll_open, vote, unvote, poll_close, timeout_set, timeout_clear, duel_count, username)."""
+
+	@abstractmethod
+	async def save_all(self, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+		"""Полностью перезаписать состояние."""
+
+	async def top_stats(self) -> List[Dict[str, Any]]:
+		"""Статистика 'Да' по убыванию."""
+		stats = self._snapshot_cb()[1] if self._snapshot_cb else {}
+		return sorted(stats.values(), key=lambda x: -x["count"])
+
+	@abstractmethod
+	async def backup_file(self) -> Optional[str]:
+		"""Подготовить файл с актуальными данными для /backup."""
+
+	async def flush(self) -> None:
+		"""Дождаться записи всех накопленных изменений."""
+
+	async def close(self) -> None:
+		await self.flush()
+
+class JsonStorage(Storage):
+	"""Хранилище в JSON-файле, опционально с журналом изменений."""
+
+	def __init__(self, path: str, journal: bool = True) -> None:
+		super().__init__()
+		self.path = path
+		self.journal = DataJournal(path) if journal else None
+		self.incremental = self.journal is not None
+
+	async def load(self) -> State:
+		if not os.path.exists(self.path) and not os.path.exists(self.path + JOURNAL_SUFFIX):
+			log.info("No data file found — starting fresh")
+		return await _json_load(self.path)
+
+	def start(self, snapshot_cb: Callable[[], State]) -> None:
+		super().start(snapshot_cb)
+		if self.journal is not None:
+			self.journal.start(snapshot_cb)
+			log.info("Vote journal enabled: %s", self.journal.journal_path)
+
+	def record(self, op: str, **fields: Any) -> None:
+		if self.journal is not None:
+			self.journal.append(op, **fields)
+
+	async def save_all(self, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+		if self.journal is not None:
+			# Полный снимок сворачивает накопленный журнал
+			await self.journal.compact(active_polls, stats, disabled_days, questionable_reminders_enabled, duels)
+		else:
+			await _json_save(self.path, active_polls, stats, disabled_days, questionable_reminders_enabled, duels)
+
+	async def backup_file(self) -> Optional[str]:
+		if self.journal is not None and self._snapshot_cb:
+			await self.journal.compact(*self._snapshot_cb())
+		return self.path if os.path.exists(self.path) else None
+
+	async def flush(self) -> None:
+		if self.journal is not None:
+			await self.journal.flush()
+
+	async def close(self) -> None:
+		if self.journal is not None:
+			await self.journal.close()
+			if self._snapshot_cb:
+				await self.journal.compact(*self._snapshot_cb())
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS polls (
+	poll_id TEXT PRIMARY KEY,
+	created_at TEXT NOT NULL DEFAULT '',
+	active INTEGER NOT NULL DEFAULT 1,
+	data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_polls_created ON polls(created_at);
+CREATE TABLE IF NOT EXISTS votes (
+	poll_id TEXT NOT NULL,
+	user_key TEXT NOT NULL,
+	user_id INTEGER,
+	data TEXT NOT NULL,
+	PRIMARY KEY (poll_id, user_key)
+);
+CREATE INDEX IF NOT EXISTS idx_votes_user ON votes(user_id);
+CREATE TABLE IF NOT EXISTS user_stats (
+	user_id TEXT PRIMARY KEY,
+	name TEXT NOT NULL,
+	count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_stats_count ON user_stats(count DESC);
+CREATE TABLE IF NOT EXISTS disabled_days (
+	day TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS duel_timeouts (
+	user_id TEXT PRIMARY KEY,
+	until_ts REAL NOT NULL,
+	chat_id INTEGER,
+	name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_duel_timeouts_until ON duel_timeouts(until_ts);
+CREATE TABLE IF NOT EXISTS duel_daily_count (
+	user_id TEXT PRIMARY KEY,
+	date TEXT NOT NULL,
+	count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS usernames (
+	username TEXT PRIMARY KEY,
+	user_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_usernames_user ON usernames(user_id);
+CREATE TABLE IF NOT EXISTS settings (
+	key TEXT PRIMARY KEY,
+	value TEXT
+);
+"""
+
+def _dumps(obj: Any) -> str:
+	return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+class SqliteStorage(Storage):
+	"""Хранилище в SQLite (WAL): каждое изменение голоса — запись одной строки.
+
+	Все обращения к соединению идут через один рабочий поток, поэтому event loop
+	не блокируется, а порядок записей сохраняется.
+	"""
+
+	incremental = True
+
+	def __init__(self, path: str, migrate_from: Optional[str] = None) -> None:
+		super().__init__()
+		self.path = path
+		self.migrate_from = migrate_from
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+		self._conn: Optional[sqlite3.Connection] = None
+
+	def _db(self) -> sqlite3.Connection:
+		if self._conn is None:
+			conn = sqlite3.connect(self.path, check_same_thread=False)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			conn.executescript(_SCHEMA)
+			self._conn = conn
+		return self._conn
+
+	async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+		return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+	def _is_empty(self) -> bool:
+		db = self._db()
+		row = db.execute("SELECT value FROM settings WHERE key='json_migrated'").fetchone()
+		if row:
+			return False
+		return db.execute("SELECT 1 FROM polls LIMIT 1").fetchone() is None and db.execute("SELECT 1 FROM user_stats LIMIT 1").fetchone() is None
+
+	def _load(self) -> State:
+		db = self._db()
+		active_polls: Dict[str, Dict[str, Any]] = {}
+		for pid, data in db.execute("SELECT poll_id, data FROM polls ORDER BY created_at"):
+			entry = json.loads(data)
+			entry["votes"] = {}
+			active_polls[pid] = entry
+		for pid, key, data in db.execute("SELECT poll_id, user_key, data FROM votes ORDER BY rowid"):
+			if pid in active_polls:
+				active_polls[pid]["votes"][key] = json.loads(data)
+		stats = {uid: {"name": name, "count": count} for uid, name, count in db.execute("SELECT user_id, name, count FROM user_stats")}
+		disabled_days = {day for (day,) in db.execute("SELECT day FROM disabled_days")}
+		row = db.execute("SELECT value FROM settings WHERE key='questionable_reminders_enabled'").fetchone()
+		qrem = True if row is None else row[0] == "1"
+		duels = empty_duels_state()
+		for uid, until, chat_id, name in db.execute("SELECT user_id, until_ts, chat_id, name FROM duel_timeouts"):
+			duels["timeouts"][uid] = {"until": until, "chat_id": chat_id, "name": name}
+		for uid, date, count in db.execute("SELECT user_id, date, count FROM duel_daily_count"):
+			duels["daily"][uid] = {"date": date, "count": count}
+		for username, uid in db.execute("SELECT username, user_id FROM usernames"):
+			duels["usernames"][username] = uid
+		return active_polls, stats, disabled_days, qrem, duels
+
+	async def load(self) -> State:
+		if self.migrate_from and await self._call(self._is_empty) and (os.path.exists(self.migrate_from) or os.path.exists(self.migrate_from + JOURNAL_SUFFIX)):
+			# Однократная миграция из JSON (снимок + журнал)
+			state = await _json_load(self.migrate_from)
+			await self._call(self._save_all, *state)
+			await self._call(self._set_setting, "json_migrated", self.migrate_from)
+			log.info("Migrated %s into SQLite storage %s", self.migrate_from, self.path)
+		return await self._call(self._load)
+
+	def _set_setting(self, key: str, value: str) -> None:
+		with self._db() as db:
+			db.execute("INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+
+	def _upsert_poll(self, db: sqlite3.Connection, pid: str, entry: Dict[str, Any]) -> None:
+		data = {k: v for k, v in entry.items() if k != "votes"}
+		db.execute(
+			"INSERT INTO polls(poll_id, created_at, active, data) VALUES(?, ?, ?, ?) "
+			"ON CONFLICT(poll_id) DO UPDATE SET created_at=excluded.created_at, active=excluded.active, data=excluded.data",
+			(pid, entry.get("created_at", ""), 1 if entry.get("active") else 0, _dumps(data)),
+		)
+
+	def _upsert_vote(self, db: sqlite3.Connection, pid: str, key: str, vote: Dict[str, Any]) -> None:
+		db.execute(
+			"INSERT INTO votes(poll_id, user_key, user_id, data) VALUES(?, ?, ?, ?) "
+			"ON CONFLICT(poll_id, user_key) DO UPDATE SET user_id=excluded.user_id, data=excluded.data",
+			(pid, str(key), vote.get("user_id"), _dumps(vote)),
+		)
+
+	def _upsert_stats(self, db: sqlite3.Connection, stats: Dict[str, Any]) -> None:
+		db.executemany(
+			"INSERT INTO user_stats(user_id, name, count) VALUES(?, ?, ?) "
+			"ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, count=excluded.count",
+			[(uid, row.get("name", ""), int(row.get("count", 0))) for uid, row in stats.items()],
+		)
+
+	def _apply(self, op: str, fields: Dict[str, Any]) -> None:
+		pid = fields.get("poll_id")
+		with self._db() as db:
+			if op == "poll_open":
+				entry = fields.get("entry", {})
+				self._upsert_poll(db, pid, entry)
+				for key, vote in entry.get("votes", {}).items():
+					self._upsert_vote(db, pid, key, vote)
+			elif op == "vote":
+				self._upsert_vote(db, pid, fields.get("user"), fields.get("vote", {}))
+			elif op == "unvote":
+				db.execute("DELETE FROM votes WHERE poll_id=? AND user_key=?", (pid, str(fields.get("user"))))
+			elif op == "poll_close":
+				db.execute("DELETE FROM votes WHERE poll_id=?", (pid,))
+				db.execute("DELETE FROM polls WHERE poll_id=?", (pid,))
+				self._upsert_stats(db, fields.get("stats") or {})
+			elif op == "timeout_set":
+				db.execute(
+					"INSERT INTO duel_timeouts(user_id, until_ts, chat_id, name) VALUES(?, ?, ?, ?) "
+					"ON CONFLICT(user_id) DO UPDATE SET until_ts=excluded.until_ts, chat_id=excluded.chat_id, name=excluded.name",
+					(str(fields.get("user")), fields.get("until"), fields.get("chat_id"), fields.get("name")),
+				)
+			elif op == "timeout_clear":
+				db.execute("DELETE FROM duel_timeouts WHERE user_id=?", (str(fields.get("user")),))
+			elif op == "duel_count":
+				db.execute(
+					"INSERT INTO duel_daily_count(user_id, date, count) VALUES(?, ?, ?) "
+					"ON CONFLICT(user_id) DO UPDATE SET date=excluded.date, count=excluded.count",
+					(str(fields.get("user")), fields.get("date"), fields.get("count")),
+				)
+			elif op == "username":
+				db.execute(
+					"INSERT INTO usernames(username, user_id) VALUES(?, ?) ON CONFLICT(username) DO UPDATE SET user_id=excluded.user_id",
+					(str(fields.get("username")), fields.get("user_id")),
+				)
+
+	def record(self, op: str, **fields: Any) -> None:
+		# Копия через JSON: рабочий поток не должен видеть словари, которые меняет event loop
+		fut = self._executor.submit(self._apply, op, json.loads(_dumps(fields)))
+
+		def _done(f) -> None:
+			if f.exception() is not None:
+				log.error("SQLite write %s failed: %s", op, f.exception())
+		fut.add_done_callback(_done)
+
+	def _save_all(self, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+		with self._db() as db:
+			db.execute("DELETE FROM votes")
+			db.execute("DELETE FROM polls")
+			for pid, entry in active_polls.items():
+				self._upsert_poll(db, pid, entry)
+				for key, vote in entry.get("votes", {}).items():
+					self._upsert_vote(db, pid, key, vote)
+			self._upsert_stats(db, stats)
+			db.execute("DELETE FROM disabled_days")
+			db.executemany("INSERT INTO disabled_days(day) VALUES(?)", [(d,) for d in sorted(disabled_days)])
+			db.execute(
+				"INSERT INTO settings(key, value) VALUES('questionable_reminders_enabled', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+				("1" if questionable_reminders_enabled else "0",),
+			)
+			if duels is not None:
+				db.execute("DELETE FROM duel_timeouts")
+				db.executemany(
+					"INSERT INTO duel_timeouts(user_id, until_ts, chat_id, name) VALUES(?, ?, ?, ?)",
+					[(uid, t.get("until"), t.get("chat_id"), t.get("name")) for uid, t in duels.get("timeouts", {}).items()],
+				)
+				db.execute("DELETE FROM duel_daily_count")
+				db.executemany(
+					"INSERT INTO duel_daily_count(user_id, date, count) VALUES(?, ?, ?)",
+					[(uid, d.get("date"), d.get("count", 0)) for uid, d in duels.get("daily", {}).items()],
+				)
+				db.executemany(
+					"INSERT INTO usernames(username, user_id) VALUES(?, ?) ON CONFLICT(username) DO UPDATE SET user_id=excluded.user_id",
+					list(duels.get("usernames", {}).items()),
+				)
+
+	async def save_all(self, active_polls: Dict[str, Dict[str, Any]], stats: Dict[str, Any], disabled_days: Set[str], questionable_reminders_enabled: bool = True, duels: Optional[Dict[str, Any]] = None) -> None:
+		# Сериализуем в event loop, чтобы поток не читал изменяющиеся словари
+		snapshot = json.loads(_dumps({"active_polls": active_polls, "stats": stats, "duels": duels}))
+		await self._call(self._save_all, snapshot["active_polls"], snapshot["stats"], set(disabled_days), questionable_reminders_enabled, snapshot["duels"])
+
+	async def top_stats(self) -> List[Dict[str, Any]]:
+		def _query() -> List[Dict[str, Any]]:
+			rows = self._db().execute("SELECT name, count FROM user_stats ORDER BY count DESC")
+			return [{"name": name, "count": count} for name, count in rows]
+		return await self._call(_query)
+
+	async def backup_file(self) -> Optional[str]:
+		dest = self.path + ".backup"
+		def _backup() -> None:
+			target = sqlite3.connect(dest)
+			try:
+				self._db().backup(target)
+			finally:
+				target.close()
+		await self._call(_backup)
+		return dest
+
+	async def flush(self) -> None:
+		# Барьер: однопоточный исполнитель выполнит его после всех ранее поставленных записей
+		await self._call(lambda: None)
+
+	async def close(self) -> None:
+		await self.flush()
+		def _close() -> None:
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+		await self._call(_close)
+		self._executor.shutdown(wait=False)
+
+def create_storage(backend: str, data_file: str, sqlite_file: str, journal: bool = True) -> Storage:
+	"""Создать хранилище по имени бэкенда ("json" или "sqlite")."""
+	backend = (backend or "json").strip().lower()
+	if backend == "sqlite":
+		return SqliteStorage(sqlite_file, migrate_from=data_file)
+	if backend != "json":
+		log.warning("Unknown STORAGE_BACKEND=%s — falling back to json", backend)
+	return JsonStorage(data_file, journal=journal)
+
+
+
+
+
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator, Callable, Awaitable
+import os
+import copy
+import time
+import json
+import logging
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from state import current_chat
+from polls import PollRegistry
+from scheduling import ScheduleEngine
+from persistence import SaveCoordinator
+from storage import Storage
+from metrics import SAVE_SECONDS, SAVE_FAILURES
+import duels
+
+log = logging.getLogger("bot")
+
+def tenant_path(path: str, chat_id: int, is_default: bool) -> str:
+	"""Файл данных чата: у основного чата — как раньше, у остальных — с chat_id в имени."""
+	if is_default:
+		return path
+	root, ext = os.path.splitext(path)
+	return f"{root}.{chat_id}{ext}"
+
+class Tenant:
+	"""Одна футбольная группа: расписание опросов, активные опросы, статистика, дуэли и своё хранилище."""
+
+	def __init__(self, chat_id: int, polls_config: List[Dict[str, Any]], storage: Storage, save_debounce: float = 2.0) -> None:
+		self.chat_id = chat_id
+		self.polls_config = polls_config
+		self.active_polls = PollRegistry()
+		self.stats: Dict[str, Any] = {}
+		self.disabled_days: set = set()
+		self.questionable_reminders_enabled = True
+		self.storage = storage
+		self.saver = SaveCoordinator(self._write_state, debounce=save_debounce)
+		self.duels = duels.state_for(chat_id)
+		self.duels.persist_cb = self.record
+		# Источник читается при каждом пересчёте: load() заменяет disabled_days новым множеством
+		self.schedule = ScheduleEngine(lambda: (self.polls_config, self.disabled_days))
+
+	def snapshot(self) -> tuple:
+		return self.active_polls, self.stats, self.disabled_days, self.questionable_reminders_enabled, self.duels.export()
+
+	async def _write_state(self) -> None:
+		started = time.perf_counter()
+		try:
+			await self.storage.save_all(*self.snapshot())
+		except Exception:
+			SAVE_FAILURES.inc(chat=self.chat_id)
+			raise
+		SAVE_SECONDS.observe(time.perf_counter() - started, chat=self.chat_id)
+		log.debug("Data saved for chat %s (%s)", self.chat_id, type(self.storage).__name__)
+
+	def record(self, op: str, **fields: Any) -> None:
+		"""Зафиксировать изменение: инкрементально, а если хранилище не умеет — полным сохранением."""
+		if self.storage.incremental:
+			self.storage.record(op, **fields)
+		else:
+			self.saver.mark_dirty()
+
+	async def load(self) -> None:
+		ap, st, dd, qrem, duel_state = await self.storage.load()
+		self.active_polls = PollRegistry(ap)
+		self.stats = st
+		self.disabled_days = set(dd)
+		self.questionable_reminders_enabled = bool(qrem)
+		self.duels.restore(duel_state)
+
+	def start(self) -> None:
+		"""Запустить фоновые задачи хранилища в текущем event loop."""
+		self.storage.start(self.snapshot)
+		self.saver.start()
+
+	async def flush(self) -> None:
+		await self.saver.flush()
+		await self.storage.flush()
+
+	async def close(self) -> None:
+		await self.saver.close()
+		await self.storage.close()
+
+class TenantRegistry:
+	"""Все обслуживаемые группы: поиск по chat_id и по poll_id — O(1)."""
+
+	def __init__(self) -> None:
+		self.by_chat: Dict[int, Tenant] = {}
+		self.by_poll: Dict[str, Tenant] = {}
+		self.default: Optional[Tenant] = None
+
+	def __iter__(self) -> Iterator[Tenant]:
+		return iter(list(self.by_chat.values()))
+
+	def __len__(self) -> int:
+		return len(self.by_chat)
+
+	def add(self, tenant: Tenant) -> None:
+		self.by_chat[tenant.chat_id] = tenant
+		if self.default is None:
+			self.default = tenant
+
+	def clear(self) -> None:
+		self.by_chat.clear()
+		self.by_poll.clear()
+		self.default = None
+
+	def get(self, chat_id: Optional[int]) -> Optional[Tenant]:
+		return self.by_chat.get(chat_id)
+
+	def resolve(self, chat_id: Optional[int]) -> Optional[Tenant]:
+		"""Группа по chat_id; без чата (задания, запуск) — основная, незнакомый чат — None."""
+		if chat_id is None:
+			return self.default
+		return self.by_chat.get(chat_id)
+
+	def index_polls(self, tenant: Tenant) -> None:
+		for pid in tenant.active_polls:
+			self.by_poll[pid] = tenant
+
+	def register_poll(self, poll_id: str, tenant: Tenant) -> None:
+		self.by_poll[poll_id] = tenant
+
+	def unregister_poll(self, poll_id: str) -> None:
+		self.by_poll.pop(poll_id, None)
+
+	def for_poll(self, poll_id: str) -> Optional[Tenant]:
+		return self.by_poll.get(poll_id)
+
+registry = TenantRegistry()
+
+def current() -> Tenant:
+	"""Группа текущего обновления или задания (см. use/select), иначе основная."""
+	tenant = registry.resolve(current_chat.get())
+	if tenant is None:
+		raise LookupError("No tenants configured")
+	return tenant
+
+def select(tenant: Tenant) -> None:
+	"""Сделать группу текущей до конца текущей asyncio-задачи (для middleware)."""
+	current_chat.set(tenant.chat_id)
+
+@contextmanager
+def use(tenant: Tenant) -> Iterator[Tenant]:
+	"""Временно сделать группу текущей."""
+	token = current_chat.set(tenant.chat_id)
+	try:
+		yield tenant
+	finally:
+		current_chat.reset(token)
+
+async def run_in(tenant: Tenant, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+	"""Выполнить корутину-функцию в контексте группы (для заданий планировщика)."""
+	with use(tenant):
+		return await func(*args, **kwargs)
+
+def load_tenant_configs(path: str, default_chat_id: int, default_polls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	"""Прочитать список групп из JSON-файла: [{"chat_id": ..., "polls": [...]}, ...].
+
+	Без файла — одна основная группа default_chat_id. Группы без "polls" получают копию
+	расписания по умолчанию. Основная группа всегда первая.
+	"""
+	entries: List[Dict[str, Any]] = []
+	if path and os.path.exists(path):
+		with open(path, "r", encoding="utf-8") as f:
+			raw = json.load(f)
+		for item in raw if isinstance(raw, list) else raw.get("chats", []):
+			try:
+				entries.append({"chat_id": int(item["chat_id"]), "polls": item.get("polls") or copy.deepcopy(default_polls)})
+			except (KeyError, TypeError, ValueError):
+				log.warning("Skipping invalid tenant entry in %s: %s", path, item)
+	if not any(e["chat_id"] == default_chat_id for e in entries):
+		entries.insert(0, {"chat_id": default_chat_id, "polls": default_polls})
+	else:
+		entries.sort(key=lambda e: e["chat_id"] != default_chat_id)
+	return entries
+
+class TenantMiddleware(BaseMiddleware):
+	"""Выбирает группу для обновления: по chat.id сообщения или колбэка, по poll_id для ответов в опросах.
+
+	Чаты не из TENANTS_FILE не обслуживаются; личный чат админа (is_admin) работает с основной группой.
+	"""
+
+	def __init__(self, is_admin: Callable[[int], bool]) -> None:
+		super().__init__()
+		self.is_admin = is_admin
+
+	async def on_pre_process_message(self, message: types.Message, data: dict) -> None:
+		self._select_chat(message.chat, message.from_user)
+
+	async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict) -> None:
+		if call.message is not None:
+			self._select_chat(call.message.chat, call.from_user)
+
+	async def on_pre_process_poll_answer(self, poll_answer: types.PollAnswer, data: dict) -> None:
+		tenant = registry.for_poll(poll_answer.poll_id)
+		if tenant is not None:
+			select(tenant)
+
+	def _select_chat(self, chat: types.Chat, user: Optional[types.User]) -> None:
+		tenant = registry.get(chat.id)
+		if tenant is None and chat.type == types.ChatType.PRIVATE and user is not None and self.is_admin(user.id):
+			tenant = registry.default
+		if tenant is None:
+			log.debug("Ignoring update from unconfigured chat %s", chat.id)
+			raise CancelHandler()
+		select(tenant)
+
+
+
+
+
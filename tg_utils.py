@@ -1,28 +1,440 @@
 from __future__ import annotations
 
-from typing import Any, Awaitable, Callable, Optional
+from typing import Any, Awaitable, Callable, Optional, Dict, List, Deque
+from collections import deque
+import os
+import time
 import asyncio
+import logging
 from aiogram.utils import exceptions
+from aiogram.utils.payload import prepare_arg
 
-async def safe_telegram_call(func: Callable[..., Awaitable[Any]], *args: Any, retries: int = 3, **kwargs: Any) -> Optional[Any]:
+from metrics import TG_CALL_SECONDS, TG_RETRIES, TG_FAILURES, TG_QUEUE, TG_DELETE_QUEUE, TG_DELETE_DROPPED, registry as metrics_registry
+
+log = logging.getLogger("bot")
+
+# Приоритеты исходящих вызовов: меньше — важнее
+PRIORITY_HIGH = 0    # создание опроса, итоги
+PRIORITY_NORMAL = 1  # ответы администратору, служебные сообщения
+PRIORITY_LOW = 2     # напоминания, дуэли
+
+# Лимиты Telegram: ~30 запросов/с на бота, ~1 сообщение/с в личку, ~20 сообщений/мин в группу
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_GROUP_PER_MINUTE = float(os.getenv("TG_GROUP_PER_MINUTE", "20"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "5"))
+
+# Удаление сообщений пачками: сколько секунд копить id по чату, лимит deleteMessages и порог backpressure
+DELETE_BATCH_WINDOW = float(os.getenv("DELETE_BATCH_WINDOW", "1.0"))
+DELETE_BATCH_SIZE = 100
+DELETE_QUEUE_MAX = int(os.getenv("DELETE_QUEUE_MAX", "2000"))
+
+class TokenBucket:
+	"""Классический token bucket: rate токенов в секунду, не больше capacity."""
+
+	def __init__(self, rate: float, capacity: float) -> None:
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+		self.blocked_until = 0.0  # пауза после RetryAfter
+
+	def _refill(self, now: float) -> None:
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def wait_time(self, now: float) -> float:
+		"""Сколько секунд ждать до появления токена (0 — можно отправлять)."""
+		self._refill(now)
+		if now < self.blocked_until:
+			return self.blocked_until - now
+		if self.tokens >= 1:
+			return 0.0
+		return (1 - self.tokens) / self.rate
+
+	def consume(self) -> None:
+		self.tokens -= 1
+
+	def block(self, now: float, seconds: float) -> None:
+		self.blocked_until = max(self.blocked_until, now + seconds)
+		self.tokens = 0
+
+class _OutboundRequest:
+	__slots__ = ("func", "args", "kwargs", "chat_id", "priority", "future", "attempt", "retries", "not_before")
+
+	def __init__(self, func: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict, chat_id: Any, priority: int, retries: int, future: asyncio.Future) -> None:
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.chat_id = chat_id
+		self.priority = priority
+		self.future = future
+		self.attempt = 0
+		self.retries = retries
+		self.not_before = 0.0
+
+class OutboundDispatcher:
+	"""Центральная очередь исходящих вызовов Telegram API.
+
+	Общий token bucket на бота и по одному на чат (для отправки сообщений) не дают упереться во flood control;
+	очереди по приоритетам пропускают опросы и итоги вперёд напоминаний и дуэлей.
+	Вызывающий получает future с результатом (или None после исчерпания попыток).
+	"""
+
+	def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE, group_per_minute: float = TG_GROUP_PER_MINUTE, chat_burst: float = TG_CHAT_BURST) -> None:
+		self.global_bucket = TokenBucket(global_rate, global_rate)
+		self.chat_rate = chat_rate
+		self.group_rate = group_per_minute / 60.0
+		self.chat_burst = chat_burst
+		self._chat_buckets: Dict[Any, TokenBucket] = {}
+		self._lanes: List[Deque[_OutboundRequest]] = [deque() for _ in range(PRIORITY_LOW + 1)]
+		self._wakeup: Optional[asyncio.Event] = None
+		self._task: Optional[asyncio.Task] = None
+		self._inflight: set = set()
+
+	@property
+	def running(self) -> bool:
+		return self._task is not None and not self._task.done()
+
+	def pending(self) -> int:
+		return sum(len(lane) for lane in self._lanes)
+
+	def _chat_bucket(self, chat_id: Any) -> Optional[TokenBucket]:
+		if chat_id is None:
+			return None
+		bucket = self._chat_buckets.get(chat_id)
+		if bucket is None:
+			is_group = isinstance(chat_id, int) and chat_id < 0
+			bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.chat_burst)
+			self._chat_buckets[chat_id] = bucket
+		return bucket
+
+	def start(self) -> None:
+		"""Запустить диспетчер в текущем event loop."""
+		self._wakeup = asyncio.Event()
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		"""Остановить диспетчер; незавершённые запросы получают None."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except (asyncio.CancelledError, Exception):
+				pass
+			self._task = None
+		for lane in self._lanes:
+			while lane:
+				req = lane.popleft()
+				if not req.future.done():
+					req.future.set_result(None)
+
+	def submit(self, func: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict, chat_id: Any = None, priority: int = PRIORITY_NORMAL, retries: int = 3) -> asyncio.Future:
+		"""Поставить вызов в очередь; возвращает future с результатом."""
+		future = asyncio.get_running_loop().create_future()
+		priority = min(max(int(priority), PRIORITY_HIGH), PRIORITY_LOW)
+		self._lanes[priority].append(_OutboundRequest(func, args, kwargs, chat_id, priority, retries, future))
+		if self._wakeup is not None:
+			self._wakeup.set()
+		return future
+
+	def _pick(self, now: float) -> tuple:
+		"""Найти первый готовый к отправке запрос с учётом приоритета; иначе — время ожидания."""
+		global_wait = self.global_bucket.wait_time(now)
+		if global_wait > 0:
+			return None, global_wait
+		min_wait: Optional[float] = None
+		for lane in self._lanes:
+			for idx, req in enumerate(lane):
+				wait = max(req.not_before - now, 0.0)
+				bucket = self._chat_bucket(req.chat_id)
+				if bucket is not None:
+					wait = max(wait, bucket.wait_time(now))
+				if wait <= 0:
+					del lane[idx]
+					return req, 0.0
+				min_wait = wait if min_wait is None else min(min_wait, wait)
+		return None, min_wait
+
+	async def _run(self) -> None:
+		while True:
+			self._wakeup.clear()
+			req, wait = self._pick(time.monotonic())
+			if req is not None:
+				self.global_bucket.consume()
+				bucket = self._chat_bucket(req.chat_id)
+				if bucket is not None:
+					bucket.consume()
+				task = asyncio.create_task(self._execute(req))
+				self._inflight.add(task)
+				task.add_done_callback(self._inflight.discard)
+				continue
+			try:
+				if wait is None:
+					await self._wakeup.wait()
+				else:
+					await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+			except asyncio.TimeoutError:
+				pass
+
+	def _requeue(self, req: _OutboundRequest, delay: float) -> None:
+		req.not_before = time.monotonic() + delay
+		# Повтор идёт в начало своей очереди, чтобы не обгоняли более поздние сообщения этого чата
+		self._lanes[req.priority].appendleft(req)
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	async def _execute(self, req: _OutboundRequest) -> None:
+		req.attempt += 1
+		method = _method_name(req.func)
+		started = time.perf_counter()
+		try:
+			result = await req.func(*req.args, **req.kwargs)
+		except exceptions.RetryAfter as e:
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
+			wait = getattr(e, 'timeout', None) or getattr(e, 'retry_after', None) or 1
+			bucket = self._chat_bucket(req.chat_id) or self.global_bucket
+			bucket.block(time.monotonic(), wait + 1)
+			log.warning("Flood control for chat %s: retry in %ss", req.chat_id, wait)
+			if req.attempt < req.retries:
+				TG_RETRIES.inc(method=method, reason="flood")
+				self._requeue(req, wait + 1)
+				return
+			TG_FAILURES.inc(method=method)
+			result = None
+		except Exception:
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
+			if req.attempt < req.retries:
+				TG_RETRIES.inc(method=method, reason="error")
+				self._requeue(req, 1 + req.attempt)
+				return
+			log.warning("Telegram call %s failed after %s attempts", method, req.attempt)
+			TG_FAILURES.inc(method=method)
+			result = None
+		else:
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
+		if not req.future.done():
+			req.future.set_result(result)
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+def _method_name(func: Callable[..., Awaitable[Any]]) -> str:
+	return getattr(func, "__name__", None) or type(func).__name__
+
+def _collect_outbound() -> None:
+	TG_QUEUE.set(_dispatcher.pending() if _dispatcher is not None else 0)
+	TG_DELETE_QUEUE.set(_delete_queue.pending() if _delete_queue is not None else 0)
+
+metrics_registry.add_collector(_collect_outbound)
+
+def start_outbound_dispatcher(**kwargs: Any) -> OutboundDispatcher:
+	"""Создать и запустить общий диспетчер исходящих вызовов в текущем event loop."""
+	global _dispatcher
+	_dispatcher = OutboundDispatcher(**kwargs)
+	_dispatcher.start()
+	return _dispatcher
+
+async def stop_outbound_dispatcher() -> None:
+	global _dispatcher
+	if _dispatcher is not None:
+		await _dispatcher.stop()
+		_dispatcher = None
+
+class DeleteQueue:
+	"""Фоновое удаление сообщений: id копятся по чатам window секунд и удаляются пачками.
+
+	Пачка уходит одним deleteMessages (до DELETE_BATCH_SIZE id); если Bot API такого метода
+	не знает (MethodNotKnown, 404 или 400 на сам метод) — дальше по одному deleteMessage. Вызовы идут через safe_telegram_call с низким приоритетом.
+	put_nowait() не ждёт никогда: обработчики обновлений возвращаются сразу, а когда в очереди уже
+	max_pending id, новые удаления отбрасываются (с предупреждением в лог и счётчиком в метриках).
+	"""
+
+	def __init__(self, bot: Any, window: float = DELETE_BATCH_WINDOW, max_pending: int = DELETE_QUEUE_MAX) -> None:
+		self.bot = bot
+		self.window = window
+		self.max_pending = max_pending
+		self.bulk = True  # False, если сервер Bot API не знает deleteMessages
+		self._chats: Dict[Any, List[int]] = {}
+		self._first: Dict[Any, float] = {}  # chat_id -> когда в пачку попал первый id
+		self._pending = 0
+		self._overflow = False  # Очередь переполнена, удаления отбрасываются
+		self._wakeup: Optional[asyncio.Event] = None
+		self._task: Optional[asyncio.Task] = None
+
+	@property
+	def running(self) -> bool:
+		return self._task is not None and not self._task.done()
+
+	def pending(self) -> int:
+		return self._pending
+
+	def start(self) -> None:
+		"""Запустить очередь в текущем event loop."""
+		self._wakeup = asyncio.Event()
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		"""Остановить очередь, удалив то, что успело накопиться."""
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except (asyncio.CancelledError, Exception):
+				pass
+			self._task = None
+		for chat_id in list(self._chats):
+			await self._flush(chat_id)
+
+	def put_nowait(self, chat_id: Any, message_id: int) -> bool:
+		"""Поставить сообщение на удаление; False — очередь переполнена и удаление отброшено."""
+		if self._pending >= self.max_pending:
+			TG_DELETE_DROPPED.inc()
+			if not self._overflow:
+				self._overflow = True
+				log.warning("Delete queue is full (%s messages); dropping deletions until it drains", self._pending)
+			return False
+		ids = self._chats.get(chat_id)
+		if ids is None:
+			ids = self._chats[chat_id] = []
+			self._first[chat_id] = time.monotonic()
+		ids.append(int(message_id))
+		self._pending += 1
+		# Полная пачка уходит сразу, не дожидаясь окна
+		if len(ids) == 1 or len(ids) >= DELETE_BATCH_SIZE:
+			self._wakeup.set()
+		return True
+
+	async def delete_messages(self, chat_id: Any, message_ids: List[int]) -> Any:
+		"""deleteMessages (Bot API 7.0; в aiogram 2 метода нет — вызываем напрямую)."""
+		try:
+			return await self.bot.request("deleteMessages", {"chat_id": chat_id, "message_ids": prepare_arg(message_ids)})
+		except exceptions.MessageError as e:
+			if not isinstance(e, exceptions.MessageIdentifierNotSpecified):
+				# Пачку отклонили из-за отдельных сообщений — её удалим по одному, сам метод работает
+				return False
+			error = e
+		except (exceptions.NotFound, exceptions.BadRequest) as e:
+			# Сервер без deleteMessages отвечает 404 «Not Found» (не MethodNotKnown) или 400 без message_ids
+			error = e
+		log.warning("deleteMessages is not supported by the Bot API server (%s); deleting messages one by one", error)
+		self.bulk = False
+		return False
+
+	async def _flush(self, chat_id: Any) -> None:
+		ids = self._chats.pop(chat_id, [])
+		first = self._first.pop(chat_id, None)
+		done = kept = 0
+		try:
+			for start in range(0, len(ids), DELETE_BATCH_SIZE):
+				batch = ids[start:start + DELETE_BATCH_SIZE]
+				if self.bulk and len(batch) > 1 and await safe_telegram_call(self.delete_messages, chat_id, batch, retries=2, priority=PRIORITY_LOW):
+					done += len(batch)
+					continue
+				for message_id in batch:
+					await safe_telegram_call(self.bot.delete_message, chat_id, message_id, retries=1, priority=PRIORITY_LOW)
+					done += 1
+		except asyncio.CancelledError:
+			# Отмена посреди пачки (stop()): неудалённые id возвращаем в очередь, stop() их дочистит
+			rest = ids[done:]
+			kept = len(rest)
+			self._chats[chat_id] = rest + self._chats.get(chat_id, [])
+			self._first[chat_id] = min(first if first is not None else time.monotonic(), self._first.get(chat_id, float("inf")))
+			raise
+		finally:
+			self._pending -= len(ids) - kept
+			if self._overflow and self._pending < self.max_pending:
+				self._overflow = False
+				log.info("Delete queue has room again (%s messages pending)", self._pending)
+
+	async def _run(self) -> None:
+		while True:
+			self._wakeup.clear()
+			now = time.monotonic()
+			due = [chat_id for chat_id, first in self._first.items() if now - first >= self.window or len(self._chats[chat_id]) >= DELETE_BATCH_SIZE]
+			for chat_id in due:
+				try:
+					await self._flush(chat_id)
+				except Exception:
+					log.exception("Failed to delete queued messages in chat %s", chat_id)
+			if due:
+				continue
+			wait = min((first + self.window - now for first in self._first.values()), default=None)
+			try:
+				if wait is None:
+					await self._wakeup.wait()
+				else:
+					await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+			except asyncio.TimeoutError:
+				pass
+
+_delete_queue: Optional[DeleteQueue] = None
+
+def start_delete_queue(bot: Any, **kwargs: Any) -> DeleteQueue:
+	"""Создать и запустить общую очередь удаления сообщений в текущем event loop."""
+	global _delete_queue
+	_delete_queue = DeleteQueue(bot, **kwargs)
+	_delete_queue.start()
+	return _delete_queue
+
+async def stop_delete_queue() -> None:
+	global _delete_queue
+	if _delete_queue is not None:
+		await _delete_queue.stop()
+		_delete_queue = None
+
+async def queue_delete(bot: Any, chat_id: Any, message_id: int) -> None:
+	"""Удалить сообщение через очередь (пачками, не ожидая); без запущенной очереди — сразу."""
+	if _delete_queue is not None and _delete_queue.running:
+		_delete_queue.put_nowait(chat_id, message_id)
+		return
+	await safe_telegram_call(bot.delete_message, chat_id, message_id, retries=1, priority=PRIORITY_LOW)
+
+def _extract_chat_id(args: tuple, kwargs: dict) -> Any:
+	if "chat_id" in kwargs:
+		return kwargs["chat_id"]
+	if args and isinstance(args[0], (int, str)):
+		return args[0]
+	return None
+
+# Лимит Telegram «сообщений в чат» касается только отправки; ограничения, удаления, пины и правки
+# идут только через общий лимит бота, иначе они съедают токены чата и задерживают сообщения
+_POSTING_PREFIXES = ("send_", "forward_", "copy_")
+
+def _rate_limited_chat(func: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict) -> Any:
+	"""chat_id для поминутного лимита чата — только у методов, которые публикуют сообщения."""
+	if not _method_name(func).startswith(_POSTING_PREFIXES):
+		return None
+	return _extract_chat_id(args, kwargs)
+
+async def safe_telegram_call(func: Callable[..., Awaitable[Any]], *args: Any, retries: int = 3, priority: int = PRIORITY_NORMAL, **kwargs: Any) -> Optional[Any]:
 	"""Надёжный вызов методов Telegram API с повторными попытками.
 
-	Обрабатывает FloodWait/RetryAfter и временные ошибки. Возвращает результат или None.
+	Если запущен OutboundDispatcher, вызов проходит через его очередь с учётом лимитов
+	и приоритета; иначе выполняется сразу. Обрабатывает FloodWait/RetryAfter и временные
+	ошибки. Возвращает результат или None.
 	"""
+	if _dispatcher is not None and _dispatcher.running:
+		return await _dispatcher.submit(func, args, kwargs, _rate_limited_chat(func, args, kwargs), priority, retries)
+	method = _method_name(func)
 	for attempt in range(1, retries + 1):
+		started = time.perf_counter()
 		try:
-			return await func(*args, **kwargs)
+			result = await func(*args, **kwargs)
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
+			return result
 		except exceptions.RetryAfter as e:
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
 			wait = getattr(e, 'timeout', None) or getattr(e, 'retry_after', None) or 1
+			TG_RETRIES.inc(method=method, reason="flood")
 			await asyncio.sleep(wait + 1)
-		except exceptions.TelegramAPIError:
-			if attempt == retries:
-				return None
-			await asyncio.sleep(1 + attempt)
 		except Exception:
+			TG_CALL_SECONDS.observe(time.perf_counter() - started, method=method)
 			if attempt == retries:
+				TG_FAILURES.inc(method=method)
 				return None
+			TG_RETRIES.inc(method=method, reason="error")
 			await asyncio.sleep(1 + attempt)
+	TG_FAILURES.inc(method=method)
 	return None
 
 
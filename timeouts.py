@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from typing import Dict, Any, List, Tuple, Optional, Callable, Awaitable
+import heapq
+import asyncio
+import logging
+
+import clock
+
+log = logging.getLogger("bot")
+
+class TimeoutManager:
+	"""Менеджер таймаутов пользователей: min-heap дедлайнов и одна спящая задача в event loop.
+
+	Вставка — O(log n), отмена — O(1) (устаревшие элементы кучи отбрасываются лениво),
+	проверка «в таймауте ли пользователь» — O(1) по словарю deadlines.
+	"""
+
+	def __init__(self, on_expire: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None, now_fn: Callable[[], float] = clock.time) -> None:
+		self.on_expire = on_expire
+		self.now_fn = now_fn
+		self.deadlines: Dict[str, float] = {}  # user_id -> timestamp окончания
+		self.payloads: Dict[str, Dict[str, Any]] = {}  # user_id -> данные для уведомления (chat_id, name)
+		self._heap: List[Tuple[float, int, str]] = []
+		self._seq = 0
+		self._wakeup: Optional[asyncio.Event] = None
+		self._task: Optional[asyncio.Task] = None
+
+	def __len__(self) -> int:
+		return len(self.deadlines)
+
+	def __contains__(self, uid: object) -> bool:
+		return uid in self.deadlines
+
+	def set(self, uid: str, until: float, payload: Optional[Dict[str, Any]] = None) -> None:
+		"""Установить (или продлить/сократить) таймаут пользователя до until."""
+		uid = str(uid)
+		earliest = self._heap[0][0] if self._heap else None
+		self.deadlines[uid] = until
+		self.payloads[uid] = dict(payload or {})
+		self._seq += 1
+		heapq.heappush(self._heap, (until, self._seq, uid))
+		# Будим задачу, только если новый дедлайн раньше текущего ближайшего
+		if self._wakeup is not None and (earliest is None or until < earliest):
+			self._wakeup.set()
+
+	def cancel(self, uid: str) -> bool:
+		"""Снять таймаут без уведомления. Возвращает True, если он был."""
+		uid = str(uid)
+		self.payloads.pop(uid, None)
+		existed = self.deadlines.pop(uid, None) is not None
+		# Куча чистится лениво; если мусора слишком много — перестраиваем
+		if existed and len(self._heap) > 64 and len(self._heap) > 2 * len(self.deadlines):
+			self._heap = [(until, seq, u) for until, seq, u in self._heap if self.deadlines.get(u) == until]
+			heapq.heapify(self._heap)
+		return existed
+
+	def is_active(self, uid: str) -> bool:
+		"""Проверить, действует ли таймаут пользователя прямо сейчас."""
+		until = self.deadlines.get(str(uid))
+		return until is not None and self.now_fn() < until
+
+	def get(self, uid: str) -> Optional[float]:
+		return self.deadlines.get(str(uid))
+
+	def next_deadline(self) -> Optional[float]:
+		"""Ближайший действующий дедлайн (или None)."""
+		return min(self.deadlines.values()) if self.deadlines else None
+
+	def wake(self) -> None:
+		"""Заново проверить дедлайны сейчас — например, после перевода часов (см. clock)."""
+		if self._wakeup is not None:
+			self._wakeup.set()
+
+	def _pop_due(self, now: float) -> List[Tuple[str, Dict[str, Any]]]:
+		due = []
+		while self._heap and self._heap[0][0] <= now:
+			until, _, uid = heapq.heappop(self._heap)
+			# Элемент устарел: таймаут снят или перезаписан другим дедлайном
+			if self.deadlines.get(uid) != until:
+				continue
+			self.deadlines.pop(uid, None)
+			due.append((uid, self.payloads.pop(uid, {})))
+		return due
+
+	def start(self) -> None:
+		"""Запустить задачу истечения таймаутов в текущем event loop."""
+		self._wakeup = asyncio.Event()
+		self._task = asyncio.create_task(self._run())
+
+	async def stop(self) -> None:
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except (asyncio.CancelledError, Exception):
+				pass
+			self._task = None
+
+	async def _run(self) -> None:
+		while True:
+			self._wakeup.clear()
+			for uid, payload in self._pop_due(self.now_fn()):
+				if self.on_expire is None:
+					continue
+				try:
+					await self.on_expire(uid, payload)
+				except Exception:
+					log.exception("Timeout expiry handler failed for user %s", uid)
+			delay = self._heap[0][0] - self.now_fn() if self._heap else None
+			try:
+				if delay is None:
+					await self._wakeup.wait()
+				elif delay > 0:
+					await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+			except asyncio.TimeoutError:
+				pass
+
+
+
+
+
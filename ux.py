@@ -1,14 +1,17 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-def format_status_overview(poll_data: Dict[str, Any]) -> str:
+from polls import PollTally, CATEGORY_YES, CATEGORY_NO, CATEGORY_MAYBE
+
+def format_status_overview(poll_data: Dict[str, Any], tally: Optional[PollTally] = None) -> str:
 	"""Return a header line with emoji counts for Yes/No/Maybe.
 
-	Yes identified by answer starting with 'Да', No by 'Нет', Maybe by 'под вопросом' substring.
+	Counts come from the poll's live tally (categories are resolved once, see polls.categorize_answer).
 	"""
-	votes = poll_data.get("votes", {})
-	yes = sum(1 for v in votes.values() if str(v.get("answer", "")).startswith("Да"))
-	no = sum(1 for v in votes.values() if str(v.get("answer", "")).startswith("Нет"))
-	maybe = sum(1 for v in votes.values() if "вопрос" in str(v.get("answer", "")).lower())
+	if tally is None:
+		tally = PollTally(poll_data.get("votes", {}))
+	yes = tally.count(CATEGORY_YES)
+	no = tally.count(CATEGORY_NO)
+	maybe = tally.count(CATEGORY_MAYBE)
 	return f"✅ Да: {yes}    ❌ Нет: {no}    ❔ Под вопросом: {maybe}\n\n"
 
 
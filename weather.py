@@ -1,8 +1,15 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
+import time
+import asyncio
+import logging
 import aiohttp
 
+log = logging.getLogger("bot")
+
+FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+
 WEATHER_MESSAGES = {
 	'clear': [
 		"🌞 Ну что, классика — солнце, мяч, поле! Плохая погода? Не, не слышали.",
@@ -77,23 +84,11 @@ def pick_weather_message(description: str) -> str:
 	import random as _rnd
 	return _rnd.choice(WEATHER_MESSAGES[cat])
 
-async def get_weather_forecast(target_iso_city: str, api_key: str, target_dt) -> Optional[str]:
-	"""Запрашивает краткий прогноз погоды с OpenWeather для города target_iso_city.
-
-	Возвращает строку вида "Описание, t°C (ощущается t°C), ветер м/с" или None при ошибке/отсутствии данных.
-	"""
-	if not api_key:
+def format_forecast(data: Dict[str, Any], target_dt) -> Optional[str]:
+	"""Выбрать из 5-дневного прогноза запись, ближайшую к target_dt, и оформить строкой."""
+	if not data or not data.get("list"):
 		return None
 	try:
-		url = f"https://api.openweathermap.org/data/2.5/forecast?q={target_iso_city}&appid={api_key}&units=metric&lang=ru"
-		async with aiohttp.ClientSession() as session:
-			async with session.get(url, timeout=10) as resp:
-				if resp.status != 200:
-					return None
-				data = await resp.json()
-		if not data.get("list"):
-			return None
-		import math
 		target_ts = int(target_dt.timestamp())
 		best = min(data["list"], key=lambda e: abs(e["dt"] - target_ts))
 		temp = best["main"]["temp"]
@@ -104,7 +99,125 @@ async def get_weather_forecast(target_iso_city: str, api_key: str, target_dt) ->
 	except Exception:
 		return None
 
+class WeatherClient:
+	"""Клиент OpenWeather с одной долгоживущей сессией и кэшем прогнозов по городу.
+
+	Свежий прогноз (моложе ttl) отдаётся из памяти. Устаревший, но не старше stale_ttl,
+	тоже отдаётся сразу, а обновление уходит в фон (stale-while-revalidate).
+	Параллельные запросы одного города схлопываются в один HTTP-запрос.
+	"""
+
+	def __init__(self, api_key: str, ttl: float = 1800.0, stale_ttl: float = 6 * 3600.0, timeout: float = 10.0) -> None:
+		self.api_key = api_key
+		self.ttl = ttl
+		self.stale_ttl = stale_ttl
+		self.timeout = timeout
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # город -> (время получения, ответ)
+		self._inflight: Dict[str, asyncio.Task] = {}
+		# Счётчики чтений: hit — свежий кэш, stale — устаревший кэш, miss — пришлось идти в сеть
+		# (или, при cache_only, прогноза не было); fetch/fetch_error — HTTP-запросы
+		self.stats: Dict[str, int] = {"hit": 0, "stale": 0, "miss": 0, "fetch": 0, "fetch_error": 0}
+
+	def _get_session(self) -> aiohttp.ClientSession:
+		if self._session is None or self._session.closed:
+			connector = aiohttp.TCPConnector(limit=10, ttl_dns_cache=300)
+			self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+		return self._session
+
+	async def _fetch(self, city: str) -> Optional[Dict[str, Any]]:
+		if not self.api_key:
+			# Без ключа OpenWeather всё равно ответит 401 — не ходим в сеть
+			return None
+		params = {"q": city, "appid": self.api_key, "units": "metric", "lang": "ru"}
+		self.stats["fetch"] += 1
+		try:
+			async with self._get_session().get(FORECAST_URL, params=params) as resp:
+				if resp.status != 200:
+					log.warning("OpenWeather returned %s for %s", resp.status, city)
+					self.stats["fetch_error"] += 1
+					return None
+				data = await resp.json()
+		except Exception as e:
+			log.warning("OpenWeather request failed for %s: %s", city, e)
+			self.stats["fetch_error"] += 1
+			return None
+		if not data.get("list"):
+			self.stats["fetch_error"] += 1
+			return None
+		self._cache[city] = (time.monotonic(), data)
+		return data
+
+	def _refresh(self, city: str) -> asyncio.Task:
+		"""Запустить загрузку прогноза, если она ещё не идёт, и вернуть её задачу."""
+		task = self._inflight.get(city)
+		if task is None or task.done():
+			task = asyncio.create_task(self._fetch(city))
+			self._inflight[city] = task
+			task.add_done_callback(lambda t, c=city: self._inflight.pop(c, None) if self._inflight.get(c) is t else None)
+		return task
+
+	def cached(self, city: str) -> Optional[Dict[str, Any]]:
+		"""Прогноз из памяти без сетевых запросов (None, если нет или слишком старый)."""
+		entry = self._cache.get(city)
+		if entry is None or time.monotonic() - entry[0] >= self.stale_ttl:
+			return None
+		return entry[1]
+
+	async def get_forecast_data(self, city: str, cache_only: bool = False) -> Optional[Dict[str, Any]]:
+		"""Полный ответ /forecast для города с учётом кэша.
+
+		При cache_only=True сеть не ожидается никогда: при промахе загрузка уходит в фон,
+		а вызывающий сразу получает None.
+		"""
+		if not self.api_key:
+			return None
+		entry = self._cache.get(city)
+		if entry is not None:
+			age = time.monotonic() - entry[0]
+			if age < self.ttl:
+				self.stats["hit"] += 1
+				return entry[1]
+			if age < self.stale_ttl:
+				self.stats["stale"] += 1
+				self._refresh(city)
+				return entry[1]
+		self.stats["miss"] += 1
+		log.info("Weather cache miss for %s%s", city, " (refreshing in background)" if cache_only else "")
+		task = self._refresh(city)
+		if cache_only:
+			return None
+		return await asyncio.shield(task)
+
+	async def prefetch(self, city: str) -> bool:
+		"""Прогреть кэш: загрузить прогноз, если в памяти нет свежего. Возвращает успех."""
+		entry = self._cache.get(city)
+		if entry is not None and time.monotonic() - entry[0] < self.ttl:
+			return True
+		return await asyncio.shield(self._refresh(city)) is not None
 
+	async def get_forecast(self, city: str, target_dt, cache_only: bool = False) -> Optional[str]:
+		"""Краткий прогноз на момент target_dt (см. format_forecast)."""
+		return format_forecast(await self.get_forecast_data(city, cache_only=cache_only), target_dt)
 
+	async def close(self) -> None:
+		for task in list(self._inflight.values()):
+			task.cancel()
+		self._inflight.clear()
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+		self._session = None
 
+async def get_weather_forecast(target_iso_city: str, api_key: str, target_dt) -> Optional[str]:
+	"""Запрашивает краткий прогноз погоды с OpenWeather для города target_iso_city.
 
+	Разовый запрос без общего кэша; в боте используется WeatherClient.
+	Возвращает строку вида "Описание, t°C (ощущается t°C), ветер м/с" или None при ошибке/отсутствии данных.
+	"""
+	if not api_key:
+		return None
+	client = WeatherClient(api_key)
+	try:
+		return await client.get_forecast(target_iso_city, target_dt)
+	finally:
+		await client.close()